@@ -1,25 +1,34 @@
-from app.controller.deployment_controller import DeploymentController, DeployRequest, UndeployRequest
+from app.controller.batching import BatchingConfig
+from app.controller.session_config import SessionConfig, parse_session_config
+from app.controller.result_cache import ResultCacheConfig
+from app.controller.profiling_controller import ProfilingConfig
+from app.controller.deployment_controller import ConcurrencyConfig, DeploymentController, DeployRequest, UndeployRequest
 from app.controller.upload_controller import UploadController
+from app.controller.variant_controller import COMPARE_RUNS, CompareRequest, DefaultVariantRequest, VariantController, VariantsRequest
 from app.controller.database import get_db_controller, DatabaseController
+from app.util.admin import require_admin
 from app.util.errors import ErrorWithStatusCode
+from app.util.model_variants import parse_variants
 from bson import ObjectId
-from fastapi import FastAPI, File, HTTPException, UploadFile, Depends
+from typing import List, Optional
+from fastapi import BackgroundTasks, FastAPI, File, Form, HTTPException, UploadFile, Depends
 
 app = FastAPI()
 
 
 @app.post("/deploy-file/")
-async def deploy_file(file: UploadFile = File(...), db_controller: DatabaseController = Depends(get_db_controller)):
+async def deploy_file(background_tasks: BackgroundTasks, file: UploadFile = File(...), session_config: Optional[str] = Form(None), variants: Optional[str] = Form(None), external_data: Optional[List[UploadFile]] = File(None), db_controller: DatabaseController = Depends(get_db_controller)):
     """
-    Uploads an ONNX model file and initializes an inference session.
+    Uploads an ONNX model file with its external data files, optionally generating the comma separated optimized variants, and initializes an inference session.
     """
     try:
-      uploaded_model = await UploadController(db_controller).upload_file(file)
+      uploaded_model = await UploadController(db_controller).upload_file(file, parse_session_config(session_config), parse_variants(variants) if variants is not None else None, external_data, background_tasks)
       model_name = uploaded_model["name"]
       return await DeploymentController(db_controller).deploy_model(
           DeployRequest(
               model_name=model_name, model_id=uploaded_model["model_id"]
-          )
+          ),
+          background_tasks,
       )
     except ErrorWithStatusCode as e:  
       raise e.as_http_exception()
@@ -28,12 +37,12 @@ async def deploy_file(file: UploadFile = File(...), db_controller: DatabaseContr
 
 
 @app.post("/deploy-model/")
-async def deploy_model(request: DeployRequest, db_controller: DatabaseController = Depends(get_db_controller)):
+async def deploy_model(request: DeployRequest, background_tasks: BackgroundTasks, db_controller: DatabaseController = Depends(get_db_controller)):
     """
-    Deploys an already uploaded model
+    Deploys an already uploaded model and warms it up in the background
     """
     try:
-      return await DeploymentController(db_controller).deploy_model(request)
+      return await DeploymentController(db_controller).deploy_model(request, background_tasks)
     except ErrorWithStatusCode as e:  
       raise e.as_http_exception()
     except Exception as e:
@@ -51,3 +60,131 @@ async def undeploy_model(request: UndeployRequest, db_controller: DatabaseContro
       raise e.as_http_exception()
     except Exception as e:
       raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/promote/{model_name}/{model_version}")
+async def promote_model(model_name: str, model_version: int, background_tasks: BackgroundTasks, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Replaces the deployed version of a model with the given version once it is warmed up, without downtime
+    """
+    try:
+      return await DeploymentController(db_controller).promote_model(model_name, model_version, background_tasks)
+    except ErrorWithStatusCode as e:  
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/promote/{model_name}")
+async def get_promotion(model_name: str, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Reports the state of the latest promotion of a model
+    """
+    try:
+      return await DeploymentController(db_controller).get_promotion(model_name)
+    except ErrorWithStatusCode as e:  
+      raise e.as_http_exception()
+
+
+@app.put("/concurrency/{model_name}/{model_version}")
+async def set_concurrency(model_name: str, model_version: int, config: ConcurrencyConfig, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Sets the maximum number of concurrent and queued inference requests of a model.
+    """
+    try:
+      return await DeploymentController(db_controller).set_concurrency(model_name, model_version, config)
+    except ErrorWithStatusCode as e:  
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.put("/batching/{model_name}/{model_version}")
+async def set_batching(model_name: str, model_version: int, config: BatchingConfig, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Enables or disables micro-batching of concurrent inference requests of a model.
+    """
+    try:
+      return await DeploymentController(db_controller).set_batching(model_name, model_version, config)
+    except ErrorWithStatusCode as e:  
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.put("/session-config/{model_name}/{model_version}")
+async def set_session_config(model_name: str, model_version: int, config: SessionConfig, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Sets the ONNX Runtime session options (thread counts, execution mode, graph optimization level, memory arena) of a model.
+    """
+    try:
+      return await DeploymentController(db_controller).set_session_config(model_name, model_version, config)
+    except ErrorWithStatusCode as e:  
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.put("/result-cache/{model_name}/{model_version}")
+async def set_result_cache(model_name: str, model_version: int, config: ResultCacheConfig, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Enables or disables caching of inference results of a deterministic model, with an optional time to live.
+    """
+    try:
+      return await DeploymentController(db_controller).set_result_cache(model_name, model_version, config)
+    except ErrorWithStatusCode as e:  
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.put("/profiling/{model_name}/{model_version}", dependencies=[Depends(require_admin)])
+async def set_profiling(model_name: str, model_version: int, config: ProfilingConfig, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Enables or disables ONNX Runtime profiling of a sample of the inference requests of a model. Requires the admin token.
+    """
+    try:
+      return await DeploymentController(db_controller).set_profiling(model_name, model_version, config)
+    except ErrorWithStatusCode as e:  
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/variants/{model_name}/{model_version}")
+async def add_variants(model_name: str, model_version: int, request: VariantsRequest, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Generates optimized variants (int8, fp16, optimized) of an uploaded model and stores them next to the original.
+    """
+    try:
+      return await VariantController(db_controller).add_variants(model_name, model_version, request)
+    except ErrorWithStatusCode as e:  
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.put("/variant/{model_name}/{model_version}")
+async def set_default_variant(model_name: str, model_version: int, request: DefaultVariantRequest, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Sets the variant serving the inference requests of a model that do not select one with the 'variant' query parameter.
+    """
+    try:
+      return await VariantController(db_controller).set_default_variant(model_name, model_version, request)
+    except ErrorWithStatusCode as e:  
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/variants/{model_name}/{model_version}/compare")
+async def compare_variants(model_name: str, model_version: int, request: Optional[CompareRequest] = None, runs: int = COMPARE_RUNS, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Compares the latency and the outputs of a model's variants with the original, on the given sample input or one generated from the signature.
+    """
+    try:
+      return await VariantController(db_controller).compare_variants(model_name, model_version, request, runs)
+    except ErrorWithStatusCode as e:  
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
@@ -1,30 +1,261 @@
-from fastapi import FastAPI, Depends, HTTPException
-from app.controller.inference_controller import InferenceController, InferenceRequest
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from app.controller.inference_controller import STREAM_BATCH_SIZE, InferenceController, InferenceRequest
 from app.controller.database import get_db_controller, DatabaseController
-from app.util.errors import ErrorWithStatusCode
+from app.controller.session_cache import get_session_cache, SessionCache
+from app.controller.routing_table import routing_table
+from app.controller.inference_executor import Deadline, inference_executor
+from app.controller.result_cache import result_cache
+from app.controller.artifact_cache import artifact_cache
+from app.controller.model_bundles import bundle_cache
+from app.controller.batching import micro_batcher
+from app.controller.model_states import model_states
+from app.controller.worker_pool import worker_pool
+from app.controller.single_flight import session_loads
+from app.util.admin import is_admin, require_admin
+from app.util.errors import BadRequestError, ErrorWithStatusCode, ForbiddenError, UnsupportedMediaTypeError
+from app.util.json_codec import precision_param, results_response
+from app.util.metrics import inference_stage_seconds, model_labels
+from app.util.ndjson import MEDIA_TYPE_NDJSON, NDJSONStreamingResponse, RequestBody, ndjson_lines
+from app.util.tensor_codec import BINARY_MEDIA_TYPES, MEDIA_TYPE_JSON, accepted_media_type, decode_tensor, media_type, output_names_param, tensor_response
 
 app = FastAPI()
 
-@app.post("/infer/{model_name}")
-async def infer(request: InferenceRequest, model_name, db_controller: DatabaseController = Depends(get_db_controller)):
+PROFILE_HEADER = "X-Nexon-Profile"
+PROFILE_ID_HEADER = "X-Nexon-Profile-Id"
+TIMEOUT_HEADER = "X-Nexon-Timeout-Ms"
+
+# Document the accepted request encodings, as the body is parsed manually
+INFER_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            MEDIA_TYPE_JSON: {"schema": InferenceRequest.model_json_schema()},
+            **{binary_type: {"schema": {"type": "string", "format": "binary"}} for binary_type in BINARY_MEDIA_TYPES},
+        },
+    }
+}
+
+async def run_inference(request: Request, controller: InferenceController, model_name: str, model_version: int = None):
+    """
+    Decodes the request body according to its Content-Type and encodes the results according to the Accept header.
+    Outputs of binary requests are selected with the comma separated 'outputs' query parameter.
+    JSON results are rounded to the number of decimals given by the 'precision' query parameter.
+    Admins profile the request with the X-Nexon-Profile header, the id of the stored profile is returned in X-Nexon-Profile-Id.
+    The 'variant' query parameter selects an optimized variant of the model (int8, fp16, optimized) or the original.
+    The X-Nexon-Timeout-Ms header sets the deadline of the request, see request_deadline.
+    """
+    deadline = request_deadline(request)
+    profile = profile_requested(request)
+    content_type = media_type(request.headers.get("content-type"))
+    accept = accepted_media_type(request.headers.get("accept"))
+    body = await request.body()
+
+    if content_type == MEDIA_TYPE_JSON:
+      try:
+        inference_request = InferenceRequest.model_validate_json(body)
+      except ValidationError as e:
+        raise RequestValidationError(e.errors())
+      inputs = inference_request.inputs if inference_request.inputs is not None else inference_request.input
+      output_names = inference_request.outputs
+    elif content_type in BINARY_MEDIA_TYPES:
+      inputs = decode_tensor(body, content_type, request.headers)
+      output_names = output_names_param(request)
+    else:
+      raise UnsupportedMediaTypeError(f"Unsupported content type '{content_type}'.")
+
+    results = await controller.run_inference(inputs, model_name, model_version, output_names, profile, request.query_params.get("variant"), deadline)
+    model = routing_table.resolve(model_name, model_version) or {"name": model_name, "version": model_version}
+    with inference_stage_seconds.time(**model_labels(model), stage="serialization"):
+      if accept == MEDIA_TYPE_JSON:
+        response = results_response(results, precision_param(request))
+      else:
+        response = tensor_response(results, accept)
+    if controller.profile_id is not None:
+      response.headers[PROFILE_ID_HEADER] = controller.profile_id
+    return response
+
+def request_deadline(request: Request) -> Deadline | None:
+    """
+    Deadline of the request, in milliseconds from its arrival as given by the X-Nexon-Timeout-Ms header.
+    Requests that can not be served in time are rejected with 503 instead of queueing,
+    and their session run is terminated once the deadline passes or the client disconnects.
+    Requests without the header get no deadline, so their runs are not watched.
+    """
+    value = request.headers.get(TIMEOUT_HEADER)
+    if value is None:
+      return None
+    try:
+      timeout_ms = float(value)
+    except ValueError:
+      timeout_ms = None
+    if timeout_ms is None or not 0 < timeout_ms < float("inf"):
+      raise BadRequestError(f"The {TIMEOUT_HEADER} header must be a positive number of milliseconds.")
+    return Deadline(timeout_ms, request.is_disconnected)
+
+def profile_requested(request: Request) -> bool:
+    """
+    Whether the request asks to be profiled with the X-Nexon-Profile header, which requires the admin token.
+    """
+    if request.headers.get(PROFILE_HEADER, "").lower() not in ("1", "true"):
+      return False
+    if not is_admin(request):
+      raise ForbiddenError("Profiling requires the admin token.")
+    return True
+
+STREAM_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {MEDIA_TYPE_NDJSON: {"schema": {"type": "string", "format": "binary"}}},
+    }
+}
+
+@app.post("/infer/{model_name}", openapi_extra=INFER_OPENAPI)
+async def infer(request: Request, model_name, db_controller: DatabaseController = Depends(get_db_controller)):
     """
     Runs inference on the uploaded ONNX model with the given inputs.
     """
     try:
-      return await InferenceController(db_controller).infer(request, model_name)
+      return await run_inference(request, InferenceController(db_controller), model_name)
     except ErrorWithStatusCode as e:
       raise e.as_http_exception()
+    except RequestValidationError:
+      raise
     except Exception as e:
       raise HTTPException(status_code=500, detail=str(e))
     
-@app.post("/infer/{model_name}/{model_version}")
-async def infer_version(request: InferenceRequest, model_name, model_version: int, db_controller: DatabaseController = Depends(get_db_controller)):
+@app.post("/infer/{model_name}/{model_version}", openapi_extra=INFER_OPENAPI)
+async def infer_version(request: Request, model_name, model_version: int, db_controller: DatabaseController = Depends(get_db_controller)):
     """
     Runs inference on the uploaded ONNX model with the given inputs.
     """
     try:
-      return await InferenceController(db_controller).infer(request, model_name, model_version)
+      return await run_inference(request, InferenceController(db_controller), model_name, model_version)
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except RequestValidationError:
+      raise
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+async def stream_inference(request: Request, controller: InferenceController, model_name: str, model_version: int, batch_size: int):
+    try:
+      body = RequestBody(request)
+      results = await controller.stream_inference(ndjson_lines(body.chunks()), model_name, model_version, output_names_param(request), batch_size, body.is_disconnected, precision_param(request), request.query_params.get("variant"))
     except ErrorWithStatusCode as e:
       raise e.as_http_exception()
     except Exception as e:
-      raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+      raise HTTPException(status_code=500, detail=str(e))
+    return NDJSONStreamingResponse(results)
+
+@app.post("/stream/{model_name}", openapi_extra=STREAM_OPENAPI)
+async def stream(request: Request, model_name, batch_size: int = STREAM_BATCH_SIZE, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Runs inference on an NDJSON body of input rows and streams NDJSON results, one line per row.
+    Outputs are selected with the comma separated 'outputs' query parameter, float results are rounded to 'precision' decimals.
+    The 'variant' query parameter selects an optimized variant of the model.
+    """
+    return await stream_inference(request, InferenceController(db_controller), model_name, None, batch_size)
+
+@app.post("/stream/{model_name}/{model_version}", openapi_extra=STREAM_OPENAPI)
+async def stream_version(request: Request, model_name, model_version: int, batch_size: int = STREAM_BATCH_SIZE, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Runs inference on an NDJSON body of input rows and streams NDJSON results, one line per row.
+    Outputs are selected with the comma separated 'outputs' query parameter, float results are rounded to 'precision' decimals.
+    The 'variant' query parameter selects an optimized variant of the model.
+    """
+    return await stream_inference(request, InferenceController(db_controller), model_name, model_version, batch_size)
+
+@app.get("/cache")
+async def get_cache_stats(session_cache: SessionCache = Depends(get_session_cache)):
+    """
+    Returns hit, miss and eviction counters of the inference session cache.
+    """
+    return session_cache.stats()
+
+
+@app.get("/result-cache")
+async def get_result_cache_stats():
+    """
+    Returns hit rates, expirations and evictions of the inference result cache, overall and per model.
+    """
+    return result_cache.stats()
+
+
+@app.get("/artifact-cache")
+async def get_artifact_cache_stats():
+    """
+    Returns hit, miss and eviction counters and the disk usage of the local model file cache,
+    and the hit and miss counters of the materialized models with external data.
+    """
+    return {**artifact_cache.stats(), "bundles": bundle_cache.stats()}
+
+
+@app.put("/cache/pin/{model_name}", dependencies=[Depends(require_admin)])
+async def pin_model(model_name: str, session_cache: SessionCache = Depends(get_session_cache)):
+    """
+    Pins a model so its sessions are never evicted from the cache. Requires the admin token.
+    """
+    session_cache.pin(model_name)
+    return {"message": f"Model '{model_name}' pinned in session cache."}
+
+
+@app.delete("/cache/pin/{model_name}", dependencies=[Depends(require_admin)])
+async def unpin_model(model_name: str, session_cache: SessionCache = Depends(get_session_cache)):
+    """
+    Unpins a model so its sessions can be evicted from the cache again. Requires the admin token.
+    """
+    session_cache.unpin(model_name)
+    return {"message": f"Model '{model_name}' unpinned from session cache."}
+
+
+@app.get("/routes")
+async def get_routes():
+    """
+    Returns the deployed models currently known to the routing table.
+    """
+    return routing_table.stats()
+
+
+@app.get("/executor")
+async def get_executor_stats():
+    """
+    Returns the in-flight, queued and rejected requests per model of the inference thread pool.
+    """
+    return inference_executor.stats()
+
+
+@app.get("/batching")
+async def get_batching_stats():
+    """
+    Returns batch counts and sizes per model with micro-batching enabled.
+    """
+    return micro_batcher.stats()
+
+
+@app.get("/workers")
+async def get_worker_stats():
+    """
+    Returns the health and model assignment of the inference worker processes.
+    """
+    return worker_pool.stats()
+
+
+@app.get("/loads")
+async def get_load_stats():
+    """
+    Returns the model loads in progress and how many requests waited for a load in progress instead of starting their own.
+    """
+    return {"sessions": session_loads.stats(), "workers": worker_pool.loads.stats()}
+
+
+@app.get("/ready")
+async def get_readiness(response: Response):
+    """
+    Reports ready only when all deployed models are loaded and warmed up, otherwise responds with 503.
+    """
+    readiness = model_states.readiness()
+    if not readiness["ready"]:
+      response.status_code = 503
+    return readiness
@@ -0,0 +1,103 @@
+from fastapi import FastAPI, Depends, File, HTTPException, Request, UploadFile
+from fastapi.responses import StreamingResponse
+from app.controller.database import get_db_controller, DatabaseController
+from app.controller.inference_controller import STREAM_BATCH_SIZE
+from app.controller.job_controller import JOB_CHUNK_ROWS, JobController
+from app.util.errors import ErrorWithStatusCode
+from app.util.ndjson import MEDIA_TYPE_NDJSON
+from app.util.tensor_codec import output_names_param
+
+app = FastAPI()
+
+
+@app.post("/{model_name}")
+async def create_job(request: Request, model_name: str, file: UploadFile = File(...), chunk_rows: int = JOB_CHUNK_ROWS, batch_size: int = STREAM_BATCH_SIZE, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Queues a batch inference job scoring an NDJSON file of input rows against the latest deployed version of a model.
+    Outputs are selected with the comma separated 'outputs' query parameter.
+    """
+    try:
+      return await JobController(db_controller).create_job(file, model_name, None, output_names_param(request), chunk_rows, batch_size)
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/{model_name}/{model_version}")
+async def create_job_version(request: Request, model_name: str, model_version: int, file: UploadFile = File(...), chunk_rows: int = JOB_CHUNK_ROWS, batch_size: int = STREAM_BATCH_SIZE, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Queues a batch inference job scoring an NDJSON file of input rows against a deployed model version.
+    Outputs are selected with the comma separated 'outputs' query parameter.
+    """
+    try:
+      return await JobController(db_controller).create_job(file, model_name, model_version, output_names_param(request), chunk_rows, batch_size)
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/")
+async def list_jobs(db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Lists all batch inference jobs, newest first.
+    """
+    try:
+      return await JobController(db_controller).list_jobs()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/{job_id}")
+async def get_job(job_id: str, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Returns the status and progress of a batch inference job.
+    """
+    try:
+      return await JobController(db_controller).get_job(job_id)
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/{job_id}/results")
+async def get_job_results(job_id: str, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Downloads the NDJSON results of a batch inference job, one line per input row.
+    While the job runs, the results of its completed chunks are returned.
+    """
+    try:
+      results = await JobController(db_controller).results(job_id)
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(results, media_type=MEDIA_TYPE_NDJSON, headers={"Content-Disposition": f"attachment; filename=job-{job_id}.ndjson"})
+
+
+@app.put("/{job_id}/cancel")
+async def cancel_job(job_id: str, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Cancels a queued or running batch inference job after its current chunk.
+    """
+    try:
+      return await JobController(db_controller).cancel_job(job_id)
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.delete("/{job_id}")
+async def delete_job(job_id: str, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Deletes a batch inference job with its input and result files.
+    """
+    try:
+      return await JobController(db_controller).delete_job(job_id)
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,60 @@
+from typing import Optional
+from fastapi import FastAPI, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from app.controller.database import get_db_controller, DatabaseController
+from app.controller.profiling_controller import PROFILE_SUMMARY_TOP_N, ProfilingController
+from app.util.admin import require_admin
+from app.util.errors import ErrorWithStatusCode
+
+app = FastAPI(dependencies=[Depends(require_admin)])
+
+
+@app.get("/")
+async def list_profiles(model_name: Optional[str] = None, model_version: Optional[int] = None, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Lists the stored ONNX Runtime profiles, newest first, optionally of one model (version).
+    """
+    try:
+      return await ProfilingController(db_controller).list_profiles(model_name, model_version)
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/{profile_id}")
+async def get_profile(profile_id: str, top_n: int = PROFILE_SUMMARY_TOP_N, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Returns a profile with the top_n operator types and nodes by total kernel time.
+    """
+    try:
+      return await ProfilingController(db_controller).get_profile(profile_id, top_n)
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/{profile_id}/trace")
+async def get_profile_trace(profile_id: str, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Downloads the Chrome trace JSON of a profile.
+    """
+    try:
+      trace = await ProfilingController(db_controller).trace(profile_id)
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(trace, media_type="application/json", headers={"Content-Disposition": f"attachment; filename=profile-{profile_id}.json"})
+
+
+@app.delete("/{profile_id}")
+async def delete_profile(profile_id: str, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Deletes a profile and its trace.
+    """
+    try:
+      return await ProfilingController(db_controller).delete_profile(profile_id)
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
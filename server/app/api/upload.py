@@ -1,18 +1,93 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
+from typing import List, Optional
+from fastapi import BackgroundTasks, FastAPI, File, Form, UploadFile, HTTPException, Depends, Request
+from app.controller.chunked_upload_controller import ChunkedUploadController, CreateUploadRequest
 from app.controller.upload_controller import UploadController
 from app.controller.database import DatabaseController, get_db_controller
+from app.controller.session_config import parse_session_config
 from app.util.errors import ErrorWithStatusCode
+from app.util.model_variants import parse_variants
 
 app = FastAPI()
 
 @app.post("/")
-async def upload_file(file: UploadFile = File(...), db_controller: DatabaseController = Depends(get_db_controller)):
+async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File(...), session_config: Optional[str] = Form(None), variants: Optional[str] = Form(None), external_data: Optional[List[UploadFile]] = File(None), db_controller: DatabaseController = Depends(get_db_controller)):
     """
-    Uploads an ONNX model file
+    Uploads an ONNX model file. The optional session_config form field holds the model's ONNX Runtime session options as JSON,
+    the optional variants form field the comma separated optimized variants to generate (int8, fp16, optimized),
+    which are generated after the response was sent and listed as pending_variants until then.
+    Models with external data are uploaded with one external_data file per referenced file, named as the model references it.
     """
     try:
-      return await UploadController(db_controller).upload_file(file)
+      return await UploadController(db_controller).upload_file(file, parse_session_config(session_config), parse_variants(variants) if variants is not None else None, external_data, background_tasks)
     except ErrorWithStatusCode as e:
-      raise e.to_http_exception()
+      raise e.as_http_exception()
     except Exception as e:
-      raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/chunked")
+async def create_chunked_upload(request: CreateUploadRequest, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Starts a resumable upload of a large ONNX model file. The response holds the upload id and the chunk size to send the file in.
+    The external data files of a model are uploaded with one upload each, created with the model's upload id as model_upload_id
+    and the file's location relative to the model as file_name.
+    """
+    try:
+      return await ChunkedUploadController(db_controller).create_upload(request)
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/chunked/{upload_id}")
+async def get_chunked_upload(upload_id: str, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Reports the state of an upload, including the offsets of the chunks still missing, e.g. to resume it after a dropped connection.
+    """
+    try:
+      return await ChunkedUploadController(db_controller).get_upload(upload_id)
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.put("/chunked/{upload_id}")
+async def put_chunk(upload_id: str, offset: int, request: Request, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Stores the chunk of the file starting at the given offset, sent as raw request body. Chunks can be sent in any order and in parallel.
+    """
+    try:
+      return await ChunkedUploadController(db_controller).put_chunk(upload_id, offset, await request.body())
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/chunked/{upload_id}/finalize")
+async def finalize_chunked_upload(upload_id: str, background_tasks: BackgroundTasks, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Verifies the checksums of a complete upload and of its external data files and registers them as a new version of the model.
+    Variants are generated after the response was sent.
+    """
+    try:
+      return await ChunkedUploadController(db_controller).finalize_upload(upload_id, background_tasks)
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.delete("/chunked/{upload_id}")
+async def abort_chunked_upload(upload_id: str, db_controller: DatabaseController = Depends(get_db_controller)):
+    """
+    Aborts an upload and deletes the chunks received so far, including those of the model's external data files.
+    """
+    try:
+      return await ChunkedUploadController(db_controller).abort_upload(upload_id)
+    except ErrorWithStatusCode as e:
+      raise e.as_http_exception()
+    except Exception as e:
+      raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,220 @@
+from collections import OrderedDict
+from os import environ
+from typing import Awaitable, Callable
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from app.util.metrics import registry
+
+logger = logging.getLogger("uvicorn")
+
+# Directory of the local model file cache. Unset downloads models into memory on every session load.
+ARTIFACT_CACHE_DIR = environ.get("NEXON_ARTIFACT_CACHE_DIR", "")
+# Disk budget of the local model file cache, in megabytes
+ARTIFACT_CACHE_MAX_MB = int(environ.get("NEXON_ARTIFACT_CACHE_MAX_MB", "10240"))
+
+MODEL_FILE_SUFFIX = ".onnx"
+CHECKSUM_FILE_SUFFIX = ".sha256"
+
+
+class ChecksumError(Exception):
+  pass
+
+
+def file_sha256(path: str) -> str:
+  digest = hashlib.sha256()
+  with open(path, "rb") as model_file:
+    for block in iter(lambda: model_file.read(1024 * 1024), b""):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+async def download_to(path: str, grid_out) -> tuple[int, str]:
+  """
+  Streams a GridFS file chunk by chunk to a temporary file next to path and renames it into place once its size
+  and the SHA-256 checksum in its metadata, if any, are verified. Returns the size and checksum of the file.
+  """
+  digest = hashlib.sha256()
+  size = 0
+  descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}-", suffix=".part")
+  try:
+    with os.fdopen(descriptor, "wb") as temp_file:
+      async for chunk in grid_out:
+        digest.update(chunk)
+        size += len(chunk)
+        await asyncio.to_thread(temp_file.write, chunk)
+    checksum = digest.hexdigest()
+    expected_checksum = (grid_out.metadata or {}).get("sha256")
+    if size != grid_out.length:
+      raise ChecksumError(f"Downloaded {size} of {grid_out.length} bytes of {os.path.basename(path)}.")
+    if expected_checksum is not None and checksum != expected_checksum:
+      raise ChecksumError(f"{os.path.basename(path)} has the checksum {checksum}, expected {expected_checksum}.")
+    os.replace(temp_path, path)
+  except BaseException:
+    if os.path.exists(temp_path):
+      os.remove(temp_path)
+    raise
+  return size, checksum
+
+
+class CachedArtifact():
+  def __init__(self, file_id: str, size: int, verified: bool):
+    self.file_id = file_id
+    self.size = size
+    self.verified = verified
+
+
+class ArtifactCache():
+  """
+  Local disk cache of model files keyed by GridFS file id, so sessions are built from a file path
+  instead of a copy of the model in memory, and reloads after an eviction or a restart skip the download.
+  Files are streamed chunk by chunk from GridFS to a temporary file and renamed into place once their size
+  and SHA-256 checksum are verified, so a crash never leaves a partial model behind.
+  The checksum is stored next to each file and verified again on the first use after a restart.
+  Files are evicted least recently used first once their combined size exceeds the disk budget.
+  """
+  def __init__(self, directory: str, max_bytes: int):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.entries: OrderedDict[str, CachedArtifact] = OrderedDict()
+    self.total_bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.lock = threading.Lock()
+    self.scanned = False
+
+  @property
+  def enabled(self) -> bool:
+    return bool(self.directory)
+
+  def model_path(self, file_id: str) -> str:
+    return os.path.join(self.directory, f"{file_id}{MODEL_FILE_SUFFIX}")
+
+  async def path(self, file_id: str, open_download_stream: Callable[[], Awaitable]) -> str:
+    """
+    Returns the path of the cached model file, downloading it with the given coroutine function on a miss.
+    """
+    file_id = str(file_id)
+    self._scan()
+    with self.lock:
+      entry = self.entries.get(file_id)
+      if entry is not None:
+        self.entries.move_to_end(file_id)
+    if entry is not None and not entry.verified:
+      entry.verified = await asyncio.to_thread(self._verify, file_id)
+      if not entry.verified:
+        logger.warning(f"Cached model file {file_id} does not match its checksum, downloading it again.")
+        self.remove(file_id)
+        entry = None
+    if entry is not None:
+      with self.lock:
+        self.hits += 1
+      return self.model_path(file_id)
+
+    with self.lock:
+      self.misses += 1
+    size = await self._download(file_id, await open_download_stream())
+    with self.lock:
+      # A concurrent download of the same file may have replaced it already
+      previous = self.entries.pop(file_id, None)
+      if previous is not None:
+        self.total_bytes -= previous.size
+      self.entries[file_id] = CachedArtifact(file_id, size, True)
+      self.total_bytes += size
+      self._evict(keep=file_id)
+    return self.model_path(file_id)
+
+  def remove(self, file_id: str):
+    """
+    Deletes the cached file of a model file that was deleted from GridFS.
+    """
+    with self.lock:
+      self._remove(str(file_id))
+
+  def clear(self):
+    with self.lock:
+      for file_id in list(self.entries):
+        self._remove(file_id)
+
+  def stats(self):
+    with self.lock:
+      return {
+        "enabled": self.enabled,
+        "directory": self.directory,
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "size": len(self.entries),
+        "total_bytes": self.total_bytes,
+        "max_bytes": self.max_bytes,
+      }
+
+  async def _download(self, file_id: str, grid_out) -> int:
+    os.makedirs(self.directory, exist_ok=True)
+    size, checksum = await download_to(self.model_path(file_id), grid_out)
+    with open(self.model_path(file_id) + CHECKSUM_FILE_SUFFIX, "w") as checksum_file:
+      checksum_file.write(checksum)
+    return size
+
+  def _verify(self, file_id: str) -> bool:
+    try:
+      with open(self.model_path(file_id) + CHECKSUM_FILE_SUFFIX) as checksum_file:
+        return file_sha256(self.model_path(file_id)) == checksum_file.read().strip()
+    except OSError:
+      return False
+
+  def _scan(self):
+    """
+    Picks up the files cached before a restart, the least recently used first. Their checksums are verified on first use.
+    """
+    if self.scanned:
+      return
+    with self.lock:
+      if self.scanned:
+        return
+      self.scanned = True
+      if not os.path.isdir(self.directory):
+        return
+      files = []
+      for name in os.listdir(self.directory):
+        path = os.path.join(self.directory, name)
+        if name.endswith(".part"):
+          os.remove(path)
+        elif name.endswith(MODEL_FILE_SUFFIX):
+          stat = os.stat(path)
+          files.append((stat.st_mtime, name[:-len(MODEL_FILE_SUFFIX)], stat.st_size))
+      for _, file_id, size in sorted(files):
+        self.entries[file_id] = CachedArtifact(file_id, size, False)
+        self.total_bytes += size
+      self._evict()
+
+  def _remove(self, file_id: str) -> bool:
+    entry = self.entries.pop(file_id, None)
+    for path in (self.model_path(file_id), self.model_path(file_id) + CHECKSUM_FILE_SUFFIX):
+      if os.path.exists(path):
+        os.remove(path)
+    if entry is None:
+      return False
+    self.total_bytes -= entry.size
+    return True
+
+  def _evict(self, keep: str = None):
+    # Sessions already built from an evicted file keep working, the file is only unlinked
+    for file_id in list(self.entries):
+      if self.total_bytes <= self.max_bytes:
+        break
+      if file_id != keep:
+        self._remove(file_id)
+        self.evictions += 1
+
+
+artifact_cache = ArtifactCache(ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_MB * 1024 * 1024)
+
+registry.gauge("nexon_artifact_cache_files", "Model files in the local artifact cache.", collect=lambda: {(): len(artifact_cache.entries)})
+registry.gauge("nexon_artifact_cache_bytes", "Size of the model files in the local artifact cache.", collect=lambda: {(): artifact_cache.total_bytes})
+registry.counter("nexon_artifact_cache_hits_total", "Session loads served from the local artifact cache.", collect=lambda: {(): artifact_cache.hits})
+registry.counter("nexon_artifact_cache_misses_total", "Session loads that downloaded the model file from GridFS.", collect=lambda: {(): artifact_cache.misses})
@@ -0,0 +1,171 @@
+from pydantic import BaseModel, Field
+import asyncio
+import logging
+import numpy as np
+
+logger = logging.getLogger("uvicorn")
+
+
+class BatchingConfig(BaseModel):
+    enabled: bool = False
+    max_batch_size: int = Field(default=32, ge=1)
+    max_wait_ms: float = Field(default=2.0, ge=0)
+
+
+class PendingRequest():
+  def __init__(self, feeds: dict, rows: int, future: asyncio.Future):
+    self.feeds = feeds
+    self.rows = rows
+    self.future = future
+
+
+class Batch():
+  def __init__(self, output_names: list, execute):
+    self.output_names = output_names
+    self.execute = execute
+    self.requests: list[PendingRequest] = []
+    self.rows = 0
+    self.timer: asyncio.TimerHandle = None
+
+
+class BatchScheduler():
+  """
+  Coalesces concurrent requests of one model along the batch dimension (axis 0).
+  A batch is run once it reaches the maximum batch size or its oldest request waited for the maximum wait time.
+  Only requests with the same inputs, dtypes, trailing dimensions and requested outputs are batched together.
+  """
+  def __init__(self, max_batch_size: int, max_wait_ms: float):
+    self.max_batch_size = max_batch_size
+    self.max_wait_ms = max_wait_ms
+    self.open_batches: dict[tuple, Batch] = {}
+    self.running: set[asyncio.Task] = set()
+    self.batches = 0
+    self.requests = 0
+    self.rows = 0
+    self.largest_batch = 0
+    self.unbatched = 0
+
+  async def run(self, feeds: dict[str, np.ndarray], output_names: list, execute):
+    """
+    Runs the request as part of a batch. execute(output_names, feeds) runs a merged batch on the session.
+    """
+    rows = self._rows(feeds)
+    if rows is None or rows > self.max_batch_size:
+      self.unbatched += 1
+      return await execute(output_names, feeds)
+
+    key = self._batch_key(feeds, output_names)
+    batch = self.open_batches.get(key)
+    if batch is not None and batch.rows + rows > self.max_batch_size:
+      self._flush(key)
+      batch = None
+    if batch is None:
+      batch = Batch(output_names, execute)
+      self.open_batches[key] = batch
+      batch.timer = asyncio.get_running_loop().call_later(self.max_wait_ms / 1000, self._flush, key)
+
+    future = asyncio.get_running_loop().create_future()
+    batch.requests.append(PendingRequest(feeds, rows, future))
+    batch.rows += rows
+    if batch.rows >= self.max_batch_size:
+      self._flush(key)
+    return await future
+
+  def stats(self):
+    return {
+      "max_batch_size": self.max_batch_size,
+      "max_wait_ms": self.max_wait_ms,
+      "batches": self.batches,
+      "requests": self.requests,
+      "rows": self.rows,
+      "average_batch_size": self.requests / self.batches if self.batches else 0.0,
+      "average_batch_rows": self.rows / self.batches if self.batches else 0.0,
+      "largest_batch": self.largest_batch,
+      "unbatched": self.unbatched,
+    }
+
+  def _flush(self, key: tuple):
+    batch = self.open_batches.pop(key, None)
+    if batch is None:
+      return
+    batch.timer.cancel()
+    task = asyncio.create_task(self._execute(batch))
+    self.running.add(task)
+    task.add_done_callback(self.running.discard)
+
+  async def _execute(self, batch: Batch):
+    self.batches += 1
+    self.requests += len(batch.requests)
+    self.rows += batch.rows
+    self.largest_batch = max(self.largest_batch, len(batch.requests))
+    try:
+      if len(batch.requests) == 1:
+        merged = batch.requests[0].feeds
+      else:
+        merged = {name: np.concatenate([request.feeds[name] for request in batch.requests]) for name in batch.requests[0].feeds}
+      results = await batch.execute(batch.output_names, merged)
+    except Exception as e:
+      for request in batch.requests:
+        if not request.future.done():
+          request.future.set_exception(e)
+      return
+
+    offset = 0
+    for request in batch.requests:
+      if not request.future.done():
+        request.future.set_result([self._slice(result, offset, request.rows, batch.rows) for result in results])
+      offset += request.rows
+
+  def _slice(self, result, offset: int, rows: int, batch_rows: int):
+    # Outputs without a batch dimension are shared by all requests of the batch
+    if isinstance(result, np.ndarray):
+      if result.ndim > 0 and result.shape[0] == batch_rows:
+        return result[offset:offset + rows]
+      return result
+    if isinstance(result, list) and len(result) == batch_rows:
+      return result[offset:offset + rows]
+    return result
+
+  def _rows(self, feeds: dict[str, np.ndarray]) -> int | None:
+    rows = None
+    for value in feeds.values():
+      if not isinstance(value, np.ndarray) or value.ndim == 0:
+        return None
+      if rows is not None and value.shape[0] != rows:
+        return None
+      rows = value.shape[0]
+    return rows
+
+  def _batch_key(self, feeds: dict[str, np.ndarray], output_names: list) -> tuple:
+    return (
+      tuple(output_names or []),
+      tuple((name, value.dtype.str, value.shape[1:]) for name, value in sorted(feeds.items())),
+    )
+
+
+class MicroBatcher():
+  """
+  Keeps one batch scheduler per model, following the model's batching configuration.
+  """
+  def __init__(self):
+    self.schedulers: dict[str, BatchScheduler] = {}
+
+  def scheduler(self, model_key: str, config: dict) -> BatchScheduler | None:
+    """
+    Returns the scheduler of a model, or None if batching is not enabled for it.
+    """
+    config = BatchingConfig(**(config or {}))
+    if not config.enabled:
+      self.schedulers.pop(str(model_key), None)
+      return None
+    scheduler = self.schedulers.get(str(model_key))
+    if scheduler is None or scheduler.max_batch_size != config.max_batch_size or scheduler.max_wait_ms != config.max_wait_ms:
+      scheduler = BatchScheduler(config.max_batch_size, config.max_wait_ms)
+      self.schedulers[str(model_key)] = scheduler
+    return scheduler
+
+  def stats(self):
+    return {model_key: scheduler.stats() for model_key, scheduler in self.schedulers.items()}
+
+
+micro_batcher = MicroBatcher()
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import io
+import logging
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from app.controller.database import DatabaseController
+from app.util.metrics import registry
+
+logger = logging.getLogger("uvicorn")
+
+# Attempts to record a stored file while the record of identical bytes is being deleted concurrently
+REGISTER_ATTEMPTS = 3
+
+blobs_deduplicated = registry.counter(
+  "nexon_model_blobs_deduplicated_total", "Model files not stored again because identical bytes are stored already, by ingest path.", ("source",))
+
+
+def source_sha256(source: bytes | io.IOBase) -> tuple[str, int]:
+  """
+  Returns the SHA-256 checksum and size of bytes or of a binary file object, read block by block from its start.
+  The file object is rewound afterwards. Blocking, run it off the event loop.
+  """
+  if isinstance(source, (bytes, bytearray)):
+    return hashlib.sha256(source).hexdigest(), len(source)
+  digest = hashlib.sha256()
+  size = 0
+  source.seek(0)
+  for block in iter(lambda: source.read(1024 * 1024), b""):
+    digest.update(block)
+    size += len(block)
+  source.seek(0)
+  return digest.hexdigest(), size
+
+
+class BlobStore:
+  """
+  Content addressed storage of model files in GridFS. Every stored file is recorded in the blobs collection
+  under its SHA-256 checksum with the number of models and variants referencing it, so identical bytes
+  (re-uploads, MLflow re-syncs, the same artifact registered under two names) are stored once and the file
+  is only deleted once its last reference is released. Files stored before the blobs collection existed
+  have no record, they are referenced once and deleted when released.
+  """
+  def __init__(self, db_controller: DatabaseController):
+    self.db_controller = db_controller
+
+  async def store(self, file_name: str, source: bytes | io.IOBase, metadata: dict = None, origin: str = None, ingest: str = "upload") -> str:
+    """
+    Stores bytes or a binary file object unless identical bytes are stored already, and returns the id of the GridFS file holding them.
+    The origin, e.g. the location of an MLflow artifact, is recorded so the file can be found by it without reading it again.
+    """
+    sha256, size = await asyncio.to_thread(source_sha256, source)
+    blob = await self._reuse(sha256, origin)
+    if blob is not None:
+      blobs_deduplicated.inc(source=ingest)
+      logger.info(f"{file_name} is identical to the stored file {blob['file_id']}, reusing it.")
+      return blob["file_id"]
+    file_id = await self.db_controller.upload_file(file_name, source, {**(metadata or {}), "sha256": sha256})
+    return await self.register(sha256, str(file_id), size, origin, ingest)
+
+  async def register(self, sha256: str, file_id: str, size: int, origin: str = None, ingest: str = "upload") -> str:
+    """
+    Records a file already stored in GridFS under its checksum. If identical bytes are stored already,
+    the new file is deleted and the id of the existing file is returned.
+    """
+    blob = {"_id": sha256, "file_id": file_id, "size": size, "refs": 1, "sources": [origin] if origin else []}
+    for _ in range(REGISTER_ATTEMPTS):
+      try:
+        await self.db_controller.insert_blob(blob)
+        return file_id
+      except DuplicateKeyError:
+        existing = await self._reuse(sha256, origin)
+        if existing is not None:
+          await self.db_controller.delete_file(ObjectId(file_id))
+          blobs_deduplicated.inc(source=ingest)
+          return existing["file_id"]
+        # The record of identical bytes lost its last reference and is being deleted, take its place
+        replaced = await self.db_controller.update_blob({"_id": sha256, "refs": {"$lte": 0}}, {"$set": {key: value for key, value in blob.items() if key != "_id"}})
+        if replaced is not None:
+          return file_id
+    raise Exception(f"Could not record the stored file {file_id} with checksum {sha256}.")
+
+  async def find_origin(self, origin: str) -> dict | None:
+    """
+    Returns the record of the file stored from the given origin, if it is still referenced.
+    """
+    return await self.db_controller.find_blob({"sources": origin, "refs": {"$gt": 0}})
+
+  async def acquire(self, file_id: str) -> bool:
+    """
+    Adds a reference to a stored file, e.g. for a model reusing the file of another one.
+    Returns False if the file has no record or is being deleted.
+    """
+    return await self.db_controller.update_blob({"file_id": str(file_id), "refs": {"$gt": 0}}, {"$inc": {"refs": 1}}) is not None
+
+  async def release(self, file_id: str) -> bool:
+    """
+    Drops a reference to a stored file and deletes the file once no model or variant references it anymore.
+    Returns whether the file was deleted.
+    """
+    file_id = str(file_id)
+    blob = await self.db_controller.update_blob({"file_id": file_id, "refs": {"$gt": 0}}, {"$inc": {"refs": -1}})
+    if blob is not None and blob["refs"] > 0:
+      return False
+    if blob is not None:
+      await self.db_controller.delete_blob({"_id": blob["_id"], "file_id": file_id, "refs": {"$lte": 0}})
+    await self.db_controller.delete_file(ObjectId(file_id))
+    return True
+
+  async def _reuse(self, sha256: str, origin: str = None) -> dict | None:
+    update = {"$inc": {"refs": 1}}
+    if origin:
+      update["$addToSet"] = {"sources": origin}
+    return await self.db_controller.update_blob({"_id": sha256, "refs": {"$gt": 0}}, update)
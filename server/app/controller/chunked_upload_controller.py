@@ -0,0 +1,257 @@
+from os import environ
+from typing import List, Optional
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import tempfile
+import time
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import BackgroundTasks
+from pydantic import BaseModel, Field
+from app.controller.blob_store import BlobStore
+from app.controller.database import DatabaseController
+from app.controller.session_config import SessionConfig
+from app.controller.upload_controller import UploadController
+from app.controller.variant_controller import DEFAULT_MODEL_VARIANTS
+from app.util.errors import BadRequestError, NotFoundError
+from app.util.external_data import check_location, external_data_locations, match_external_data
+from app.util.model_signature import read_signature
+from app.util.model_variants import parse_variants
+
+logger = logging.getLogger("uvicorn")
+
+# Chunk size of chunked uploads in megabytes. Every chunk is stored as one GridFS chunk document, so it is capped below MongoDB's 16 MB document limit.
+UPLOAD_CHUNK_MB = float(environ.get("NEXON_UPLOAD_CHUNK_MB", "8"))
+UPLOAD_CHUNK_SIZE = int(min(UPLOAD_CHUNK_MB, 15) * 1024 * 1024)
+
+
+class CreateUploadRequest(BaseModel):
+    file_name: str
+    size: int = Field(gt=0)  # Size of the file in bytes
+    sha256: Optional[str] = None  # Checksum of the file, verified when the upload is finalized
+    session_config: Optional[SessionConfig] = None
+    variants: Optional[List[str]] = None
+    # Upload of the model file this upload holds an external data file of, named by its location relative to the model
+    model_upload_id: Optional[str] = None
+
+
+class RunningChecksum():
+  """
+  SHA-256 of the chunks of an upload received in order so far, so finalizing an upload sent chunk by chunk does not hash it again.
+  Chunks received out of order, e.g. by parallel uploads, are hashed from GridFS when the upload is finalized.
+  """
+  def __init__(self):
+    self.digest = hashlib.sha256()
+    self.next_chunk = 0
+    self.lock = asyncio.Lock()
+
+  async def add(self, n: int, data: bytes):
+    async with self.lock:
+      if n == self.next_chunk:
+        await asyncio.to_thread(self.digest.update, data)
+        self.next_chunk += 1
+      elif n < self.next_chunk:
+        # A chunk hashed before was uploaded again, the whole file is hashed when the upload is finalized
+        self.digest = hashlib.sha256()
+        self.next_chunk = 0
+
+
+# Running checksums of the uploads in progress, by upload id. Uploads resumed after a restart are hashed when finalized.
+running_checksums: dict[str, RunningChecksum] = {}
+
+
+class ChunkedUploadController:
+  """
+  Resumable uploads of large model files: the client creates an upload, sends the file in chunks at their offsets,
+  in any order and in parallel, and finalizes it. Chunks are written straight into GridFS as they arrive,
+  and the file becomes readable once the upload is finalized and its checksum verified.
+  A dropped connection only loses the chunks in flight, the state of the upload tells which offsets are missing.
+  The external data files of a model are uploaded the same way, one upload per file referring to the model's upload,
+  and are finalized together with it.
+  """
+  def __init__(self, db_controller: DatabaseController):
+    self.db_controller = db_controller
+
+  async def create_upload(self, request: CreateUploadRequest):
+    model_upload_id = None
+    if request.model_upload_id is None:
+      if not request.file_name.endswith(".onnx"):
+        raise BadRequestError("Only ONNX files are allowed.")
+      file_name = request.file_name
+    else:
+      model_upload = await self._find_upload(request.model_upload_id)
+      if model_upload.get("model_upload_id") is not None:
+        raise BadRequestError("External data files belong to the upload of a model file.")
+      model_upload_id = model_upload["_id"]
+      file_name = check_location(request.file_name)
+    upload = {
+      "_id": ObjectId(),  # Id of the GridFS file the chunks are written to
+      "file_name": file_name,
+      "size": request.size,
+      "chunk_size": UPLOAD_CHUNK_SIZE,
+      "sha256": request.sha256.lower() if request.sha256 else None,
+      "session_config": request.session_config.model_dump(exclude_none=True) if request.session_config else None,
+      "variants": parse_variants(request.variants) if request.variants is not None else None,
+      "model_upload_id": model_upload_id,
+      "received": [],
+      "finalizing": False,
+      "created": time.time(),
+    }
+    await self.db_controller.insert_upload(upload)
+    running_checksums[str(upload["_id"])] = RunningChecksum()
+    return self._status(upload)
+
+  async def get_upload(self, upload_id: str):
+    return self._status(await self._find_upload(upload_id))
+
+  async def put_chunk(self, upload_id: str, offset: int, data: bytes):
+    """
+    Stores the chunk of the file starting at the given offset. Chunks sent again replace the ones received before.
+    """
+    upload = await self._find_upload(upload_id)
+    if upload.get("finalizing"):
+      raise BadRequestError(f"The upload {upload_id} is being finalized.")
+    chunk_size = upload["chunk_size"]
+    if offset < 0 or offset % chunk_size or offset >= upload["size"]:
+      raise BadRequestError(f"Chunks start at multiples of {chunk_size} bytes below the file size of {upload['size']} bytes, got offset {offset}.")
+    expected_size = min(chunk_size, upload["size"] - offset)
+    if len(data) != expected_size:
+      raise BadRequestError(f"The chunk at offset {offset} must be {expected_size} bytes, got {len(data)}.")
+
+    n = offset // chunk_size
+    await self.db_controller.put_file_chunk(upload["_id"], n, data)
+    await self.db_controller.update_upload({"_id": upload["_id"]}, {"$addToSet": {"received": n}})
+    checksum = running_checksums.get(str(upload["_id"]))
+    if checksum is not None:
+      await checksum.add(n, data)
+    return {"upload_id": str(upload["_id"]), "offset": offset, "size": len(data)}
+
+  async def finalize_upload(self, upload_id: str, background_tasks: BackgroundTasks = None):
+    """
+    Verifies that all chunks of the model file and of its external data files were received and that the files match
+    the checksums given when their uploads were created, then registers them as a new version of the model like a regular upload.
+    Only one call finalizes an upload, concurrent calls are rejected.
+    """
+    upload = await self._find_upload(upload_id)
+    if upload.get("model_upload_id") is not None:
+      raise BadRequestError("External data files are finalized with the upload of their model file.")
+    upload = await self.db_controller.claim_upload({"_id": upload["_id"], "finalizing": {"$ne": True}}, {"$set": {"finalizing": True}})
+    if upload is None:
+      raise BadRequestError(f"The upload {upload_id} is already being finalized.")
+    try:
+      return await self._finalize(upload, background_tasks)
+    except BaseException:
+      # A failed finalization can be retried, unless the upload was discarded
+      await self.db_controller.update_upload({"_id": upload["_id"]}, {"$set": {"finalizing": False}})
+      raise
+
+  async def abort_upload(self, upload_id: str):
+    upload = await self._find_upload(upload_id)
+    await self._discard(upload)
+    return {"message": f"Upload of {upload['file_name']} aborted."}
+
+  async def _finalize(self, upload: dict, background_tasks: BackgroundTasks = None):
+    external_uploads = await self.db_controller.find_uploads({"model_upload_id": upload["_id"]})
+    for file_upload in [upload, *external_uploads]:
+      missing_offsets = self._status(file_upload)["missing_offsets"]
+      if missing_offsets:
+        raise BadRequestError(f"The upload of {file_upload['file_name']} is missing {len(missing_offsets)} chunks, the first at offset {missing_offsets[0]}.")
+
+    file_name = upload["file_name"]
+    # The model file is read back once to hash the chunks received out of order and to read the model's signature from disk
+    descriptor, temp_path = tempfile.mkstemp(prefix="nexon-upload-", suffix=".onnx")
+    os.close(descriptor)
+    try:
+      sha256 = await self._verify(upload, temp_path)
+      locations = await asyncio.to_thread(external_data_locations, temp_path)
+      matched_files = match_external_data(locations, [file_upload["file_name"] for file_upload in external_uploads])
+      signature = await asyncio.to_thread(read_signature, temp_path)
+    finally:
+      os.remove(temp_path)
+    external_sha256 = {file_upload["file_name"]: await self._verify(file_upload) for file_upload in external_uploads}
+
+    external_data = None
+    if matched_files:
+      uploads_by_name = {file_upload["file_name"]: file_upload for file_upload in external_uploads}
+      external_data = []
+      for location, external_file_name in matched_files.items():
+        file_upload = uploads_by_name[external_file_name]
+        file_id = await self._register(file_upload, external_sha256[external_file_name], {"external_data": location})
+        external_data.append({"location": location, "file_id": file_id, "size": file_upload["size"]})
+    file_id = await self._register(upload, sha256)
+
+    upload_controller = UploadController(self.db_controller)
+    variants = parse_variants(DEFAULT_MODEL_VARIANTS) if upload["variants"] is None else upload["variants"]
+    if variants and external_data:
+      logger.info(f"Variants are not generated for {file_name}, as it has external data.")
+      variants = []
+    session_config = SessionConfig(**upload["session_config"]) if upload["session_config"] else None
+    size = upload["size"] + sum(entry["size"] for entry in external_data or [])
+    version = await upload_controller.next_version(file_name)
+    result = await upload_controller.insert_model(file_name, version, file_id, size, signature, session_config, None, external_data)
+    logger.info(f"Chunked upload of {file_name} (v{version}) finalized, sha256 {sha256}.")
+    return {**await upload_controller.schedule_variants(result, variants, background_tasks), "sha256": sha256}
+
+  async def _verify(self, upload: dict, path: str = None) -> str:
+    """
+    Returns the SHA-256 checksum of a complete upload, hashing the chunks the running checksum did not cover,
+    and writes the file to path if given. Discards the upload if the checksum differs from the one it was created with.
+    """
+    checksum = running_checksums.pop(str(upload["_id"]), None) or RunningChecksum()
+    if path is not None or checksum.next_chunk < self._status(upload)["chunks"]:
+      with open(path or os.devnull, "wb") as temp_file:
+        async for chunk in self.db_controller.find_file_chunks(upload["_id"]):
+          if chunk["n"] >= checksum.next_chunk:
+            await asyncio.to_thread(checksum.digest.update, chunk["data"])
+          if path is not None:
+            await asyncio.to_thread(temp_file.write, chunk["data"])
+    sha256 = checksum.digest.hexdigest()
+    if upload["sha256"] is not None and sha256 != upload["sha256"]:
+      await self._discard(upload)
+      raise BadRequestError(f"The uploaded file {upload['file_name']} has the checksum {sha256}, expected {upload['sha256']}. The upload was discarded.")
+    return sha256
+
+  async def _register(self, upload: dict, sha256: str, metadata: dict = None) -> str:
+    """
+    Makes the file of a verified upload readable and records it in the blob store.
+    If identical bytes are stored already, the uploaded file is deleted and the id of the stored one is returned.
+    """
+    await self.db_controller.insert_file(upload["_id"], upload["file_name"], upload["size"], upload["chunk_size"], {**(metadata or {}), "sha256": sha256})
+    await self.db_controller.delete_upload({"_id": upload["_id"]})
+    return await BlobStore(self.db_controller).register(sha256, str(upload["_id"]), upload["size"])
+
+  async def _discard(self, upload: dict):
+    """
+    Deletes an upload and its chunks, together with the uploads of its external data files.
+    """
+    for file_upload in [upload, *await self.db_controller.find_uploads({"model_upload_id": upload["_id"]})]:
+      running_checksums.pop(str(file_upload["_id"]), None)
+      await self.db_controller.delete_file_chunks(file_upload["_id"])
+      await self.db_controller.delete_upload({"_id": file_upload["_id"]})
+
+  def _status(self, upload: dict) -> dict:
+    size = upload["size"]
+    chunk_size = upload["chunk_size"]
+    received = set(upload["received"])
+    return {
+      "upload_id": str(upload["_id"]),
+      "file_name": upload["file_name"],
+      "model_upload_id": str(upload["model_upload_id"]) if upload.get("model_upload_id") else None,
+      "size": size,
+      "chunk_size": chunk_size,
+      "chunks": math.ceil(size / chunk_size),
+      "received_bytes": sum(min(chunk_size, size - n * chunk_size) for n in received),
+      "missing_offsets": [n * chunk_size for n in range(math.ceil(size / chunk_size)) if n not in received],
+    }
+
+  async def _find_upload(self, upload_id: str) -> dict:
+    try:
+      upload = await self.db_controller.find_upload({"_id": ObjectId(upload_id)})
+    except InvalidId:
+      upload = None
+    if upload is None:
+      raise NotFoundError(f"No upload with id {upload_id}.")
+    return upload
@@ -1,9 +1,12 @@
 from dotenv import load_dotenv
 from bson import ObjectId
+from datetime import datetime, timezone
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument
 from os import environ
 import logging
+from app.controller.routing_table import routing_table
 
 logger = logging.getLogger("uvicorn")
 
@@ -16,7 +19,7 @@ DB_NAME = environ['NEXON_MONGO_DB']
       
 
 class ModelMetadata():
-    def __init__(self, file_id: str = None, name: str = None, upload: str = None, version: int = None, deploy: str = None, size: str = None, status: str = None, mlflow_uri: str = None, mlflow_source_selectors: list = []):
+    def __init__(self, file_id: str = None, name: str = None, upload: str = None, version: int = None, deploy: str = None, size: str = None, status: str = None, mlflow_uri: str = None, mlflow_source_selectors: list = [], concurrency: dict = None, batching: dict = None, session_config: dict = None, signature: dict = None, variants: dict = None, external_data: list = None):
         self.file_id = file_id
         self.name = name
         self.upload = upload
@@ -26,6 +29,12 @@ class ModelMetadata():
         self.status = status
         self.mlflow_uri = mlflow_uri
         self.mlflow_source_selectors = mlflow_source_selectors
+        self.concurrency = concurrency
+        self.batching = batching
+        self.session_config = session_config
+        self.signature = signature
+        self.variants = variants
+        self.external_data = external_data
 
     def to_dict(self):
         return {
@@ -37,7 +46,13 @@ class ModelMetadata():
             "size": self.size,
             "status": self.status,
             "mlflow_uri": self.mlflow_uri,
-            "mlflow_source_selectors": self.mlflow_source_selectors
+            "mlflow_source_selectors": self.mlflow_source_selectors,
+            "concurrency": self.concurrency,
+            "batching": self.batching,
+            "session_config": self.session_config,
+            "signature": self.signature,
+            "variants": self.variants,
+            "external_data": self.external_data
         }      
         
 class MLflowDeployment():
@@ -55,9 +70,23 @@ class DatabaseController():
       self.fs = fs_bucket
       self.models_collection = self.database["models"]
       self.mlflow_deployments_collection = self.database["mlflow_deployments"]
+      self.jobs_collection = self.database["jobs"]
+      self.profiles_collection = self.database["profiles"]
+      self.uploads_collection = self.database["uploads"]
+      self.blobs_collection = self.database["blobs"]
+      self.promotions_collection = self.database["promotions"]
+      # Collections of the default GridFS bucket, written directly by chunked uploads
+      self.files_collection = self.database["fs.files"]
+      self.chunks_collection = self.database["fs.chunks"]
 
     async def create_indices(self):
       await self.mlflow_deployments_collection.create_index("timestamp")
+      await self.jobs_collection.create_index("status")
+      await self.profiles_collection.create_index([("model_name", 1), ("model_version", 1)])
+      await self.blobs_collection.create_index("file_id")
+      await self.blobs_collection.create_index("sources")
+      await self.uploads_collection.create_index("model_upload_id")
+      await self.chunks_collection.create_index([("files_id", 1), ("n", 1)], unique=True)
       await self.models_collection.create_index("mlflow_uri", unique=True, partialFilterExpression={"mlflow_uri": {"$type": "string"}}
 )
 
@@ -73,11 +102,17 @@ class DatabaseController():
     async def find_one(self, query, sort=None):
       return await self.models_collection.find_one(query, sort=sort)
     
+    def watch_models(self):
+      """
+      Opens a change stream on the models collection, looking up the full document of updates.
+      """
+      return self.models_collection.watch(full_document="updateLookup")
+    
     async def delete_one(self, query):
       return await self.models_collection.delete_one(query)
     
-    async def upload_file(self, filename: str, file: any):
-      return await self.fs.upload_from_stream(filename, file)
+    async def upload_file(self, filename: str, file: any, metadata: dict = None):
+      return await self.fs.upload_from_stream(filename, file, metadata=metadata)
     
     async def download_file(self, file_id: ObjectId):
       return await self.fs.open_download_stream(file_id=file_id)
@@ -85,6 +120,77 @@ class DatabaseController():
     async def delete_file(self, file_id: ObjectId):
       return await self.fs.delete(file_id)
     
+    async def find_files(self, query):
+      return await self.fs.find(query).to_list(None)
+    
+    async def put_file_chunk(self, file_id: ObjectId, n: int, data: bytes):
+      """
+      Stores the n-th chunk of a GridFS file that is not finalized yet, replacing a chunk uploaded before.
+      """
+      return await self.chunks_collection.update_one({"files_id": file_id, "n": n}, {"$set": {"data": data}}, upsert=True)
+    
+    def find_file_chunks(self, file_id: ObjectId):
+      return self.chunks_collection.find({"files_id": file_id}, sort=[("n", 1)])
+    
+    async def delete_file_chunks(self, file_id: ObjectId):
+      return await self.chunks_collection.delete_many({"files_id": file_id})
+    
+    async def insert_file(self, file_id: ObjectId, filename: str, length: int, chunk_size: int, metadata: dict = None):
+      """
+      Finalizes a GridFS file whose chunks were stored with put_file_chunk, making it readable.
+      """
+      return await self.files_collection.insert_one({
+        "_id": file_id,
+        "length": length,
+        "chunkSize": chunk_size,
+        "uploadDate": datetime.now(timezone.utc),
+        "filename": filename,
+        "metadata": metadata,
+      })
+    
+    async def insert_blob(self, blob: dict):
+      """
+      Inserts the record of a stored model file, keyed by its SHA-256 checksum. Raises DuplicateKeyError if it exists.
+      """
+      return await self.blobs_collection.insert_one(blob)
+    
+    async def find_blob(self, query):
+      return await self.blobs_collection.find_one(query)
+    
+    async def update_blob(self, query, update):
+      """
+      Updates the record of a stored model file and returns it as updated, or None if no record matches.
+      """
+      return await self.blobs_collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+    
+    async def delete_blob(self, query):
+      return await self.blobs_collection.delete_one(query)
+    
+    async def insert_upload(self, upload: dict):
+      """
+      Inserts the state of a chunked upload into the database.
+      """
+      result = await self.uploads_collection.insert_one(upload)
+      return str(result.inserted_id)
+    
+    async def find_upload(self, query):
+      return await self.uploads_collection.find_one(query)
+    
+    async def find_uploads(self, query):
+      return await self.uploads_collection.find(query).to_list(None)
+    
+    async def update_upload(self, query, update):
+      return await self.uploads_collection.update_one(query, update)
+    
+    async def claim_upload(self, query, update):
+      """
+      Updates the first upload matching the query and returns it as updated, or None if no upload matches.
+      """
+      return await self.uploads_collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+    
+    async def delete_upload(self, query):
+      return await self.uploads_collection.delete_one(query)
+    
     async def insert_model(self, model_metadata: ModelMetadata):
       """
       Inserts a model metadata into the database.
@@ -99,6 +205,60 @@ class DatabaseController():
       """
       return await self.models_collection.update_one(query, update)
     
+    async def insert_job(self, job: dict):
+      """
+      Inserts a batch inference job into the database.
+      """
+      result = await self.jobs_collection.insert_one(job)
+      return str(result.inserted_id)
+    
+    async def find_job(self, query):
+      return await self.jobs_collection.find_one(query)
+    
+    async def find_jobs(self, query):
+      return await self.jobs_collection.find(query).sort([("_id", -1)]).to_list(None)
+    
+    async def update_job(self, query, update):
+      return await self.jobs_collection.update_one(query, update)
+    
+    async def claim_job(self, query, update):
+      """
+      Updates the first job matching the query and returns it as updated, or None if no job matches.
+      """
+      return await self.jobs_collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+    
+    async def delete_job(self, query):
+      return await self.jobs_collection.delete_one(query)
+    
+    async def start_promotion(self, query, update):
+      """
+      Records a promotion of a model under its name, upserting the record if none matches the query.
+      Raises DuplicateKeyError if the model has a record not matching the query, e.g. of a promotion in progress.
+      """
+      return await self.promotions_collection.update_one(query, update, upsert=True)
+    
+    async def find_promotion(self, query):
+      return await self.promotions_collection.find_one(query)
+    
+    async def update_promotion(self, query, update):
+      return await self.promotions_collection.update_one(query, update)
+    
+    async def insert_profile(self, profile: dict):
+      """
+      Inserts an ONNX Runtime profile of a model into the database.
+      """
+      result = await self.profiles_collection.insert_one(profile)
+      return str(result.inserted_id)
+    
+    async def find_profile(self, query):
+      return await self.profiles_collection.find_one(query)
+    
+    async def find_profiles(self, query):
+      return await self.profiles_collection.find(query).sort([("_id", -1)]).to_list(None)
+    
+    async def delete_profile(self, query):
+      return await self.profiles_collection.delete_one(query)
+    
     async def get_latest_mlflow_deployment(self) -> MLflowDeployment | None:
       doc = await self.mlflow_deployments_collection.find_one({}, sort=[("timestamp", -1)])
       if doc:
@@ -125,10 +285,15 @@ async def connect_to_mongo():
   await db_controller.create_indices()
   logger.info(f"Successfully connected to MongoDB at {MONGO_URI} and initialized GridFS for '{DB_NAME}'.")
 
+  await routing_table.load(db_controller)
+  routing_table.start(db_controller)
+  logger.info(f"Routing table initialized with {len(routing_table.ids)} deployed models.")
+
 
 async def close_mongo_connection():
   """Closes the MongoDB connection."""
   global db_client
+  await routing_table.stop()
   if db_client:
       db_client.close()
       logger.info("MongoDB connection closed.")
@@ -1,20 +1,55 @@
 from bson import ObjectId
+from fastapi import BackgroundTasks
 from datetime import datetime
-from pydantic import BaseModel
+from os import environ
+from typing import Optional
+import asyncio
+import logging
+import time
+from pydantic import BaseModel, Field
+from pymongo.errors import DuplicateKeyError
 from app.controller.database import DatabaseController
-from app.util.constants import STATUS_DEPLOYED, STATUS_UPLOADED
+from app.controller.session_cache import session_cache
+from app.controller.routing_table import routing_table
+from app.controller.result_cache import ResultCacheConfig, result_cache
+from app.controller.profiling_controller import ProfilingConfig
+from app.controller.batching import BatchingConfig
+from app.controller.session_config import SessionConfig
+from app.controller.model_states import model_states
+from app.controller.warmup_controller import WarmupController
+from app.util.constants import MODEL_STATE_FAILED, MODEL_STATE_READY, PROMOTION_COMPLETED, PROMOTION_DRAINING, PROMOTION_FAILED, PROMOTION_WARMING, STATUS_DEPLOYED, STATUS_UPLOADED
 from app.util.errors import BadRequestError, NotFoundError
+from app.util.metrics import inference_in_flight, model_labels
+from app.util.model_variants import model_file_ids
+
+logger = logging.getLogger("uvicorn")
 
 BASE_URL = "http://localhost:3000"
 
+# Seconds a promotion waits for the requests in flight on the replaced version before releasing its session
+PROMOTE_DRAIN_TIMEOUT = float(environ.get("NEXON_PROMOTE_DRAIN_TIMEOUT", "30"))
+# Seconds between checks of the requests in flight on the replaced version
+PROMOTE_DRAIN_INTERVAL = 0.05
+# Seconds after which an unfinished promotion, e.g. of a server that stopped during it, no longer blocks promoting the model again
+PROMOTE_EXPIRY = float(environ.get("NEXON_PROMOTE_EXPIRY", "900"))
+
 class DeployRequest(BaseModel):
     model_name: str
     model_id: str
+    session_config: Optional[SessionConfig] = None
 
 class UndeployRequest(BaseModel):
     model_name: str
     model_version: int     
+
+class ConcurrencyConfig(BaseModel):
+    max_in_flight: Optional[int] = Field(default=None, ge=1)
+    max_queue: Optional[int] = Field(default=None, ge=0)
+    max_queue_wait_ms: Optional[float] = Field(default=None, gt=0)
     
+def deployment_date() -> str:
+    return f"{datetime.now().day}/{datetime.now().month}/{datetime.now().year}"
+
 def get_inference_endpoint(model_name: str, model_version: int = None) -> str:
     if model_version:
         return f"{BASE_URL}/inference/infer/{model_name}/{model_version}"
@@ -24,27 +59,44 @@ class DeploymentController:
   def __init__(self, db_controller: DatabaseController):
     self.db_controller = db_controller
     
-  async def deploy_model(self, request: DeployRequest):
+  async def deploy_model(self, request: DeployRequest, background_tasks: BackgroundTasks = None):
     """
-    Deploys an already uploaded model
+    Deploys an already uploaded model.
+    If background_tasks is given, the model's session is loaded and warmed up after the response was sent.
     """
     model_id = ObjectId(request.model_id)
     try:
       models = await self.db_controller.find({"name": request.model_name})
+      deployed_model = None
       for model in models:
         if (model["status"] == STATUS_DEPLOYED):
           if model["_id"] == model_id:
             raise BadRequestError("This version is already deployed!")
           else:
             raise BadRequestError("Another version of this model is already deployed!")
+        if model["_id"] == model_id:
+          deployed_model = model
 
-      date = f"{datetime.now().day}/{datetime.now().month}/{datetime.now().year}"
+      date = deployment_date()
       api_endpoint = get_inference_endpoint(request.model_name)
+      update = {"status": STATUS_DEPLOYED, "deploy": date, "endpoint": api_endpoint}
+      if request.session_config is not None:
+        update["session_config"] = request.session_config.model_dump(exclude_none=True)
       updated_result = await self.db_controller.update_one(
           {"_id": model_id},
-          {"$set": {"status": STATUS_DEPLOYED, "deploy": date, "endpoint": api_endpoint}},
+          {"$set": update},
       )
       if updated_result.modified_count > 0:
+        if deployed_model:
+          for file_id in model_file_ids(deployed_model):
+            session_cache.invalidate(file_id)
+          deployed_model = {**deployed_model, **update}
+          if background_tasks is not None:
+            # Marked before routing, so the route listener does not warm it up a second time
+            warmup_controller = WarmupController(self.db_controller)
+            warmup_controller.mark_warming(deployed_model)
+            background_tasks.add_task(warmup_controller.warm_up, deployed_model)
+          routing_table.update(deployed_model)
         return {
           "message": f"Model {request.model_name} deployed successfuly!",
           "inference_endpoint": api_endpoint
@@ -76,4 +128,159 @@ class DeploymentController:
       if update_result.modified_count == 0:
           raise Exception("Failed to undeploy model.")
 
-      return {"message": f"Model '{request.model_name}' (v{request.model_version}) undeployed successfully."}
\ No newline at end of file
+      routing_table.remove(model["_id"])
+      for file_id in model_file_ids(model):
+        session_cache.invalidate(file_id)
+
+      return {"message": f"Model '{request.model_name}' (v{request.model_version}) undeployed successfully."}
+
+  async def promote_model(self, model_name: str, model_version: int, background_tasks: BackgroundTasks = None):
+      """
+      Replaces the deployed version of a model with another version without a window of failed or cold requests:
+      the new version is loaded and warmed up while the deployed one keeps serving, then the unversioned route
+      switches over in one step and the session of the replaced version is released once its requests in flight drained.
+      If background_tasks is given, the promotion runs after the response was sent and its progress is reported by get_promotion.
+      The state of the promotion is stored in the database, so only one promotion of a model runs at a time across all server instances.
+      """
+      models = await self.db_controller.find({"name": model_name})
+      target = next((model for model in models if model["version"] == model_version), None)
+      if not target:
+        raise NotFoundError("Model not found.")
+      replaced = [model for model in models if model["status"] == STATUS_DEPLOYED and model["_id"] != target["_id"]]
+      if target["status"] == STATUS_DEPLOYED and not replaced:
+        raise BadRequestError("This version is already deployed!")
+
+      promotion = {
+        "promotion_id": str(ObjectId()),
+        "model_name": model_name,
+        "from_versions": [model["version"] for model in replaced],
+        "to_version": model_version,
+        "state": PROMOTION_WARMING,
+        "details": None,
+        "started": time.time(),
+        "drained": None,
+      }
+      try:
+        # Matches no record while a promotion of the model is in progress, so the upsert fails on the model's name
+        await self.db_controller.start_promotion(
+          {"_id": model_name, "$or": [{"state": {"$in": [PROMOTION_COMPLETED, PROMOTION_FAILED]}}, {"started": {"$lt": time.time() - PROMOTE_EXPIRY}}]},
+          {"$set": promotion},
+        )
+      except DuplicateKeyError:
+        in_progress = await self.db_controller.find_promotion({"_id": model_name}) or {}
+        raise BadRequestError(f"A promotion of model '{model_name}' to v{in_progress.get('to_version')} is already in progress.")
+      if background_tasks is not None:
+        background_tasks.add_task(self._promote, target, replaced, promotion)
+      else:
+        await self._promote(target, replaced, promotion)
+      return {"message": f"Promoting model '{model_name}' to v{model_version}.", "promotion": promotion}
+
+  async def get_promotion(self, model_name: str):
+      """
+      Reports the state of the latest promotion of a model.
+      """
+      promotion = await self.db_controller.find_promotion({"_id": model_name})
+      if promotion is None:
+        raise NotFoundError(f"Model '{model_name}' has not been promoted.")
+      promotion.pop("_id", None)
+      return promotion
+
+  async def _promote(self, target: dict, replaced: list[dict], promotion: dict):
+      try:
+        update = {"status": STATUS_DEPLOYED, "deploy": deployment_date(), "endpoint": get_inference_endpoint(target["name"])}
+        promoted = {**target, **update}
+        warmup_controller = WarmupController(self.db_controller)
+        await warmup_controller.warm_up(promoted)
+        if model_states.get(promoted["file_id"]) == MODEL_STATE_FAILED:
+          raise Exception(f"Warm-up failed: {model_states.details(promoted['file_id'])}")
+
+        # The new version is deployed before the replaced ones are undeployed, so other server instances always route one of them
+        await self.db_controller.update_one({"_id": target["_id"]}, {"$set": update})
+        for model in replaced:
+          await self.db_controller.update_one({"_id": model["_id"]}, {"$set": {"status": STATUS_UPLOADED}})
+        # Marked warming while routed, so the route listener does not warm it up a second time
+        warmup_controller.mark_warming(promoted)
+        routing_table.swap(promoted, [model["_id"] for model in replaced])
+        model_states.set(promoted["file_id"], MODEL_STATE_READY)
+        logger.info(f"Model {target['name']} promoted from {promotion['from_versions']} to v{target['version']}.")
+
+        await self._update_promotion(promotion, state=PROMOTION_DRAINING)
+        drained = await self._drain(replaced)
+        for model in replaced:
+          for file_id in model_file_ids(model):
+            session_cache.invalidate(file_id)
+        await self._update_promotion(promotion, state=PROMOTION_COMPLETED, drained=drained)
+      except Exception as e:
+        await self._update_promotion(promotion, state=PROMOTION_FAILED, details=str(e))
+        logger.error(f"Promotion of model {target['name']} to v{target['version']} failed: {e}")
+
+  async def _update_promotion(self, promotion: dict, **fields):
+      """
+      Records the progress of a promotion, unless a newer promotion of the model replaced it after it expired.
+      """
+      promotion.update(fields)
+      await self.db_controller.update_promotion({"_id": promotion["model_name"], "promotion_id": promotion["promotion_id"]}, {"$set": fields})
+
+  async def _drain(self, models: list[dict]) -> bool:
+      """
+      Waits until no request is in flight on the given models, at most PROMOTE_DRAIN_TIMEOUT seconds.
+      """
+      deadline = time.monotonic() + PROMOTE_DRAIN_TIMEOUT
+      while any(inference_in_flight.get(**model_labels(model)) for model in models):
+        if time.monotonic() >= deadline:
+          logger.warning(f"Requests to model {models[0]['name']} still in flight after {PROMOTE_DRAIN_TIMEOUT:g}s, releasing its session.")
+          return False
+        await asyncio.sleep(PROMOTE_DRAIN_INTERVAL)
+      return True
+
+  async def set_concurrency(self, model_name: str, model_version: int, config: ConcurrencyConfig):
+      """
+      Sets the maximum number of concurrent and queued inference requests of a model.
+      """
+      await self._update_model_settings(model_name, model_version, {"concurrency": config.model_dump()})
+      return {"message": f"Concurrency limits of model '{model_name}' (v{model_version}) updated.", "concurrency": config.model_dump()}
+
+  async def set_batching(self, model_name: str, model_version: int, config: BatchingConfig):
+      """
+      Enables or disables micro-batching of concurrent inference requests of a model.
+      """
+      await self._update_model_settings(model_name, model_version, {"batching": config.model_dump()})
+      return {"message": f"Batching of model '{model_name}' (v{model_version}) updated.", "batching": config.model_dump()}
+
+  async def set_session_config(self, model_name: str, model_version: int, config: SessionConfig):
+      """
+      Sets the ONNX Runtime session options of a model. The model's cached session is rebuilt on the next request.
+      """
+      model = await self._update_model_settings(model_name, model_version, {"session_config": config.model_dump(exclude_none=True)})
+      for file_id in model_file_ids(model):
+        session_cache.invalidate(file_id)
+      return {"message": f"Session configuration of model '{model_name}' (v{model_version}) updated.", "session_config": config.model_dump(exclude_none=True)}
+
+  async def set_result_cache(self, model_name: str, model_version: int, config: ResultCacheConfig):
+      """
+      Enables or disables caching of inference results of a model. Only enable it for deterministic models.
+      """
+      model = await self._update_model_settings(model_name, model_version, {"result_cache": config.model_dump()})
+      if not config.enabled:
+        for file_id in model_file_ids(model):
+          result_cache.invalidate(file_id)
+      return {"message": f"Result cache of model '{model_name}' (v{model_version}) updated.", "result_cache": config.model_dump()}
+
+  async def set_profiling(self, model_name: str, model_version: int, config: ProfilingConfig):
+      """
+      Enables or disables profiling of a sample of the inference requests of a model.
+      """
+      await self._update_model_settings(model_name, model_version, {"profiling": config.model_dump()})
+      return {"message": f"Profiling of model '{model_name}' (v{model_version}) updated.", "profiling": config.model_dump()}
+
+  async def _update_model_settings(self, model_name: str, model_version: int, settings: dict):
+      """
+      Stores per-model settings in the model document and refreshes its route.
+      """
+      model = await self.db_controller.find_one({"name": model_name, "version": model_version})
+      if not model:
+          raise NotFoundError("Model not found.")
+
+      await self.db_controller.update_one({"_id": model["_id"]}, {"$set": settings})
+      routing_table.update({**model, **settings})
+      return model
@@ -1,84 +1,365 @@
+from functools import partial
+from os import environ
+import json
+import time
 import onnxruntime as ort
-from pydantic import BaseModel
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from pydantic import BaseModel, model_validator
 import numpy as np
 from bson import ObjectId
 from app.controller.database import DatabaseController
-from app.util.errors import BadRequestError, NotFoundError
+from app.controller.artifact_cache import artifact_cache
+from app.controller.model_bundles import bundle_cache
+from app.controller.session_cache import session_cache, load_session
+from app.controller.routing_table import routing_table
+from app.controller.model_states import model_states
+from app.controller.result_cache import result_cache
+from app.controller.inference_executor import Deadline, inference_executor
+from app.controller.batching import micro_batcher
+from app.controller.profiling_controller import ProfilingController, is_sampled, run_profiled
+from app.controller.session_config import build_session_options
+from app.controller.single_flight import session_loads
+from app.controller.worker_pool import RemoteSession, worker_pool
+from app.util.errors import BadRequestError, ErrorWithStatusCode, NotFoundError
 from app.util.constants import STATUS_DEPLOYED
+from app.util.json_codec import round_floats
+from app.util.metrics import inference_in_flight, inference_requests, inference_stage_seconds, model_labels
+from app.util.model_signature import session_signature, shape_mismatch
+from app.util.model_variants import select_variant
+from app.util.ndjson import ndjson_line
+
+# Default number of rows per session run of the streaming endpoints
+STREAM_BATCH_SIZE = int(environ.get("NEXON_STREAM_BATCH_SIZE", "256"))
 
 class InferenceRequest(BaseModel):
-    input: list
+    input: Optional[list] = None  # Tensor for the first model input
+    inputs: Optional[Dict[str, Any]] = None  # Tensors by model input name
+    outputs: Optional[List[str]] = None  # Output names to fetch, defaults to the first model output
+
+    @model_validator(mode="after")
+    def check_inputs(self):
+        if (self.input is None) == (self.inputs is None):
+            raise ValueError("Exactly one of 'input' or 'inputs' must be given")
+        return self
     
 onnx_to_numpy_dtype = {
     "tensor(float)": np.float32,
+    "tensor(double)": np.float64,
+    "tensor(float16)": np.float16,
+    "tensor(int8)": np.int8,
+    "tensor(int16)": np.int16,
+    "tensor(int32)": np.int32,
     "tensor(int64)": np.int64,
-    "tensor(double)": np.float64
+    "tensor(uint8)": np.uint8,
+    "tensor(uint16)": np.uint16,
+    "tensor(uint32)": np.uint32,
+    "tensor(uint64)": np.uint64,
+    "tensor(bool)": np.bool_,
+    "tensor(string)": np.object_,
 }
 
 class InferenceController:
   def __init__(self, db_controller: DatabaseController):
     self.db_controller = db_controller
+    self.profile_id = None  # Id of the profile stored by the last profiled inference
 
   async def infer(self, request: InferenceRequest, model_name: str, model_version: int = None):
     """
     Runs inference on the uploaded ONNX model with the given inputs.
     """
-    file_id = None
+    inputs = request.inputs if request.inputs is not None else request.input
+    results = await self.run_inference(inputs, model_name, model_version, request.outputs)
+    return {"results": list(results.values()), "outputs": list(results.keys())}
+
+  async def run_inference(self, inputs, model_name: str, model_version: int = None, output_names: list = None, profile: bool = False, variant: str = None, deadline: Deadline = None) -> dict:
+    """
+    Runs inference on the uploaded ONNX model and returns the raw session outputs by output name.
+    Inputs are either a single tensor for the first model input or a dict of tensors by input name,
+    each given as nested list or already decoded NumPy array.
+    Only the requested outputs are fetched from the session, by default the first model output.
+    With profile, or if the request is sampled for profiling by the model's configuration, it runs on a profiling session.
+    The request runs on the given variant of the model, by default on the model's default variant or the original.
+    With a deadline, the request is rejected if it can not be served in time and its session run is terminated once the deadline passes.
+    """
+    model = select_variant(await self.resolve_model(model_name, model_version), variant)
+    labels = model_labels(model)
+    inference_in_flight.inc(**labels)
+    try:
+      results = await self._run_inference(model, inputs, output_names, profile, deadline)
+    except Exception:
+      inference_requests.inc(**labels, outcome="error")
+      raise
+    finally:
+      inference_in_flight.dec(**labels)
+    inference_requests.inc(**labels, outcome="success")
+    return results
+
+  async def _run_inference(self, model: dict, inputs, output_names: list = None, profile: bool = False, deadline: Deadline = None) -> dict:
+    session = await self.get_session(model)
+    labels = model_labels(model)
+
+    try:
+        signature = self._signature(model, session)
+        with inference_stage_seconds.time(**labels, stage="input_conversion"):
+          feeds = self._feeds(signature, inputs)
+        output_names = self._output_names(signature, output_names)
+
+        trigger = "request" if profile else ("sampled" if is_sampled(model) else None)
+        if trigger is not None:
+          results = await self.run_profiled(model, feeds, output_names, trigger)
+        else:
+          with inference_stage_seconds.time(**labels, stage="run"):
+            results = await self.run_cached(model, session, feeds, output_names, deadline)
+        model_states.mark_served(model["file_id"])
+        return dict(zip(output_names, results))
+
+    except ErrorWithStatusCode:
+        raise
+    except Exception as e:
+        raise BadRequestError(f"Inference error: {str(e)}")
+
+  async def stream_inference(self, lines: AsyncIterator[bytes], model_name: str, model_version: int = None, output_names: list = None, batch_size: int = STREAM_BATCH_SIZE, is_disconnected: Callable[[], Awaitable[bool]] = None, precision: int = None, variant: str = None) -> AsyncIterator[bytes]:
+    """
+    Runs inference on a stream of NDJSON rows and returns a stream of NDJSON results in the same order.
+    Each line is one row without the batch dimension, either for the first model input or a dict of rows by input name.
+    Rows are stacked into batches of up to batch_size rows, so only one batch is held in memory at a time.
+    Every result line is {"results": [row of each output]}, or {"error": message} for rows that could not be processed.
+    The model is resolved and loaded before the stream starts, so unknown models fail the request itself.
+    The stream stops before the next batch once is_disconnected reports that the client went away.
+    Float results are rounded to precision decimals if given.
+    """
+    if batch_size < 1:
+      raise BadRequestError("The batch size must be at least 1.")
+    model = select_variant(await self.resolve_model(model_name, model_version), variant)
+    session = await self.get_session(model)
+    signature = self._signature(model, session)
+    output_names = self._output_names(signature, output_names)
+    return self._stream_batches(lines, model, session, signature, output_names, batch_size, is_disconnected, precision)
+
+  async def _stream_batches(self, lines: AsyncIterator[bytes], model: dict, session, signature: dict, output_names: list, batch_size: int, is_disconnected=None, precision: int = None) -> AsyncIterator[bytes]:
+    rows = []
+    batch_key = None
+    async for line in lines:
+      try:
+        feeds = self._feeds(signature, json.loads(line), batched=False)
+      except (ValueError, ErrorWithStatusCode) as e:
+        # Flush first to keep the results in the order of the rows
+        async for result in self._run_stream_batch(model, session, rows, output_names, precision):
+          yield result
+        rows = []
+        yield ndjson_line({"error": f"Invalid row: {str(e)}"})
+        continue
+
+      # Rows of different shapes or dtypes cannot be stacked into one batch
+      key = tuple((name, np.shape(value), str(getattr(value, "dtype", type(value)))) for name, value in feeds.items())
+      if rows and (key != batch_key or len(rows) >= batch_size):
+        async for result in self._run_stream_batch(model, session, rows, output_names, precision):
+          yield result
+        rows = []
+        if is_disconnected is not None and await is_disconnected():
+          return
+      batch_key = key
+      rows.append(feeds)
+
+    if is_disconnected is not None and await is_disconnected():
+      return
+    async for result in self._run_stream_batch(model, session, rows, output_names, precision):
+      yield result
+
+  async def _run_stream_batch(self, model: dict, session, rows: list, output_names: list, precision: int = None) -> AsyncIterator[bytes]:
+    if not rows:
+      return
+    try:
+      feeds = {name: np.stack([row[name] for row in rows]) for name in rows[0]}
+      results = await self.run_session(model, session, feeds, output_names)
+    except Exception as e:
+      error = ndjson_line({"error": f"Inference error: {str(e)}"})
+      for _ in rows:
+        yield error
+      return
+    for index in range(len(rows)):
+      yield ndjson_line({"results": [round_floats(result[index], precision) for result in results]})
+
+  async def resolve_model(self, model_name: str, model_version: int = None) -> dict:
+    """
+    Resolves the deployed model from the routing table, falling back to the database.
+    """
+    start = time.perf_counter()
+    model = routing_table.resolve(model_name, model_version)
+    if model is None:
+      model = await self._find_deployed_model(model_name, model_version)
+      routing_table.update(model)
+    inference_stage_seconds.observe(time.perf_counter() - start, **model_labels(model), stage="routing")
+    return model
+
+  def _signature(self, model: dict, session) -> dict:
+    """
+    Returns the signature stored with the model, reading it from the session for models uploaded without one.
+    """
+    if not model.get("signature"):
+      model["signature"] = session_signature(session)
+    return model["signature"]
+
+  def _feeds(self, signature: dict, inputs, batched: bool = True) -> dict:
+    """
+    Converts the given inputs to C-contiguous NumPy arrays of the model's input types, keyed by input name,
+    and validates their shapes against the model signature. Rows of the streaming endpoints have no batch dimension.
+    """
+    model_inputs = {model_input["name"]: model_input for model_input in signature["inputs"]}
+    if not isinstance(inputs, dict):
+      inputs = {signature["inputs"][0]["name"]: inputs}
+
+    unknown_inputs = [name for name in inputs if name not in model_inputs]
+    if unknown_inputs:
+      raise BadRequestError(f"Unknown inputs {unknown_inputs}. The model expects {list(model_inputs)}.")
+    missing_inputs = [name for name in model_inputs if name not in inputs]
+    if missing_inputs:
+      raise BadRequestError(f"Missing inputs {missing_inputs}. The model expects {list(model_inputs)}.")
+
+    feeds = {}
+    for name, value in inputs.items():
+      model_input = model_inputs[name]
+      dtype = onnx_to_numpy_dtype.get(model_input["type"])
+      if dtype is None:
+        # Types without a NumPy equivalent (e.g. sequences, maps or bfloat16) are passed to ONNX Runtime unchanged
+        feeds[name] = value
+        continue
+      try:
+        feeds[name] = np.asarray(value, dtype=dtype, order="C")
+      except (ValueError, TypeError) as e:
+        raise BadRequestError(f"Input '{name}' can not be converted to {model_input['type']}: {str(e)}")
+
+      expected = model_input["shape"]
+      if expected is not None and not batched:
+        expected = expected[1:]
+      if shape_mismatch(feeds[name].shape, expected):
+        expected = [dim if dim is not None else "?" for dim in expected]
+        raise BadRequestError(f"Input '{name}' has shape {list(feeds[name].shape)}, the model expects {expected}.")
+    return feeds
+
+  def _output_names(self, signature: dict, output_names: list = None) -> list:
+    """
+    Validates the requested output names, defaulting to the first model output.
+    """
+    model_outputs = [model_output["name"] for model_output in signature["outputs"]]
+    if not output_names:
+      return model_outputs[:1]
+    unknown_outputs = [name for name in output_names if name not in model_outputs]
+    if unknown_outputs:
+      raise BadRequestError(f"Unknown outputs {unknown_outputs}. The model provides {model_outputs}.")
+    return list(dict.fromkeys(output_names))
+
+  async def run_cached(self, model: dict, session: ort.InferenceSession | RemoteSession, feeds: dict, output_names: list, deadline: Deadline = None):
+    """
+    Runs the session, serving repeated requests from the result cache if it is enabled for the model.
+    """
+    config = model.get("result_cache") or {}
+    key = result_cache.key(model["file_id"], feeds, output_names) if config.get("enabled") else None
+    if key is None:
+      return await self.run_session(model, session, feeds, output_names, deadline)
+
+    results = result_cache.get(key, model["name"])
+    if results is None:
+      results = await self.run_session(model, session, feeds, output_names, deadline)
+      result_cache.put(key, model["name"], results, config.get("ttl_seconds"))
+    return results
+
+  async def run_profiled(self, model: dict, feeds: dict, output_names: list, trigger: str):
+    """
+    Runs the request on a dedicated session with ONNX Runtime profiling enabled and stores the trace.
+    """
+    model_source = await self._model_source(model)
+    options = build_session_options(model.get("session_config"), len(routing_table.ids))
+    results, trace = await inference_executor.run(model["file_id"], model.get("concurrency"), run_profiled, model_source, options, feeds, output_names)
+    self.profile_id = await ProfilingController(self.db_controller).store_profile(model, trace, trigger)
+    return results
+
+  async def run_session(self, model: dict, session: ort.InferenceSession | RemoteSession, feeds: dict, output_names: list | None, deadline: Deadline = None):
+    """
+    Runs the session on the inference thread pool, or in its worker process if the worker pool is enabled.
+    Requests are batched with concurrent requests if enabled for the model.
+    The deadline applies to the admission of unbatched requests, and terminates their run through its RunOptions.
+    Batched requests only check it before joining a batch, as a batch run serves several requests.
+    """
+    file_id = model["file_id"]
+    remote = isinstance(session, RemoteSession)
+    if remote:
+      execute = partial(inference_executor.admit, file_id, model.get("concurrency"), session.run)
+    else:
+      execute = partial(inference_executor.run, file_id, model.get("concurrency"), session.run)
+    scheduler = micro_batcher.scheduler(file_id, model.get("batching"))
+    if scheduler is not None:
+      if deadline is not None:
+        deadline.check()
+      return await scheduler.run(feeds, output_names, execute)
+    if deadline is None:
+      return await execute(output_names, feeds)
+    if remote:
+      return await execute(output_names, feeds, deadline=deadline)
+    return await execute(output_names, feeds, deadline.run_options, deadline=deadline)
+
+  async def _find_deployed_model(self, model_name: str, model_version: int = None) -> dict:
+    """
+    Looks up the deployed model in the database if it is not in the routing table yet.
+    """
     if model_version is not None:
       model = await self.db_controller.find_one({"name": f"{model_name}", "version": model_version, "status": STATUS_DEPLOYED})
       if model:
-        file_id = model["file_id"]
+        return model
       else:
         raise NotFoundError("No model with this name and version has been deployed")
     else:
       models = await self.db_controller.find_and_sort({"name": model_name, "status": STATUS_DEPLOYED}, [("version", -1)])
       if not models:
         raise NotFoundError("No model with this name has been deployed")
-      file_id = models[0]["file_id"]
-      
-    # models = await self.db_controller.find({"name": model_name})
-    # if not models:
-    #   raise NotFoundError("No model with this name has been uploaded")
-    # file_id = None
-    # for model in models:
-    #   if model["status"] == STATUS_DEPLOYED:
-    #       file_id = model["file_id"]
-    #       break
-    # if file_id == None:
-    #   raise NotFoundError("No model with this name has been deployed")
-        
-    try:
-      grid_out = await self.db_controller.download_file(file_id=ObjectId(file_id))
-      model_bytes = await grid_out.read()
-      session = ort.InferenceSession(model_bytes)
-    except Exception as e: 
-        raise Exception(f"Server error: {str(e)}. This could be due to a corrupted file or a database disconnection. Please try uploading the model again or try again later.")
-
-    try:
-        # Convert input data to NumPy array
-        
-        type = onnx_to_numpy_dtype.get(session.get_inputs()[0].type)
-        input_data = np.array(request.input).astype(type)
-        input_data = request.input
-        input_name = session.get_inputs()[0].name
-        output_name = session.get_outputs()[0].name
+      return models[0]
 
+  async def get_session(self, model: dict) -> ort.InferenceSession | RemoteSession:
+    """
+    Returns the inference session of the given model, building and caching it on a cache miss.
+    Concurrent requests for a model that is not loaded yet share a single load.
+    With the worker pool enabled, the session is loaded in the model's worker process instead.
+    """
+    file_id = model["file_id"]
+    if worker_pool.enabled:
+      try:
+        return await worker_pool.session(model, len(routing_table.ids), partial(self._model_source, model))
+      except ErrorWithStatusCode:
+        raise
+      except Exception as e:
+        raise Exception(f"Server error: {str(e)}. This could be due to a corrupted file or a database disconnection. Please try uploading the model again or try again later.")
 
-        # Currently poses some problems because the shape format isn't always the same and mismatching shapes do not necessarily lead to an error
+    session = session_cache.get(file_id)
+    if session is not None:
+      return session
+    return await session_loads.load(str(file_id), partial(self._load_session, model))
 
-        # Check input shape compatibility
-        # expected_shape = session.get_inputs()[0].shape
-        # if list(input_data.shape) != expected_shape:
-        #     raise HTTPException(
-        #         status_code=400,
-        #         detail=f"Input shape mismatch. Expected: {expected_shape}, Received: {list(input_data.shape)}",
-        #     )
+  async def _load_session(self, model: dict) -> ort.InferenceSession:
+    try:
+      model_source = await self._model_source(model)
+      options = build_session_options(model.get("session_config"), len(routing_table.ids))
+      with inference_stage_seconds.time(**model_labels(model), stage="session"):
+        session, footprint = await inference_executor.submit(load_session, model_source, options)
+    except Exception as e: 
+        raise Exception(f"Server error: {str(e)}. This could be due to a corrupted file or a database disconnection. Please try uploading the model again or try again later.")
 
-        # Run inference
-        results = session.run([output_name], {input_name: input_data})
+    session_cache.put(model["file_id"], model["name"], session, footprint)
+    return session
 
-        json_results = [result.tolist() for result in results]
-        return {"results": json_results}
+  async def _model_source(self, model: dict) -> bytes | str:
+    """
+    Returns the path of the model file in the local artifact cache if it is enabled, otherwise the downloaded model.
+    Models with external data are always materialized on disk with their external data files and loaded from the path.
+    """
+    if model.get("external_data"):
+      with inference_stage_seconds.time(**model_labels(model), stage="download"):
+        return await bundle_cache.path(model, lambda file_id: self.db_controller.download_file(file_id=ObjectId(file_id)))
+    if not artifact_cache.enabled:
+      return await self._download_model(model)
+    with inference_stage_seconds.time(**model_labels(model), stage="download"):
+      return await artifact_cache.path(model["file_id"], partial(self.db_controller.download_file, file_id=ObjectId(model["file_id"])))
 
-    except Exception as e:
-        raise BadRequestError(f"Inference error: {str(e)}")
\ No newline at end of file
+  async def _download_model(self, model: dict) -> bytes:
+    with inference_stage_seconds.time(**model_labels(model), stage="download"):
+      grid_out = await self.db_controller.download_file(file_id=ObjectId(model["file_id"]))
+      return await grid_out.read()
@@ -0,0 +1,253 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from os import environ
+import asyncio
+import logging
+import math
+import os
+import time
+import onnxruntime as ort
+from app.util.errors import ClientClosedRequestError, ServiceUnavailableError, TooManyRequestsError
+
+logger = logging.getLogger("uvicorn")
+
+# Threads running ONNX Runtime sessions. ORT releases the GIL, so these run in parallel to the event loop.
+INFERENCE_THREADS = int(environ.get("NEXON_INFERENCE_THREADS", str(os.cpu_count() or 4)))
+# Default number of concurrent session runs per model
+MODEL_MAX_IN_FLIGHT = int(environ.get("NEXON_MODEL_MAX_IN_FLIGHT", "4"))
+# Default number of requests per model waiting for a free slot before new requests are rejected
+MODEL_MAX_QUEUE = int(environ.get("NEXON_MODEL_MAX_QUEUE", "64"))
+# Default time in milliseconds a request waits for a free slot before it is rejected. Unset waits as long as needed.
+MODEL_MAX_QUEUE_WAIT_MS = float(environ["NEXON_MODEL_MAX_QUEUE_WAIT_MS"]) if environ.get("NEXON_MODEL_MAX_QUEUE_WAIT_MS") else None
+# Seconds between checks whether the client of a running request disconnected
+DISCONNECT_POLL_INTERVAL = 0.05
+# Weight of the latest run in the moving average of the run time of a model
+RUN_TIME_SMOOTHING = 0.2
+
+DEADLINE_EXCEEDED = "deadline exceeded"
+CLIENT_DISCONNECTED = "client disconnected"
+
+
+class Deadline():
+  """
+  Time budget of an inference request and its cancellation.
+  Requests that cannot be admitted before their deadline are rejected, running session runs are terminated
+  through their RunOptions once the deadline passes or the client disconnects.
+  """
+  def __init__(self, timeout_ms: float = None, is_disconnected=None):
+    self.expires = time.monotonic() + timeout_ms / 1000 if timeout_ms is not None else None
+    self.is_disconnected = is_disconnected
+    self.run_options = ort.RunOptions()
+    self.reason = None
+
+  def remaining(self) -> float | None:
+    """Seconds left until the deadline, None without a deadline."""
+    if self.expires is None:
+      return None
+    return max(self.expires - time.monotonic(), 0.0)
+
+  def expired(self) -> bool:
+    return self.expires is not None and time.monotonic() >= self.expires
+
+  def cancel(self, reason: str):
+    self.reason = reason
+    self.run_options.terminate = True
+
+  def check(self):
+    """
+    Raises if the request was cancelled or its deadline passed.
+    """
+    if self.reason is None and self.expired():
+      self.reason = DEADLINE_EXCEEDED
+    if self.reason == CLIENT_DISCONNECTED:
+      raise ClientClosedRequestError("The client disconnected before the inference finished.")
+    if self.reason == DEADLINE_EXCEEDED:
+      raise ServiceUnavailableError("The request deadline passed before the inference finished.")
+
+  async def guard(self, awaitable):
+    """
+    Awaits a session run, terminating it when the deadline passes or the client disconnects.
+    A terminated run still occupies its thread, or its worker process which cannot be terminated, until it returns,
+    so the run is awaited before its error is raised and the model's slot is held until then.
+    """
+    if self.expires is None and self.is_disconnected is None:
+      return await awaitable
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.create_task(self._watch())
+    try:
+      done, _ = await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+      if task not in done:
+        await self._settle(task)
+      elif task.exception() is None:
+        return task.result()
+      self.check()
+      return task.result()
+    except asyncio.CancelledError:
+      # The request itself was cancelled, e.g. when the server shuts down
+      self.cancel(CLIENT_DISCONNECTED)
+      await self._settle(task)
+      raise
+    finally:
+      watcher.cancel()
+
+  async def _settle(self, task: asyncio.Future):
+    """
+    Waits for a terminated run to return, discarding its result or error.
+    """
+    await asyncio.wait({task})
+    if not task.cancelled():
+      task.exception()
+
+  async def _watch(self):
+    while True:
+      remaining = self.remaining()
+      await asyncio.sleep(DISCONNECT_POLL_INTERVAL if remaining is None else min(remaining, DISCONNECT_POLL_INTERVAL))
+      if self.expired():
+        self.cancel(DEADLINE_EXCEEDED)
+        return
+      if self.is_disconnected is not None and await self.is_disconnected():
+        self.cancel(CLIENT_DISCONNECTED)
+        return
+
+
+class ModelLimiter():
+  """
+  Bounds the number of concurrent session runs of a model and the number of requests waiting for one.
+  Requests are rejected right away when the queue is full (429) or when the expected wait for a slot,
+  estimated from the average run time, would exceed their deadline (503).
+  Queued requests give up once they waited max_queue_wait_ms or their deadline passed (503).
+  """
+  def __init__(self, max_in_flight: int, max_queue: int, max_queue_wait_ms: float = None):
+    self.max_in_flight = max_in_flight
+    self.max_queue = max_queue
+    self.max_queue_wait_ms = max_queue_wait_ms
+    self.semaphore = asyncio.Semaphore(max_in_flight)
+    self.in_flight = 0
+    self.queued = 0
+    self.rejected = 0
+    self.shed = 0
+    self.timed_out = 0
+    self.average_run_time = 0.0
+
+  def expected_wait(self) -> float:
+    """
+    Estimates the seconds until a new request would be admitted and finished.
+    """
+    if not self.semaphore.locked():
+      return self.average_run_time
+    return (math.floor(self.queued / self.max_in_flight) + 1) * self.average_run_time + self.average_run_time
+
+  @asynccontextmanager
+  async def slot(self, deadline: Deadline = None):
+    if self.semaphore.locked() and self.queued >= self.max_queue:
+      self.rejected += 1
+      raise TooManyRequestsError("Too many pending requests for this model, please try again later.")
+    remaining = deadline.remaining() if deadline is not None else None
+    if remaining is not None and (remaining <= 0 or self.expected_wait() > remaining):
+      self.shed += 1
+      raise ServiceUnavailableError("The request can not be served before its deadline, please try again later.")
+
+    timeout = self.max_queue_wait_ms / 1000 if self.max_queue_wait_ms is not None else None
+    if remaining is not None:
+      timeout = remaining if timeout is None else min(timeout, remaining)
+    self.queued += 1
+    try:
+      await asyncio.wait_for(self.semaphore.acquire(), timeout)
+    except asyncio.TimeoutError:
+      self.timed_out += 1
+      raise ServiceUnavailableError("The request waited too long for the model, please try again later.")
+    finally:
+      self.queued -= 1
+    self.in_flight += 1
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      run_time = time.perf_counter() - start
+      self.average_run_time = run_time if not self.average_run_time else (1 - RUN_TIME_SMOOTHING) * self.average_run_time + RUN_TIME_SMOOTHING * run_time
+      self.in_flight -= 1
+      self.semaphore.release()
+
+  def stats(self):
+    return {
+      "max_in_flight": self.max_in_flight,
+      "max_queue": self.max_queue,
+      "in_flight": self.in_flight,
+      "queued": self.queued,
+      "rejected": self.rejected,
+      "max_queue_wait_ms": self.max_queue_wait_ms,
+      "shed": self.shed,
+      "timed_out": self.timed_out,
+      "average_run_ms": round(self.average_run_time * 1000, 3),
+    }
+
+
+class InferenceExecutor():
+  """
+  Runs blocking ONNX Runtime calls on a dedicated thread pool so the event loop stays responsive.
+  Session runs are admitted per model, so a heavy model cannot occupy all threads.
+  """
+  def __init__(self, max_workers: int, max_in_flight: int, max_queue: int, max_queue_wait_ms: float = None):
+    self.max_workers = max_workers
+    self.max_in_flight = max_in_flight
+    self.max_queue = max_queue
+    self.max_queue_wait_ms = max_queue_wait_ms
+    self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="nexon-inference")
+    self.limiters: dict[str, ModelLimiter] = {}
+
+  def limiter(self, model_key: str, concurrency: dict = None) -> ModelLimiter:
+    """
+    Returns the limiter of a model, (re)creating it when its configured limits changed.
+    """
+    concurrency = concurrency or {}
+    max_in_flight = concurrency.get("max_in_flight") or self.max_in_flight
+    max_queue = concurrency.get("max_queue")
+    if max_queue is None:
+      max_queue = self.max_queue
+    max_queue_wait_ms = concurrency.get("max_queue_wait_ms") or self.max_queue_wait_ms
+    limiter = self.limiters.get(str(model_key))
+    if limiter is None or limiter.max_in_flight != max_in_flight or limiter.max_queue != max_queue or limiter.max_queue_wait_ms != max_queue_wait_ms:
+      limiter = ModelLimiter(max_in_flight, max_queue, max_queue_wait_ms)
+      self.limiters[str(model_key)] = limiter
+    return limiter
+
+  async def run(self, model_key: str, concurrency: dict, func, *args, deadline: Deadline = None, **kwargs):
+    """
+    Runs func on the thread pool once the model has a free slot.
+    With a deadline, the request is only admitted if it can be served in time and func is expected to take the deadline's RunOptions.
+    """
+    async with self.limiter(model_key, concurrency).slot(deadline):
+      if deadline is None:
+        return await self.submit(func, *args, **kwargs)
+      deadline.check()
+      return await deadline.guard(self.submit(func, *args, **kwargs))
+
+  async def admit(self, model_key: str, concurrency: dict, coroutine_function, *args, deadline: Deadline = None, **kwargs):
+    """
+    Awaits coroutine_function once the model has a free slot, e.g. to run a session in a worker process.
+    """
+    async with self.limiter(model_key, concurrency).slot(deadline):
+      if deadline is None:
+        return await coroutine_function(*args, **kwargs)
+      deadline.check()
+      return await deadline.guard(coroutine_function(*args, **kwargs))
+
+  async def submit(self, func, *args, **kwargs):
+    """
+    Runs func on the thread pool without per-model admission, e.g. for building sessions.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(self.pool, partial(func, *args, **kwargs))
+
+  def stats(self):
+    return {
+      "threads": self.max_workers,
+      "models": {model_key: limiter.stats() for model_key, limiter in self.limiters.items()},
+    }
+
+  def shutdown(self):
+    self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+inference_executor = InferenceExecutor(INFERENCE_THREADS, MODEL_MAX_IN_FLIGHT, MODEL_MAX_QUEUE, MODEL_MAX_QUEUE_WAIT_MS)
@@ -0,0 +1,298 @@
+from datetime import datetime
+from os import environ
+from typing import AsyncIterator
+import asyncio
+import io
+import logging
+import time
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import UploadFile
+from app.controller.database import DatabaseController
+from app.controller.inference_controller import STREAM_BATCH_SIZE, InferenceController
+from app.util.errors import BadRequestError, NotFoundError
+from app.util.ndjson import ndjson_records
+from app.util.constants import JOB_STATUS_CANCELLED, JOB_STATUS_COMPLETED, JOB_STATUS_FAILED, JOB_STATUS_QUEUED, JOB_STATUS_RUNNING
+
+logger = logging.getLogger("uvicorn")
+
+# Default number of input rows per result chunk, the unit a job resumes from after a restart
+JOB_CHUNK_ROWS = int(environ.get("NEXON_JOB_CHUNK_ROWS", "10000"))
+# Number of jobs running at the same time
+JOB_CONCURRENCY = int(environ.get("NEXON_JOB_CONCURRENCY", "1"))
+# Seconds a server keeps the claim on a running job without recording a chunk, before another server may take the job over
+JOB_LEASE_SECONDS = float(environ.get("NEXON_JOB_LEASE_SECONDS", "300"))
+
+UNFINISHED_JOB_STATES = [JOB_STATUS_QUEUED, JOB_STATUS_RUNNING]
+
+
+def job_status(job: dict) -> dict:
+  """
+  Public view of a job document, including its progress through the input file.
+  """
+  input_size = job.get("input_size") or 0
+  return {
+    "job_id": str(job["_id"]),
+    "model_name": job["model_name"],
+    "model_version": job["model_version"],
+    "status": job["status"],
+    "rows": job["rows"],
+    "errors": job["errors"],
+    "chunks": len(job["result_files"]),
+    "progress": 1.0 if job["status"] == JOB_STATUS_COMPLETED else (job["input_offset"] / input_size if input_size else 0.0),
+    "error": job.get("error"),
+    "created": job["created"],
+    "updated": job["updated"],
+  }
+
+
+def now() -> str:
+  return datetime.now().isoformat(timespec="seconds")
+
+
+class JobController:
+  def __init__(self, db_controller: DatabaseController):
+    self.db_controller = db_controller
+
+  async def create_job(self, file: UploadFile, model_name: str, model_version: int = None, output_names: list = None, chunk_rows: int = JOB_CHUNK_ROWS, batch_size: int = STREAM_BATCH_SIZE):
+    """
+    Stores an NDJSON input dataset in GridFS and queues a job scoring it against a deployed model.
+    Without a version, the job is bound to the latest version deployed when it is created.
+    """
+    if chunk_rows < 1 or batch_size < 1:
+      raise BadRequestError("The chunk and batch sizes must be at least 1.")
+    model = await InferenceController(self.db_controller).resolve_model(model_name, model_version)
+
+    input_file_id = await self.db_controller.upload_file(f"job-input-{file.filename}", file.file)
+    job = {
+      "model_name": model_name,
+      "model_version": model["version"],
+      "output_names": output_names,
+      "chunk_rows": chunk_rows,
+      "batch_size": batch_size,
+      "status": JOB_STATUS_QUEUED,
+      "input_file_id": str(input_file_id),
+      "input_size": file.size,
+      "input_offset": 0,
+      "rows": 0,
+      "errors": 0,
+      "result_files": [],
+      "error": None,
+      "created": now(),
+      "updated": now(),
+    }
+    job["_id"] = await self.db_controller.insert_job(job)
+    job_runner.submit(self.db_controller, job["_id"])
+    return job_status(job)
+
+  async def get_job(self, job_id: str):
+    return job_status(await self._find_job(job_id))
+
+  async def list_jobs(self):
+    return [job_status(job) for job in await self.db_controller.find_jobs({})]
+
+  async def results(self, job_id: str) -> AsyncIterator[bytes]:
+    """
+    Returns the NDJSON results of the completed chunks of a job, one line per input row.
+    """
+    job = await self._find_job(job_id)
+    return self._read_files(job["result_files"])
+
+  async def cancel_job(self, job_id: str):
+    """
+    Stops a queued or running job after its current chunk. Results of completed chunks are kept.
+    """
+    job = await self._find_job(job_id)
+    result = await self.db_controller.update_job(
+      {"_id": job["_id"], "status": {"$in": UNFINISHED_JOB_STATES}},
+      {"$set": {"status": JOB_STATUS_CANCELLED, "updated": now()}},
+    )
+    if result.modified_count == 0:
+      raise BadRequestError(f"Job {job_id} is already {job['status']}.")
+    return await self.get_job(job_id)
+
+  async def delete_job(self, job_id: str):
+    """
+    Deletes a job with its input and result files, stopping it if it still runs.
+    """
+    job = await self._find_job(job_id)
+    await self.db_controller.delete_job({"_id": job["_id"]})
+    for file_id in [job["input_file_id"], *job["result_files"]]:
+      await self.db_controller.delete_file(ObjectId(file_id))
+    return {"message": f"Job {job_id} deleted successfully."}
+
+  async def _find_job(self, job_id: str) -> dict:
+    try:
+      job = await self.db_controller.find_job({"_id": ObjectId(job_id)})
+    except InvalidId:
+      job = None
+    if job is None:
+      raise NotFoundError(f"No job with id {job_id}.")
+    return job
+
+  async def _read_files(self, file_ids: list[str]) -> AsyncIterator[bytes]:
+    for file_id in file_ids:
+      grid_out = await self.db_controller.download_file(ObjectId(file_id))
+      async for chunk in grid_out:
+        yield chunk
+
+
+class JobRunner():
+  """
+  Runs batch inference jobs in the background. The input is scored chunk by chunk, and every chunk's results
+  are stored as a GridFS file together with the input offset reached, so a job resumes from its last completed chunk
+  after a restart.
+  A job runs on the one server that claimed it: the claim sets the job's owner and a lease that is renewed with
+  every recorded chunk, and a job is only claimed when it has no owner or its owner's lease expired,
+  so servers sharing the database never score the same job twice.
+  """
+  def __init__(self, concurrency: int, lease_seconds: float = JOB_LEASE_SECONDS):
+    self.concurrency = concurrency
+    self.lease_seconds = lease_seconds
+    self.owner = str(ObjectId())  # Identifies the jobs claimed by this server
+    self.semaphore: asyncio.Semaphore = None
+    self.tasks: dict[str, asyncio.Task] = {}
+    self.db_controller: DatabaseController = None
+
+  async def start(self, db_controller: DatabaseController):
+    """
+    Resumes the jobs that were queued, or running on a server whose lease expired, when the server stopped.
+    """
+    jobs = await db_controller.find_jobs(self._claimable({}))
+    for job in reversed(jobs):
+      self.submit(db_controller, str(job["_id"]))
+    if jobs:
+      logger.info(f"Resuming {len(jobs)} batch inference jobs.")
+
+  def submit(self, db_controller: DatabaseController, job_id: str):
+    """
+    Runs a job once a slot is free, if this server can claim it then.
+    """
+    if self.semaphore is None:
+      self.semaphore = asyncio.Semaphore(self.concurrency)
+    self.db_controller = db_controller
+    task = asyncio.create_task(self._run(db_controller, job_id))
+    self.tasks[job_id] = task
+    task.add_done_callback(lambda _: self.tasks.pop(job_id, None))
+
+  async def stop(self):
+    """
+    Interrupts all jobs. Running jobs stay marked as running and their leases are released,
+    so they are resumed on the next start.
+    """
+    job_ids = list(self.tasks)
+    tasks = list(self.tasks.values())
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for job_id in job_ids:
+      await self.db_controller.update_job({"_id": ObjectId(job_id), "owner": self.owner}, {"$set": {"lease_until": 0}})
+
+  async def _run(self, db_controller: DatabaseController, job_id: str):
+    async with self.semaphore:
+      await self.run_job(db_controller, job_id)
+
+  async def run_job(self, db_controller: DatabaseController, job_id: str):
+    job = await db_controller.claim_job(
+      self._claimable({"_id": ObjectId(job_id)}),
+      {"$set": {"status": JOB_STATUS_RUNNING, "owner": self.owner, "lease_until": self._lease(), "updated": now()}},
+    )
+    if job is None:
+      # The job finished, was cancelled or deleted, or another server holds it
+      return
+    try:
+      await self._discard_unrecorded_chunks(db_controller, job)
+      if not await self._score(db_controller, job):
+        logger.info(f"Batch inference job {job_id} was cancelled or taken over by another server.")
+        return
+      await db_controller.update_job(
+        {"_id": job["_id"], "status": JOB_STATUS_RUNNING, "owner": self.owner},
+        {"$set": {"status": JOB_STATUS_COMPLETED, "updated": now()}},
+      )
+      logger.info(f"Batch inference job {job_id} completed.")
+    except asyncio.CancelledError:
+      raise
+    except Exception as e:
+      logger.error(f"Batch inference job {job_id} failed: {e}")
+      await db_controller.update_job(
+        {"_id": job["_id"], "status": JOB_STATUS_RUNNING, "owner": self.owner},
+        {"$set": {"status": JOB_STATUS_FAILED, "error": str(e), "updated": now()}},
+      )
+
+  async def _score(self, db_controller: DatabaseController, job: dict) -> bool:
+    """
+    Scores the input from the job's offset on, recording every chunk and renewing the lease with it.
+    Returns False if the job was cancelled, deleted or taken over by another server.
+    """
+    inference_controller = InferenceController(db_controller)
+    grid_out = await db_controller.download_file(ObjectId(job["input_file_id"]))
+    grid_out.seek(job["input_offset"])
+    records = ndjson_records(grid_out, job["input_offset"])
+    chunk = len(job["result_files"])
+
+    while True:
+      rows, offset = await self._read_chunk(records, job["chunk_rows"])
+      if not rows:
+        return True
+      results = await inference_controller.stream_inference(
+        self._iterate(rows), job["model_name"], job["model_version"], job["output_names"], job["batch_size"]
+      )
+      buffer = io.BytesIO()
+      errors = 0
+      async for line in results:
+        buffer.write(line)
+        errors += line.startswith(b'{"error"')
+
+      file_id = await db_controller.upload_file(
+        f"job-{job['_id']}-{chunk:06d}.ndjson", buffer.getvalue(), metadata={"job_id": str(job["_id"]), "chunk": chunk}
+      )
+      # Results and offset are recorded together, so a resumed job neither skips nor repeats rows
+      result = await db_controller.update_job(
+        {"_id": job["_id"], "status": JOB_STATUS_RUNNING, "owner": self.owner},
+        {
+          "$push": {"result_files": str(file_id)},
+          "$set": {"input_offset": offset, "lease_until": self._lease(), "updated": now()},
+          "$inc": {"rows": len(rows), "errors": errors},
+        },
+      )
+      if result.matched_count == 0:
+        await db_controller.delete_file(file_id)
+        return False
+      chunk += 1
+
+  def _claimable(self, query: dict) -> dict:
+    """
+    Restricts a query to unfinished jobs without an owner or whose owner's lease expired.
+    """
+    return {
+      **query,
+      "status": {"$in": UNFINISHED_JOB_STATES},
+      "$or": [{"owner": None}, {"lease_until": {"$lt": time.time()}}],
+    }
+
+  def _lease(self) -> float:
+    return time.time() + self.lease_seconds
+
+  async def _read_chunk(self, records: AsyncIterator[tuple[bytes, int]], chunk_rows: int) -> tuple[list[bytes], int]:
+    rows = []
+    offset = None
+    async for line, offset in records:
+      rows.append(line)
+      if len(rows) >= chunk_rows:
+        break
+    return rows, offset
+
+  async def _iterate(self, rows: list[bytes]) -> AsyncIterator[bytes]:
+    for row in rows:
+      yield row
+
+  async def _discard_unrecorded_chunks(self, db_controller: DatabaseController, job: dict):
+    """
+    Deletes result files of a chunk that was interrupted after its upload but before it was recorded.
+    """
+    for grid_file in await db_controller.find_files({"metadata.job_id": str(job["_id"])}):
+      if str(grid_file._id) not in job["result_files"]:
+        await db_controller.delete_file(grid_file._id)
+
+
+job_runner = JobRunner(JOB_CONCURRENCY)
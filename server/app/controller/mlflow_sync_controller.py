@@ -2,8 +2,10 @@ from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 from bson import ObjectId
 from fastapi import BackgroundTasks, Response
+import asyncio
 import mlflow
 import os
+import posixpath
 import tempfile
 import mlflow.artifacts
 from pydantic import BaseModel
@@ -12,10 +14,20 @@ import traceback
 
 from mlflow.entities.model_registry import RegisteredModel
 
+from app.controller.blob_store import BlobStore
 from app.controller.database import DatabaseController, ModelMetadata
 from app.util.constants import STATUS_DEPLOYED, STATUS_DOWNLOADING, STATUS_UPLOADED
 from app.util.file_utils import convert_size
+from app.util.metrics import mlflow_sync_failures, mlflow_sync_seconds
+from app.util.external_data import external_data_locations
+from app.util.model_signature import read_signature
+from app.util.model_variants import model_file_ids, parse_variants
 from app.controller.deployment_controller import get_inference_endpoint
+from app.controller.session_cache import session_cache
+from app.controller.routing_table import routing_table
+from app.controller.upload_controller import UploadController
+from app.controller.variant_controller import DEFAULT_MODEL_VARIANTS, VariantController
+from app.controller.warmup_controller import WarmupController
 
 logger = logging.getLogger("uvicorn")
 
@@ -101,16 +113,17 @@ class MLFlowSyncController:
           # Resolve given selectors to actual model versions from MLflow
           try:
             full_selector = f"{model_name}/{version_selector}"
-            if (version_selector == "latest"):
-              result =  await self.find_version_uri_latest(model_name)
-            elif (version_selector.startswith("@")):
-              result = await self.find_version_uri_by_alias(model_name, version_selector)
-            elif (":" in version_selector):
-              result = await self.find_version_uri_by_tag(model_name, version_selector)
-            elif (version_selector.isdigit()):
-              result = await self.find_version_uri_by_version(model_name, version_selector)
-            else:
-              result = invalid_selector_result(model_name, version_selector)
+            with mlflow_sync_seconds.time(model=model_name, version=version_selector, stage="registry_lookup"):
+              if (version_selector == "latest"):
+                result =  await self.find_version_uri_latest(model_name)
+              elif (version_selector.startswith("@")):
+                result = await self.find_version_uri_by_alias(model_name, version_selector)
+              elif (":" in version_selector):
+                result = await self.find_version_uri_by_tag(model_name, version_selector)
+              elif (version_selector.isdigit()):
+                result = await self.find_version_uri_by_version(model_name, version_selector)
+              else:
+                result = invalid_selector_result(model_name, version_selector)
               
             for version_uri in result.resolved_versions:
               if version_uri not in versions_to_deploy:
@@ -269,23 +282,33 @@ class MLFlowSyncController:
             for artifact in artifacts:
               if artifact.path.endswith(".onnx"):
                 logger.debug(f"Found ONNX artifact: {artifact.path}")
+                origin = self._artifact_origin(model_infos, artifact)
+                if await self.reuse_and_update_model(model_infos, origin, db_controller):
+                  logger.info(f"Artifact {artifact.path} of {model_infos.model_uri} is stored already, skipping its download.")
+                  await self._warm_up_model(db_controller, model_infos.nexon_id)
+                  continue
                 with tempfile.TemporaryDirectory() as tmpdir:
                   logger.debug(f"Temporary directory created: {tmpdir}")
                   logger.debug(f"Downloading model artifact from URI: {model_infos.model_uri}")
                   artifact_uri = f"{model_infos.model_uri}/{artifact.path}"
-                  download_result = mlflow.artifacts.download_artifacts(
-                      artifact_uri=artifact_uri,
-                      dst_path=tmpdir
-                  )
+                  with mlflow_sync_seconds.time(model=model_infos.model_name, version=model_infos.model_version, stage="artifact_download"):
+                    download_result = mlflow.artifacts.download_artifacts(
+                        artifact_uri=artifact_uri,
+                        dst_path=tmpdir
+                    )
                   local_file_path = os.path.join(tmpdir, artifact.path)
                   logger.debug(f"Model downloaded to '{local_file_path}': {download_result}")
-                  await self.upload_and_update_model(model_infos, local_file_path, artifact.path, db_controller)
+                  external_data = await self._download_external_data(model_infos, artifact.path, local_file_path, tmpdir)
+                  await self.upload_and_update_model(model_infos, local_file_path, artifact.path, db_controller, origin, external_data)
+                  await self._warm_up_model(db_controller, model_infos.nexon_id)
           except Exception as e:
             logger.error(f"Error downloading and deploying model {model_infos.model_name} version {model_infos.model_version}: {e}")
+            mlflow_sync_failures.inc(model=model_infos.model_name, version=model_infos.model_version)
             import traceback
             traceback.print_exc()
         else:
           await self._set_model_deployed_in_db(db_controller, model_infos.nexon_id, model_infos)
+          await self._warm_up_model(db_controller, model_infos.nexon_id)
       
       logger.info(f"Undeploying removed models...")
       for version_uri in removed_models:
@@ -297,6 +320,9 @@ class MLFlowSyncController:
               {"_id": ObjectId(model["_id"])},
               {"$set": {"status": STATUS_UPLOADED, "deploy": None, "endpoint": None, "mlflow_source_selectors": []}},
             )
+            routing_table.remove(model["_id"])
+            for file_id in model_file_ids(model):
+              session_cache.invalidate(file_id)
           else:
             logger.warning(f"Cannot remove model {model_infos.model_name} version {model_infos.model_version}: Not found.")
         except Exception as e:
@@ -319,6 +345,7 @@ class MLFlowSyncController:
               )
             else:
               await self._set_model_deployed_in_db(db_controller, model["_id"], model_infos)
+              await self._warm_up_model(db_controller, model["_id"])
           else:
             logger.warning(f"Cannot update model {model_infos.model_name} version {model_infos.model_version}: Not found.")
         except Exception as e:
@@ -327,30 +354,102 @@ class MLFlowSyncController:
           traceback.print_exc()
       logger.info(f"Background task completed.")
       
-    async def upload_and_update_model(self, model_infos: QueuedModelInfos, file_path: str, file_name: str, db_controller: DatabaseController) -> ObjectId:
+    def _artifact_origin(self, model_infos: QueuedModelInfos, artifact) -> str:
+      """
+      Identifies the bytes of a model version's artifact without downloading it. MLflow reports no checksums of artifacts,
+      but the artifacts of a run are immutable, so the run's artifact location, the artifact path and its size
+      stand in for one. Model versions registered from the same run, e.g. under two names, share the origin.
+      """
+      source = self.mlflow_client.get_model_version(model_infos.model_name, model_infos.model_version).source
+      return f"{source.rstrip('/')}/{artifact.path}#{artifact.file_size}"
+
+    async def reuse_and_update_model(self, model_infos: QueuedModelInfos, origin: str, db_controller: DatabaseController) -> bool:
+      """
+      Points a model version at the stored file of an artifact synced before, including its signature and variants.
+      Returns False if the artifact was not synced before and has to be downloaded.
+      """
+      blob_store = BlobStore(db_controller)
+      blob = await blob_store.find_origin(origin)
+      source_model = await db_controller.find_one({"file_id": blob["file_id"]}) if blob else None
+      if source_model is None:
+        return False
+      acquired = []
+      for file_id in model_file_ids(source_model):
+        if not await blob_store.acquire(file_id):
+          for acquired_file_id in acquired:
+            await blob_store.release(acquired_file_id)
+          return False
+        acquired.append(file_id)
+      external_data = source_model.get("external_data")
+      size = blob["size"] + sum(entry["size"] for entry in external_data or [])
+      await self._set_model_file_in_db(db_controller, model_infos, blob["file_id"], size, source_model.get("signature"), source_model.get("variants"), external_data)
+      return True
+
+    async def _download_external_data(self, model_infos: QueuedModelInfos, artifact_path: str, local_file_path: str, tmpdir: str) -> Dict[str, str]:
+      """
+      Downloads the external data files referenced by a downloaded ONNX artifact, located relative to the artifact.
+      Returns the local path of each file by its location.
+      """
+      external_data = {}
+      for location in await asyncio.to_thread(external_data_locations, local_file_path):
+        artifact_uri = f"{model_infos.model_uri}/{posixpath.join(posixpath.dirname(artifact_path), location)}"
+        logger.debug(f"Downloading external data artifact from URI: {artifact_uri}")
+        with mlflow_sync_seconds.time(model=model_infos.model_name, version=model_infos.model_version, stage="artifact_download"):
+          external_data[location] = mlflow.artifacts.download_artifacts(
+            artifact_uri=artifact_uri,
+            dst_path=os.path.join(tmpdir, "external_data", posixpath.dirname(location))
+          )
+      return external_data
+
+    async def upload_and_update_model(self, model_infos: QueuedModelInfos, file_path: str, file_name: str, db_controller: DatabaseController, origin: str = None, external_data: Dict[str, str] = None) -> ObjectId:
       with open(file_path, "rb") as file_stream:
           logger.debug(f"File opened successfully: {file_stream}")
           logger.debug(f"Uploading model file to database...")
-          file_id = await db_controller.upload_file(file_name, file_stream)
-          now = datetime.now()
-          deploy_date = f"{now.day}/{now.month}/{now.year}"
+          with mlflow_sync_seconds.time(model=model_infos.model_name, version=model_infos.model_version, stage="gridfs_upload"):
+            # Identical bytes stored before, e.g. by an upload, are reused instead of stored again
+            file_id = await BlobStore(db_controller).store(file_name, file_stream, origin=origin, ingest="mlflow")
+          signature = await asyncio.to_thread(read_signature, file_path)
+          stored_external_data = await self._store_external_data(db_controller, external_data)
           file_size_bytes = os.fstat(file_stream.fileno()).st_size
           logger.debug(f"File size (bytes): {file_size_bytes}")
-          file_size_readable = convert_size(file_size_bytes)
-          api_endpoint = get_inference_endpoint(model_infos.model_name, int(model_infos.model_version))
-          logger.debug(f"Nexon Model ID: {model_infos.nexon_id}, File ID: {file_id}, Deploy Date: {deploy_date}, API Endpoint: {api_endpoint}")
-          updated_result = await db_controller.update_one(
-            {"_id": ObjectId(model_infos.nexon_id)},
-            {"$set": {
-              "status": STATUS_DEPLOYED,
-              "deploy": deploy_date,
-              "file_id": str(file_id),
-              "endpoint": api_endpoint,
-              "size": file_size_readable,
-              "mlflow_source_selectors": model_infos.source_selectors
-            }},
-          )
-          logger.debug(f"Model metadata updated in database: {updated_result}")
+          file_size_bytes += sum(entry["size"] for entry in stored_external_data or [])
+          await self._set_model_file_in_db(db_controller, model_infos, file_id, file_size_bytes, signature, None, stored_external_data)
+      # Variants are built from the downloaded file once the model serves, and from the model file alone,
+      # which lacks the weights of models with external data
+      variants = parse_variants(DEFAULT_MODEL_VARIANTS) if not stored_external_data else []
+      if variants:
+        await VariantController(db_controller).generate_model_variants(model_infos.model_name, int(model_infos.model_version), variants, file_path)
+
+    async def _store_external_data(self, db_controller: DatabaseController, external_data: Dict[str, str] = None) -> Optional[List[dict]]:
+      if not external_data:
+        return None
+      files = {location: open(path, "rb") for location, path in external_data.items()}
+      try:
+        return await UploadController(db_controller).store_external_data(files)
+      finally:
+        for external_file in files.values():
+          external_file.close()
+
+    async def _set_model_file_in_db(self, db_controller: DatabaseController, model_infos: QueuedModelInfos, file_id: str, file_size_bytes: int, signature: dict, variants: dict, external_data: list = None):
+      now = datetime.now()
+      deploy_date = f"{now.day}/{now.month}/{now.year}"
+      api_endpoint = get_inference_endpoint(model_infos.model_name, int(model_infos.model_version))
+      logger.debug(f"Nexon Model ID: {model_infos.nexon_id}, File ID: {file_id}, Deploy Date: {deploy_date}, API Endpoint: {api_endpoint}")
+      updated_result = await db_controller.update_one(
+        {"_id": ObjectId(model_infos.nexon_id)},
+        {"$set": {
+          "status": STATUS_DEPLOYED,
+          "deploy": deploy_date,
+          "file_id": str(file_id),
+          "endpoint": api_endpoint,
+          "size": convert_size(file_size_bytes),
+          "signature": signature,
+          "variants": variants,
+          "external_data": external_data,
+          "mlflow_source_selectors": model_infos.source_selectors
+        }},
+      )
+      logger.debug(f"Model metadata updated in database: {updated_result}")
           
     async def _set_model_deployed_in_db(self, db_controller: DatabaseController, nexon_id: str, model_infos: QueuedModelInfos):
       now = datetime.now()
@@ -364,4 +463,15 @@ class MLFlowSyncController:
           "deploy": deploy_date,
           "endpoint": api_endpoint,
           }},
-      )
\ No newline at end of file
+      )
+
+    async def _warm_up_model(self, db_controller: DatabaseController, nexon_id: str):
+      """
+      Routes a freshly deployed model and loads and warms up its session.
+      """
+      model = await db_controller.find_one({"_id": ObjectId(nexon_id)})
+      if model:
+        warmup_controller = WarmupController(db_controller)
+        warmup_controller.mark_warming(model)
+        routing_table.update(model)
+        await warmup_controller.warm_up(model)
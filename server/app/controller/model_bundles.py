@@ -0,0 +1,109 @@
+from os import environ
+from typing import Awaitable, Callable
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+from app.controller.artifact_cache import ARTIFACT_CACHE_DIR, download_to
+
+logger = logging.getLogger("uvicorn")
+
+# Directory models with external data are materialized in, by default next to the artifact cache or in the system's temporary directory
+BUNDLE_DIR = environ.get("NEXON_BUNDLE_DIR", os.path.join(ARTIFACT_CACHE_DIR, "bundles") if ARTIFACT_CACHE_DIR else os.path.join(tempfile.gettempdir(), "nexon-bundles"))
+
+MANIFEST_FILE = "bundle.json"
+
+
+def bundle_size(model_path: str) -> int:
+  """
+  Returns the size of a model file including its external data files, if it is part of a materialized bundle.
+  """
+  try:
+    with open(os.path.join(os.path.dirname(model_path), MANIFEST_FILE)) as manifest_file:
+      return json.load(manifest_file)["size"]
+  except (OSError, ValueError, KeyError):
+    return os.path.getsize(model_path)
+
+
+class BundleCache():
+  """
+  Materializes models with external data into a local directory per model file, the model file and its
+  external data files at their locations, so sessions are built from the model's path and ONNX Runtime
+  reads the weights from disk instead of from a copy in memory. Files are streamed from GridFS and verified
+  like those of the artifact cache. A bundle is complete once its manifest is written, so a crash
+  never leaves a partial bundle behind, and complete bundles are reused after a restart.
+  """
+  def __init__(self, directory: str):
+    self.directory = directory
+    self.locks: dict[str, asyncio.Lock] = {}
+    self.hits = 0
+    self.misses = 0
+
+  def bundle_directory(self, file_id: str) -> str:
+    return os.path.join(self.directory, str(file_id))
+
+  def model_path(self, file_id: str) -> str:
+    return os.path.join(self.bundle_directory(file_id), f"{file_id}.onnx")
+
+  async def path(self, model: dict, open_download_stream: Callable[[str], Awaitable]) -> str:
+    """
+    Returns the path of the materialized model file, downloading the bundle with the given coroutine function, called with each file id, if needed.
+    """
+    file_id = str(model["file_id"])
+    if self._complete(file_id):
+      self.hits += 1
+      return self.model_path(file_id)
+    lock = self.locks.setdefault(file_id, asyncio.Lock())
+    async with lock:
+      if self._complete(file_id):
+        self.hits += 1
+        return self.model_path(file_id)
+      self.misses += 1
+      await self._materialize(model, open_download_stream)
+    self.locks.pop(file_id, None)
+    return self.model_path(file_id)
+
+  def remove(self, file_id: str):
+    """
+    Deletes the materialized bundle of a model file deleted from GridFS. Sessions built from it keep working.
+    """
+    shutil.rmtree(self.bundle_directory(file_id), ignore_errors=True)
+
+  def stats(self):
+    return {
+      "directory": self.directory,
+      "hits": self.hits,
+      "misses": self.misses,
+    }
+
+  def _complete(self, file_id: str) -> bool:
+    return os.path.exists(os.path.join(self.bundle_directory(file_id), MANIFEST_FILE))
+
+  async def _materialize(self, model: dict, open_download_stream: Callable[[str], Awaitable]):
+    file_id = str(model["file_id"])
+    files = [(os.path.basename(self.model_path(file_id)), file_id)]
+    files += [(entry["location"], entry["file_id"]) for entry in model["external_data"]]
+    directory = self.bundle_directory(file_id)
+    # Files are written to a temporary directory that replaces an incomplete bundle left behind by a crash
+    os.makedirs(self.directory, exist_ok=True)
+    temp_directory = tempfile.mkdtemp(dir=self.directory, prefix=f".{file_id}-")
+    try:
+      size = 0
+      for location, location_file_id in files:
+        path = os.path.join(temp_directory, location)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_size, _ = await download_to(path, await open_download_stream(location_file_id))
+        size += file_size
+      with open(os.path.join(temp_directory, MANIFEST_FILE), "w") as manifest_file:
+        json.dump({"files": [location for location, _ in files], "size": size}, manifest_file)
+      shutil.rmtree(directory, ignore_errors=True)
+      os.replace(temp_directory, directory)
+    except BaseException:
+      shutil.rmtree(temp_directory, ignore_errors=True)
+      raise
+    logger.info(f"Materialized model {model['name']} (v{model['version']}) with {len(files) - 1} external data files in {directory}.")
+
+
+bundle_cache = BundleCache(BUNDLE_DIR)
@@ -1,7 +1,12 @@
 from app.controller.database import DatabaseController, ModelMetadata
+from app.controller.artifact_cache import artifact_cache
+from app.controller.blob_store import BlobStore
+from app.controller.model_bundles import bundle_cache
+from app.controller.session_cache import session_cache
+from app.controller.routing_table import routing_table
 from app.util.constants import STATUS_DEPLOYED, STATUS_UPLOADED
 from app.util.errors import BadRequestError, NotFoundError
-from bson import ObjectId
+from app.util.model_variants import model_file_ids
 
 class ModelController:
     """
@@ -43,8 +48,14 @@ class ModelController:
           raise BadRequestError("Model does not have a valid file ID.")
 
       try:
-          # Delete the file from GridFS
-          await self.db_controller.delete_file(ObjectId(file_id))  # Ensure we pass an ObjectId
+          # Release the file and the files of its variants, they are deleted from GridFS unless other models share them
+          routing_table.remove(model["_id"])
+          blob_store = BlobStore(self.db_controller)
+          for model_file_id in model_file_ids(model):
+            if await blob_store.release(model_file_id):
+              session_cache.invalidate(model_file_id)
+              artifact_cache.remove(model_file_id)
+              bundle_cache.remove(model_file_id)
 
           # Delete model metadata
           delete_result = await self.db_controller.delete_one({"_id": model["_id"]})
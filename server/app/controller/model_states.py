@@ -0,0 +1,52 @@
+import time
+from app.controller.routing_table import routing_table
+from app.util.constants import MODEL_STATE_READY, MODEL_STATE_WARMING
+
+
+class ModelStates():
+  """
+  Warm-up state of deployed models, keyed by GridFS file id.
+  """
+  def __init__(self):
+    self.states: dict[str, dict] = {}
+
+  def set(self, file_id: str, state: str, details: str = None):
+    self.states[str(file_id)] = {"state": state, "details": details, "updated": time.time()}
+
+  def get(self, file_id: str) -> str | None:
+    entry = self.states.get(str(file_id))
+    return entry["state"] if entry else None
+
+  def mark_served(self, file_id: str):
+    """
+    Marks a model ready once it served an inference, e.g. after its warm-up failed.
+    """
+    if self.get(file_id) != MODEL_STATE_READY:
+      self.set(file_id, MODEL_STATE_READY)
+
+  def details(self, file_id: str) -> str | None:
+    entry = self.states.get(str(file_id))
+    return entry["details"] if entry else None
+
+  def readiness(self):
+    """
+    Reports the warm-up state of all deployed models. The server is ready once all of them are warm.
+    """
+    models = []
+    for name, version in routing_table.ids.values():
+      model = routing_table.resolve(name, version)
+      file_id = str(model.get("file_id"))
+      models.append({
+        "name": name,
+        "version": version,
+        "file_id": file_id,
+        "state": self.get(file_id) or MODEL_STATE_WARMING,
+        "details": self.details(file_id),
+      })
+    return {
+      "ready": all(model["state"] == MODEL_STATE_READY for model in models),
+      "models": models,
+    }
+
+
+model_states = ModelStates()
@@ -0,0 +1,157 @@
+from datetime import datetime
+from typing import AsyncIterator
+import json
+import logging
+import os
+import random
+import tempfile
+import onnxruntime as ort
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic import BaseModel, Field
+from app.controller.database import DatabaseController
+from app.util.errors import NotFoundError
+
+logger = logging.getLogger("uvicorn")
+
+PROFILE_SUMMARY_TOP_N = 10
+
+
+class ProfilingConfig(BaseModel):
+    enabled: bool = False
+    sample_rate: float = Field(default=0.01, gt=0, le=1)
+
+
+def is_sampled(model: dict) -> bool:
+  """
+  Decides whether a request to the model is profiled, according to the model's profiling configuration.
+  """
+  config = model.get("profiling") or {}
+  return bool(config.get("enabled")) and random.random() < config.get("sample_rate", 0.01)
+
+
+def run_profiled(model: bytes | str, options: ort.SessionOptions, feeds: dict, output_names: list) -> tuple[list, bytes]:
+  """
+  Runs the request on a dedicated session with ONNX Runtime profiling enabled, so the cached session is not slowed down.
+  Returns the results and the Chrome trace JSON of the run.
+  """
+  with tempfile.TemporaryDirectory(prefix="nexon-profile-") as directory:
+    options.enable_profiling = True
+    options.profile_file_prefix = os.path.join(directory, "profile")
+    session = ort.InferenceSession(model, sess_options=options)
+    try:
+      results = session.run(output_names, feeds)
+    finally:
+      trace_path = session.end_profiling()
+    with open(trace_path, "rb") as trace_file:
+      return results, trace_file.read()
+
+
+def summarize_trace(trace: list, top_n: int = PROFILE_SUMMARY_TOP_N) -> dict:
+  """
+  Aggregates the kernel times of a trace by operator type and by node, the slowest first. Times are in microseconds.
+  """
+  run_us = sum(event.get("dur", 0) for event in trace if event.get("cat") == "Session" and event.get("name") == "model_run")
+  ops: dict[str, dict] = {}
+  nodes: dict[str, dict] = {}
+  for event in trace:
+    if event.get("cat") != "Node" or not event.get("name", "").endswith("_kernel_time"):
+      continue
+    op_type = event.get("args", {}).get("op_name", "unknown")
+    node_name = event["name"][:-len("_kernel_time")]
+    for key, entries, extra in ((op_type, ops, {}), (node_name, nodes, {"op_type": op_type})):
+      entry = entries.setdefault(key, {"total_us": 0, "count": 0, **extra})
+      entry["total_us"] += event.get("dur", 0)
+      entry["count"] += 1
+
+  kernel_us = sum(entry["total_us"] for entry in ops.values())
+  def ranked(entries: dict, key_name: str) -> list:
+    ranking = sorted(entries.items(), key=lambda item: item[1]["total_us"], reverse=True)[:top_n]
+    return [{key_name: key, **entry, "share": entry["total_us"] / kernel_us if kernel_us else 0.0} for key, entry in ranking]
+
+  return {
+    "run_us": run_us,
+    "kernel_us": kernel_us,
+    "ops": ranked(ops, "op_type"),
+    "nodes": ranked(nodes, "node"),
+  }
+
+
+def profile_view(profile: dict) -> dict:
+  return {
+    "profile_id": str(profile["_id"]),
+    "model_name": profile["model_name"],
+    "model_version": profile["model_version"],
+    "trace_file_id": profile["trace_file_id"],
+    "trigger": profile["trigger"],
+    "created": profile["created"],
+  }
+
+
+class ProfilingController:
+  def __init__(self, db_controller: DatabaseController):
+    self.db_controller = db_controller
+
+  async def store_profile(self, model: dict, trace: bytes, trigger: str) -> str:
+    """
+    Stores the Chrome trace of a profiled request in GridFS and links it to the model in the profiles collection.
+    """
+    trace_file_id = await self.db_controller.upload_file(
+      f"profile-{model['name']}-v{model['version']}.json", trace, {"model_id": str(model["_id"]), "kind": "profile"})
+    profile_id = await self.db_controller.insert_profile({
+      "model_id": str(model["_id"]),
+      "model_name": model["name"],
+      "model_version": model["version"],
+      "file_id": str(model["file_id"]),
+      "trace_file_id": str(trace_file_id),
+      "trigger": trigger,
+      "created": datetime.now().isoformat(timespec="seconds"),
+    })
+    logger.info(f"Stored profile {profile_id} of model {model['name']} (v{model['version']})")
+    return profile_id
+
+  async def list_profiles(self, model_name: str = None, model_version: int = None) -> list:
+    query = {}
+    if model_name is not None:
+      query["model_name"] = model_name
+    if model_version is not None:
+      query["model_version"] = model_version
+    return [profile_view(profile) for profile in await self.db_controller.find_profiles(query)]
+
+  async def get_profile(self, profile_id: str, top_n: int = PROFILE_SUMMARY_TOP_N) -> dict:
+    """
+    Returns a profile with the operator-level summary of its trace.
+    """
+    profile = await self._find_profile(profile_id)
+    trace = json.loads(await self._read_trace(profile))
+    return {**profile_view(profile), "summary": summarize_trace(trace, top_n)}
+
+  async def trace(self, profile_id: str) -> AsyncIterator[bytes]:
+    """
+    Streams the Chrome trace JSON of a profile, which can be opened in chrome://tracing or Perfetto.
+    """
+    profile = await self._find_profile(profile_id)
+    grid_out = await self.db_controller.download_file(ObjectId(profile["trace_file_id"]))
+    async def chunks():
+      async for chunk in grid_out:
+        yield chunk
+    return chunks()
+
+  async def delete_profile(self, profile_id: str):
+    profile = await self._find_profile(profile_id)
+    await self.db_controller.delete_file(ObjectId(profile["trace_file_id"]))
+    await self.db_controller.delete_profile({"_id": profile["_id"]})
+    return {"message": f"Profile {profile_id} deleted."}
+
+  async def _find_profile(self, profile_id: str) -> dict:
+    try:
+      profile = await self.db_controller.find_profile({"_id": ObjectId(profile_id)})
+    except InvalidId:
+      profile = None
+    if profile is None:
+      raise NotFoundError("Profile not found.")
+    return profile
+
+  async def _read_trace(self, profile: dict) -> bytes:
+    grid_out = await self.db_controller.download_file(ObjectId(profile["trace_file_id"]))
+    return await grid_out.read()
@@ -0,0 +1,172 @@
+from collections import OrderedDict
+from os import environ
+from typing import Optional
+from pydantic import BaseModel, Field
+import hashlib
+import logging
+import threading
+import time
+import numpy as np
+from app.util.json_codec import encode_json
+from app.util.metrics import registry
+
+logger = logging.getLogger("uvicorn")
+
+# Memory budget for all cached inference results, in megabytes
+RESULT_CACHE_MAX_MB = int(environ.get("NEXON_RESULT_CACHE_MAX_MB", "256"))
+# Default time to live of cached results, in seconds
+RESULT_CACHE_TTL_SECONDS = float(environ.get("NEXON_RESULT_CACHE_TTL_SECONDS", "300"))
+
+
+class ResultCacheConfig(BaseModel):
+    enabled: bool = False
+    ttl_seconds: Optional[float] = Field(default=None, gt=0)
+
+
+def _result_size(value) -> int:
+  if isinstance(value, np.ndarray):
+    return value.nbytes
+  return len(encode_json(value))
+
+
+class CachedResult():
+  def __init__(self, file_id: str, model_name: str, results: list, size: int, expires: float):
+    self.file_id = file_id
+    self.model_name = model_name
+    self.results = results
+    self.size = size
+    self.expires = expires
+
+
+class ResultCache():
+  """
+  Process wide LRU cache of inference results of deterministic models, keyed by the model file,
+  a hash of the input tensors and the requested outputs.
+  Results expire after their time to live and are evicted least recently used first once their combined size exceeds the memory budget.
+  """
+  def __init__(self, max_bytes: int, ttl_seconds: float):
+    self.max_bytes = max_bytes
+    self.ttl_seconds = ttl_seconds
+    self.entries: OrderedDict[tuple, CachedResult] = OrderedDict()
+    self.total_bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.expirations = 0
+    self.evictions = 0
+    self.models: dict[str, dict] = {}
+    self.lock = threading.Lock()
+
+  def key(self, file_id: str, feeds: dict, output_names: list) -> tuple | None:
+    """
+    Content address of an inference request: the SHA-256 of the names, dtypes, shapes and bytes of the input tensors.
+    Returns None for inputs that cannot be hashed, e.g. sequences or maps, which are never cached.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(feeds):
+      value = feeds[name]
+      if not isinstance(value, np.ndarray):
+        return None
+      digest.update(f"{name}\0{value.dtype.str}\0{value.shape}\0".encode())
+      if value.dtype == np.object_:
+        digest.update(encode_json(value.ravel().tolist()))
+      else:
+        digest.update(np.ascontiguousarray(value).data)
+    return (str(file_id), digest.hexdigest(), tuple(output_names))
+
+  def get(self, key: tuple, model_name: str) -> list | None:
+    """
+    Returns the cached results of the given request and marks them as recently used.
+    """
+    with self.lock:
+      counters = self.models.setdefault(model_name, {"hits": 0, "misses": 0})
+      entry = self.entries.get(key)
+      if entry is not None and entry.expires <= time.monotonic():
+        self._remove(key)
+        self.expirations += 1
+        entry = None
+      if entry is None:
+        self.misses += 1
+        counters["misses"] += 1
+        return None
+      self.entries.move_to_end(key)
+      self.hits += 1
+      counters["hits"] += 1
+      return entry.results
+
+  def put(self, key: tuple, model_name: str, results: list, ttl_seconds: float = None):
+    """
+    Caches the results of a request. Result arrays are made read-only as they are shared by all later hits.
+    """
+    for result in results:
+      if isinstance(result, np.ndarray):
+        result.setflags(write=False)
+    size = sum(_result_size(result) for result in results)
+    if size > self.max_bytes:
+      return
+    expires = time.monotonic() + (ttl_seconds or self.ttl_seconds)
+    with self.lock:
+      self._remove(key)
+      self.entries[key] = CachedResult(key[0], model_name, results, size, expires)
+      self.total_bytes += size
+      self._evict()
+
+  def invalidate(self, file_id: str):
+    """
+    Drops all cached results of the given file, e.g. after the result cache was disabled for its model.
+    """
+    with self.lock:
+      for key in [key for key, entry in self.entries.items() if entry.file_id == str(file_id)]:
+        self._remove(key)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.total_bytes = 0
+
+  def stats(self):
+    with self.lock:
+      lookups = self.hits + self.misses
+      return {
+        "hits": self.hits,
+        "misses": self.misses,
+        "hit_rate": self.hits / lookups if lookups else 0.0,
+        "expirations": self.expirations,
+        "evictions": self.evictions,
+        "size": len(self.entries),
+        "total_bytes": self.total_bytes,
+        "max_bytes": self.max_bytes,
+        "ttl_seconds": self.ttl_seconds,
+        "models": {
+          model_name: {
+            **counters,
+            "hit_rate": counters["hits"] / (counters["hits"] + counters["misses"]) if counters["hits"] + counters["misses"] else 0.0,
+          }
+          for model_name, counters in self.models.items()
+        },
+      }
+
+  def _remove(self, key: tuple) -> bool:
+    entry = self.entries.pop(key, None)
+    if entry is None:
+      return False
+    self.total_bytes -= entry.size
+    return True
+
+  def _evict(self):
+    # Expired entries are dropped from the least recently used end, the rest once they are looked up again
+    now = time.monotonic()
+    while self.entries and next(iter(self.entries.values())).expires <= now:
+      self._remove(next(iter(self.entries)))
+      self.expirations += 1
+    while self.total_bytes > self.max_bytes and self.entries:
+      key = next(iter(self.entries))
+      self._remove(key)
+      self.evictions += 1
+
+
+result_cache = ResultCache(RESULT_CACHE_MAX_MB * 1024 * 1024, RESULT_CACHE_TTL_SECONDS)
+
+registry.gauge("nexon_result_cache_entries", "Inference results in the result cache.", collect=lambda: {(): len(result_cache.entries)})
+registry.gauge("nexon_result_cache_bytes", "Size of the cached inference results.", collect=lambda: {(): result_cache.total_bytes})
+registry.counter("nexon_result_cache_hits_total", "Result cache hits by model.", ("model",), lambda: {(model_name,): counters["hits"] for model_name, counters in result_cache.models.items()})
+registry.counter("nexon_result_cache_misses_total", "Result cache misses by model.", ("model",), lambda: {(model_name,): counters["misses"] for model_name, counters in result_cache.models.items()})
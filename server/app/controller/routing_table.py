@@ -0,0 +1,184 @@
+from os import environ
+import asyncio
+import logging
+from pymongo.errors import OperationFailure, PyMongoError
+from app.util.constants import STATUS_DEPLOYED
+
+logger = logging.getLogger("uvicorn")
+
+# Seconds between full reloads when change streams are not available (standalone mongod)
+ROUTING_POLL_INTERVAL = float(environ.get("NEXON_ROUTING_POLL_INTERVAL", "5"))
+# Seconds to wait before reopening a change stream that failed
+ROUTING_RETRY_INTERVAL = float(environ.get("NEXON_ROUTING_RETRY_INTERVAL", "5"))
+
+# Error codes of a deployment without change stream support (Location40573 and IllegalOperation on a standalone mongod)
+CHANGE_STREAMS_UNSUPPORTED_CODES = (40573, 20)
+
+
+class RoutingTable():
+  """
+  In-memory routing table of deployed models, mapping (name, version) to the model document.
+  It is populated at startup and kept coherent with the models collection via a change stream,
+  falling back to polling when the database does not support change streams.
+  """
+  def __init__(self):
+    self.routes: dict[str, dict[int, dict]] = {}
+    self.ids: dict[str, tuple[str, int]] = {}
+    self.mode = None
+    self.task: asyncio.Task = None
+    self.route_listeners = []
+
+  def resolve(self, model_name: str, model_version: int = None) -> dict | None:
+    """
+    Returns the deployed model document for the given name and version,
+    or the latest deployed version if no version is given.
+    """
+    versions = self.routes.get(model_name)
+    if not versions:
+      return None
+    if model_version is None:
+      return versions[max(versions)]
+    return versions.get(model_version)
+
+  def update(self, model: dict):
+    """
+    Adds or refreshes the route of a model document, or drops it if the model is not deployed.
+    """
+    routed = self._file_ids() if self.route_listeners else set()
+    self._add(model)
+    self._notify(routed)
+
+  def swap(self, model: dict, replaced_ids: list[str]):
+    """
+    Routes a model and drops the routes of the models it replaces in one step,
+    so no request resolves neither or both of them.
+    """
+    routed = self._file_ids() if self.route_listeners else set()
+    for model_id in replaced_ids:
+      self.remove(model_id)
+    self._add(model)
+    self._notify(routed)
+
+  def add_route_listener(self, listener):
+    """
+    Registers a callback for model documents whose file was not routed before, e.g. to warm up their sessions.
+    """
+    self.route_listeners.append(listener)
+
+  def remove(self, model_id: str):
+    """
+    Drops the route of the model with the given id.
+    """
+    key = self.ids.pop(str(model_id), None)
+    if key is None:
+      return
+    name, version = key
+    versions = self.routes.get(name, {})
+    versions.pop(version, None)
+    if not versions:
+      self.routes.pop(name, None)
+
+  async def load(self, db_controller):
+    """
+    Replaces the routing table with the currently deployed models.
+    """
+    models = await db_controller.find({"status": STATUS_DEPLOYED})
+    routed = self._file_ids() if self.route_listeners else set()
+    self.routes = {}
+    self.ids = {}
+    for model in models:
+      self._add(model)
+    self._notify(routed)
+    logger.debug(f"Routing table loaded with {len(self.ids)} deployed models.")
+
+  def start(self, db_controller):
+    """
+    Starts keeping the routing table coherent with the database in the background.
+    """
+    if self.task is None:
+      self.task = asyncio.create_task(self._watch(db_controller))
+
+  async def stop(self):
+    if self.task is not None:
+      self.task.cancel()
+      try:
+        await self.task
+      except asyncio.CancelledError:
+        pass
+      self.task = None
+
+  def stats(self):
+    return {
+      "mode": self.mode,
+      "routes": [{"name": name, "version": version, "file_id": str(self.routes[name][version].get("file_id"))} for name, version in self.ids.values()],
+    }
+
+  async def _watch(self, db_controller):
+    while True:
+      try:
+        async with db_controller.watch_models() as stream:
+          self.mode = "change_stream"
+          logger.info("Watching models collection for routing changes.")
+          # Events may have been missed while the stream was closed
+          await self.load(db_controller)
+          async for change in stream:
+            self._apply_change(change)
+      except asyncio.CancelledError:
+        raise
+      except OperationFailure as e:
+        if e.code not in CHANGE_STREAMS_UNSUPPORTED_CODES:
+          # E.g. missing permissions or a lost change stream history, the stream is reopened and the table reloaded
+          logger.warning(f"Routing table change stream failed: {e}. Retrying in {ROUTING_RETRY_INTERVAL}s.")
+          await asyncio.sleep(ROUTING_RETRY_INTERVAL)
+          continue
+        logger.info(f"Change streams are not available ({e}), polling models collection every {ROUTING_POLL_INTERVAL}s instead.")
+        await self._poll(db_controller)
+      except PyMongoError as e:
+        logger.warning(f"Routing table change stream failed: {e}. Retrying in {ROUTING_RETRY_INTERVAL}s.")
+        await asyncio.sleep(ROUTING_RETRY_INTERVAL)
+
+  async def _poll(self, db_controller):
+    self.mode = "polling"
+    while True:
+      await asyncio.sleep(ROUTING_POLL_INTERVAL)
+      try:
+        await self.load(db_controller)
+      except PyMongoError as e:
+        logger.warning(f"Failed to reload routing table: {e}")
+
+  def _add(self, model: dict):
+    model_id = str(model["_id"])
+    self.remove(model_id)
+    if model.get("status") != STATUS_DEPLOYED:
+      return
+    name, version = model["name"], model["version"]
+    self.routes.setdefault(name, {})[version] = model
+    self.ids[model_id] = (name, version)
+
+  def _file_ids(self) -> set[str]:
+    return {str(self.routes[name][version].get("file_id")) for name, version in self.ids.values()}
+
+  def _notify(self, routed: set[str]):
+    if not self.route_listeners:
+      return
+    for name, version in list(self.ids.values()):
+      model = self.routes[name][version]
+      if str(model.get("file_id")) not in routed:
+        for listener in self.route_listeners:
+          listener(model)
+
+  def _apply_change(self, change: dict):
+    operation = change["operationType"]
+    model_id = change["documentKey"]["_id"]
+    if operation == "delete":
+      self.remove(model_id)
+    elif operation in ("insert", "update", "replace"):
+      model = change.get("fullDocument")
+      if model is None:
+        # The document was deleted before the update could be looked up
+        self.remove(model_id)
+      else:
+        self.update(model)
+
+
+routing_table = RoutingTable()
@@ -0,0 +1,174 @@
+from collections import OrderedDict
+from os import environ
+import logging
+import os
+import threading
+import onnxruntime as ort
+from app.controller.model_bundles import bundle_size
+from app.util.metrics import registry
+
+logger = logging.getLogger("uvicorn")
+
+# Memory budget for all cached sessions, in megabytes
+SESSION_CACHE_MAX_MB = int(environ.get("NEXON_SESSION_CACHE_MAX_MB", "2048"))
+# Comma separated model names whose sessions are never evicted
+PINNED_MODELS = [name.strip() for name in environ.get("NEXON_PINNED_MODELS", "").split(",") if name.strip()]
+# Memory of a loaded session relative to the size of its serialized model (weights, optimized graph, arena)
+SESSION_MEMORY_FACTOR = float(environ.get("NEXON_SESSION_MEMORY_FACTOR", "2"))
+
+
+def session_footprint(model_size: int) -> int:
+  """
+  Estimates the memory footprint of a session as the size of the serialized model times NEXON_SESSION_MEMORY_FACTOR.
+  The estimate is deterministic on purpose: sessions are built on threads shared with other builds and runs,
+  so measuring the process memory while building one session would also count the allocations of the others.
+  """
+  return int(model_size * SESSION_MEMORY_FACTOR)
+
+
+def load_session(model: bytes | str, options: ort.SessionOptions = None):
+  """
+  Builds an inference session from a serialized model or the path of a model file and estimates its memory footprint.
+  External data of a model loaded from its path is read from the files next to it.
+  """
+  session = ort.InferenceSession(model, sess_options=options)
+  return session, session_footprint(bundle_size(model) if isinstance(model, str) else len(model))
+
+
+class CachedSession():
+  def __init__(self, file_id: str, model_name: str, session: ort.InferenceSession, footprint: int):
+    self.file_id = file_id
+    self.model_name = model_name
+    self.session = session
+    self.footprint = footprint
+
+
+class SessionCache():
+  """
+  Process wide LRU cache of ONNX Runtime inference sessions keyed by GridFS file id.
+  Sessions are evicted least recently used first once their combined footprint exceeds the memory budget.
+  Sessions of pinned models are never evicted.
+  """
+  def __init__(self, max_bytes: int, pinned_models: list[str] = []):
+    self.max_bytes = max_bytes
+    self.pinned_models = set(pinned_models)
+    self.entries: OrderedDict[str, CachedSession] = OrderedDict()
+    self.total_bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+    self.invalidation_listeners = []
+    self.lock = threading.Lock()
+
+  def get(self, file_id: str) -> ort.InferenceSession | None:
+    """
+    Returns the cached session for the given file and marks it as recently used.
+    """
+    with self.lock:
+      entry = self.entries.get(str(file_id))
+      if entry is None:
+        self.misses += 1
+        return None
+      self.entries.move_to_end(str(file_id))
+      self.hits += 1
+      return entry.session
+
+  def put(self, file_id: str, model_name: str, session: ort.InferenceSession, footprint: int):
+    """
+    Adds a session to the cache and evicts other sessions until the cache fits its budget again.
+    """
+    with self.lock:
+      self._remove(str(file_id))
+      self.entries[str(file_id)] = CachedSession(str(file_id), model_name, session, footprint)
+      self.total_bytes += footprint
+      self._evict(keep=str(file_id))
+
+  def invalidate(self, file_id: str):
+    """
+    Drops the session of the given file, e.g. after the model was (un)deployed or deleted.
+    """
+    with self.lock:
+      if self._remove(str(file_id)):
+        self.invalidations += 1
+        logger.info(f"Invalidated cached session for file {file_id}")
+    for listener in self.invalidation_listeners:
+      listener(str(file_id))
+
+  def add_invalidation_listener(self, listener):
+    """
+    Registers a callback for invalidated file ids, e.g. to drop sessions held in other processes.
+    """
+    self.invalidation_listeners.append(listener)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.total_bytes = 0
+
+  def pin(self, model_name: str):
+    with self.lock:
+      self.pinned_models.add(model_name)
+
+  def unpin(self, model_name: str):
+    with self.lock:
+      self.pinned_models.discard(model_name)
+      self._evict()
+
+  def stats(self):
+    with self.lock:
+      lookups = self.hits + self.misses
+      return {
+        "hits": self.hits,
+        "misses": self.misses,
+        "hit_rate": self.hits / lookups if lookups else 0.0,
+        "evictions": self.evictions,
+        "invalidations": self.invalidations,
+        "size": len(self.entries),
+        "total_bytes": self.total_bytes,
+        "max_bytes": self.max_bytes,
+        "pinned_models": sorted(self.pinned_models),
+        "sessions": [
+          {
+            "file_id": entry.file_id,
+            "model_name": entry.model_name,
+            "footprint": entry.footprint,
+            "pinned": entry.model_name in self.pinned_models,
+          }
+          for entry in self.entries.values()
+        ],
+      }
+
+  def _remove(self, file_id: str) -> bool:
+    entry = self.entries.pop(file_id, None)
+    if entry is None:
+      return False
+    self.total_bytes -= entry.footprint
+    return True
+
+  def _evict(self, keep: str = None):
+    for file_id in list(self.entries.keys()):
+      if self.total_bytes <= self.max_bytes:
+        break
+      entry = self.entries[file_id]
+      if file_id == keep or entry.model_name in self.pinned_models:
+        continue
+      self._remove(file_id)
+      self.evictions += 1
+      logger.info(f"Evicted cached session for model {entry.model_name} (file {file_id}, {entry.footprint} bytes)")
+    if self.total_bytes > self.max_bytes:
+      logger.warning(f"Session cache exceeds its budget ({self.total_bytes} > {self.max_bytes} bytes) because of pinned or oversized models")
+
+
+session_cache = SessionCache(SESSION_CACHE_MAX_MB * 1024 * 1024, PINNED_MODELS)
+
+registry.gauge("nexon_session_cache_sessions", "Inference sessions in the session cache.", collect=lambda: {(): len(session_cache.entries)})
+registry.gauge("nexon_session_cache_bytes", "Estimated memory footprint of the cached sessions.", collect=lambda: {(): session_cache.total_bytes})
+registry.counter("nexon_session_cache_hits_total", "Session cache hits.", collect=lambda: {(): session_cache.hits})
+registry.counter("nexon_session_cache_misses_total", "Session cache misses.", collect=lambda: {(): session_cache.misses})
+registry.counter("nexon_session_cache_evictions_total", "Sessions evicted from the session cache.", collect=lambda: {(): session_cache.evictions})
+
+
+def get_session_cache() -> SessionCache:
+  """Dependency for FastAPI to inject the session cache."""
+  return session_cache
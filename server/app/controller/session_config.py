@@ -0,0 +1,84 @@
+from typing import Literal, Optional
+from os import environ
+import os
+import onnxruntime as ort
+from pydantic import BaseModel, Field, ValidationError
+from app.util.errors import BadRequestError
+
+# Cores shared by the intra-op thread pools of all loaded models
+SESSION_CORES = int(environ.get("NEXON_SESSION_CORES", str(os.cpu_count() or 1)))
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+class SessionConfig(BaseModel):
+    """
+    ONNX Runtime session options of a model. Unset options fall back to the server-wide defaults.
+    """
+    intra_op_num_threads: Optional[int] = Field(default=None, ge=0)
+    inter_op_num_threads: Optional[int] = Field(default=None, ge=0)
+    execution_mode: Optional[Literal["sequential", "parallel"]] = None
+    graph_optimization_level: Optional[Literal["disable", "basic", "extended", "all"]] = None
+    enable_cpu_mem_arena: Optional[bool] = None
+    enable_mem_pattern: Optional[bool] = None
+
+
+def parse_session_config(value: str | None) -> SessionConfig | None:
+  """
+  Parses a session configuration given as JSON string, e.g. in a multipart form.
+  """
+  if not value:
+    return None
+  try:
+    return SessionConfig.model_validate_json(value)
+  except ValidationError as e:
+    raise BadRequestError(f"Invalid session configuration: {str(e)}")
+
+
+def default_session_config(loaded_models: int) -> SessionConfig:
+  """
+  Server-wide defaults, splitting the available cores between the intra-op thread pools of all loaded models
+  so that many models on one machine do not oversubscribe the CPU.
+  """
+  return SessionConfig(
+    intra_op_num_threads=max(1, SESSION_CORES // max(1, loaded_models)),
+    inter_op_num_threads=1,
+    execution_mode="sequential",
+    graph_optimization_level="all",
+    enable_cpu_mem_arena=True,
+    enable_mem_pattern=True,
+  )
+
+
+def resolve_session_config(config: dict | None, loaded_models: int) -> SessionConfig:
+  """
+  Merges the options configured for a model over the server-wide defaults.
+  """
+  defaults = default_session_config(loaded_models).model_dump()
+  configured = SessionConfig(**(config or {})).model_dump(exclude_none=True)
+  return SessionConfig(**{**defaults, **configured})
+
+
+def build_session_options(config: dict | None, loaded_models: int) -> ort.SessionOptions:
+  """
+  Builds the ONNX Runtime session options of a model.
+  """
+  resolved = resolve_session_config(config, loaded_models)
+  options = ort.SessionOptions()
+  options.intra_op_num_threads = resolved.intra_op_num_threads
+  options.inter_op_num_threads = resolved.inter_op_num_threads
+  options.execution_mode = EXECUTION_MODES[resolved.execution_mode]
+  options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[resolved.graph_optimization_level]
+  options.enable_cpu_mem_arena = resolved.enable_cpu_mem_arena
+  options.enable_mem_pattern = resolved.enable_mem_pattern
+  return options
@@ -0,0 +1,72 @@
+from os import environ
+import asyncio
+import logging
+from app.util.errors import ServiceUnavailableError
+from app.util.metrics import registry
+
+logger = logging.getLogger("uvicorn")
+
+# Seconds a model load (download and session build) may take before it is abandoned and its waiters fail with 503
+MODEL_LOAD_TIMEOUT = float(environ.get("NEXON_MODEL_LOAD_TIMEOUT", "300"))
+
+model_loads = registry.counter(
+  "nexon_model_loads_total", "Model loads started, by loader.", ("loader",))
+model_load_deduplicated = registry.counter(
+  "nexon_model_load_deduplicated_total", "Requests that waited for a model load already in progress instead of starting their own, by loader.", ("loader",))
+model_load_timeouts = registry.counter(
+  "nexon_model_load_timeouts_total", "Model loads abandoned after NEXON_MODEL_LOAD_TIMEOUT, by loader.", ("loader",))
+
+
+class SingleFlight():
+  """
+  Coalesces concurrent loads of the same key, e.g. a cold model hit by many requests at once:
+  the first caller starts the load, later callers wait for it and share its result or its error.
+  The load runs as its own task, so it is neither cancelled nor repeated when a waiting request goes away.
+  """
+  def __init__(self, name: str, timeout: float = MODEL_LOAD_TIMEOUT):
+    self.name = name
+    self.timeout = timeout
+    self.loads: dict[str, asyncio.Task] = {}
+    self.started = 0
+    self.deduplicated = 0
+    self.timeouts = 0
+
+  async def load(self, key: str, coroutine_function):
+    """
+    Returns the result of coroutine_function(), awaiting the load of the same key if one is in progress.
+    """
+    task = self.loads.get(key)
+    if task is None:
+      task = asyncio.create_task(self._load(key, coroutine_function))
+      # Retrieves the error of loads whose waiters all went away
+      task.add_done_callback(lambda done: done.cancelled() or done.exception())
+      self.loads[key] = task
+      self.started += 1
+      model_loads.inc(loader=self.name)
+    else:
+      self.deduplicated += 1
+      model_load_deduplicated.inc(loader=self.name)
+    return await asyncio.shield(task)
+
+  async def _load(self, key: str, coroutine_function):
+    try:
+      return await asyncio.wait_for(coroutine_function(), self.timeout)
+    except asyncio.TimeoutError:
+      self.timeouts += 1
+      model_load_timeouts.inc(loader=self.name)
+      logger.error(f"Loading {key} took longer than {self.timeout}s and was abandoned.")
+      raise ServiceUnavailableError(f"Loading the model took longer than {self.timeout:g}s, please try again later.")
+    finally:
+      self.loads.pop(key, None)
+
+  def stats(self):
+    return {
+      "in_progress": len(self.loads),
+      "started": self.started,
+      "deduplicated": self.deduplicated,
+      "timeouts": self.timeouts,
+      "timeout_seconds": self.timeout,
+    }
+
+
+session_loads = SingleFlight("session")
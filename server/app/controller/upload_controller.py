@@ -1,48 +1,115 @@
-from fastapi import UploadFile, File
+import asyncio
+import logging
+from fastapi import BackgroundTasks, UploadFile, File
 from datetime import datetime
+from app.controller.blob_store import BlobStore
 from app.controller.database import DatabaseController, ModelMetadata
+from app.controller.session_config import SessionConfig
+from app.controller.variant_controller import DEFAULT_MODEL_VARIANTS, VariantController
 from app.util.errors import BadRequestError
 from app.util.file_utils import convert_size
+from app.util.external_data import external_data_locations, match_external_data
+from app.util.model_signature import read_signature
+from app.util.model_variants import parse_variants
 from app.util.constants import STATUS_UPLOADED
 
+logger = logging.getLogger("uvicorn")
 
 class UploadController:
   def __init__(self, db_controller: DatabaseController):
     self.db_controller = db_controller
     
-  async def upload_file(self, file: UploadFile):
+  async def upload_file(self, file: UploadFile, session_config: SessionConfig = None, variants: list[str] = None, external_data: list[UploadFile] = None, background_tasks: BackgroundTasks = None):
     """
-    Uploads an ONNX model file
+    Uploads an ONNX model file, optionally with the ONNX Runtime session options to use for it
+    and the optimized variants to generate from it, by default those of NEXON_MODEL_VARIANTS.
+    Models with external data are uploaded together with the files holding it, named as the model references them.
+    If background_tasks is given, the variants are generated after the response was sent and recorded on the model once built.
     """
     if not file.filename.endswith(".onnx"):
       raise BadRequestError("Only ONNX files are allowed.")
+    variants = parse_variants(DEFAULT_MODEL_VARIANTS) if variants is None else variants
+    locations = await asyncio.to_thread(external_data_locations, file.file)
+    file.file.seek(0)
+    external_files = {external_file.filename: external_file for external_file in external_data or []}
+    matched_files = match_external_data(locations, list(external_files))
     
     try:
-      latest_model = await self.db_controller.find_one(
-          {"name": file.filename}, sort=[("version", -1)]
-      )
-      new_version = 1 if latest_model is None else latest_model["version"] + 1
+      new_version = await self.next_version(file.filename)
 
-      file_id = await self.db_controller.upload_file(file.filename, file.file)
-      size = convert_size(file.size)
-      upload_date = f"{datetime.now().day}/{datetime.now().month}/{datetime.now().year}"
-
-      model_metadata = ModelMetadata(
-          file_id= str(file_id),
-          name= file.filename,
-          upload= upload_date,
-          version= new_version,
-          deploy= "",
-          size= size,
-          status= STATUS_UPLOADED,
-      )
-      new_id = await self.db_controller.insert_model(model_metadata)
-      result = {
-          "message": f"Model {file.filename} uploaded successfully!",
-          "model_id": new_id,
-          **model_metadata.to_dict()
-      }
-      return result
+      # Inputs and outputs are read once here instead of from the session on every request
+      signature = await asyncio.to_thread(read_signature, file.file)
+      file.file.seek(0)
+      # Identical bytes stored before, e.g. by a re-upload, are reused instead of stored again
+      file_id = await BlobStore(self.db_controller).store(file.filename, file.file)
+      stored_external_data = await self.store_external_data({location: external_files[file_name].file for location, file_name in matched_files.items()})
+      if variants and stored_external_data:
+        logger.info(f"Variants are not generated for {file.filename}, as it has external data.")
+        variants = []
+      size = file.size + sum(entry["size"] for entry in stored_external_data or [])
+      result = await self.insert_model(file.filename, new_version, file_id, size, signature, session_config, None, stored_external_data)
+      return await self.schedule_variants(result, variants, background_tasks)
       
     except Exception as e:
-      raise Exception(f"Error uploading model: {str(e)}")
\ No newline at end of file
+      raise Exception(f"Error uploading model: {str(e)}")
+
+  async def schedule_variants(self, model: dict, variants: list[str], background_tasks: BackgroundTasks = None) -> dict:
+    """
+    Generates the variants of a newly registered model, after the response was sent if background_tasks is given.
+    Returns the model with the variants generated so far.
+    """
+    if not variants:
+      return model
+    variant_controller = VariantController(self.db_controller)
+    if background_tasks is not None:
+      background_tasks.add_task(variant_controller.generate_model_variants, model["name"], model["version"], variants)
+      return {**model, "pending_variants": variants}
+    return {**model, "variants": await variant_controller.generate_model_variants(model["name"], model["version"], variants)}
+
+  async def store_external_data(self, files: dict) -> list[dict] | None:
+    """
+    Stores the external data files of a model, given as binary file objects by location.
+    Returns the entries to record on the model document, or None if the model has no external data.
+    """
+    if not files:
+      return None
+    blob_store = BlobStore(self.db_controller)
+    stored = []
+    for location, external_file in files.items():
+      external_file.seek(0, 2)
+      size = external_file.tell()
+      external_file.seek(0)
+      file_id = await blob_store.store(location, external_file, {"external_data": location})
+      stored.append({"location": location, "file_id": str(file_id), "size": size})
+    return stored
+
+  async def insert_model(self, file_name: str, version: int, file_id, size: int, signature: dict, session_config: SessionConfig = None, variants: dict = None, external_data: list = None):
+    """
+    Registers a model file stored in GridFS as a new uploaded version
+    """
+    upload_date = f"{datetime.now().day}/{datetime.now().month}/{datetime.now().year}"
+    model_metadata = ModelMetadata(
+        file_id= str(file_id),
+        name= file_name,
+        upload= upload_date,
+        version= version,
+        deploy= "",
+        size= convert_size(size),
+        status= STATUS_UPLOADED,
+        session_config= session_config.model_dump(exclude_none=True) if session_config else None,
+        signature= signature,
+        variants= variants,
+        external_data= external_data,
+    )
+    new_id = await self.db_controller.insert_model(model_metadata)
+    return {
+        "message": f"Model {file_name} uploaded successfully!",
+        "model_id": new_id,
+        **model_metadata.to_dict()
+    }
+
+  async def next_version(self, file_name: str) -> int:
+    latest_model = await self.db_controller.find_one(
+        {"name": file_name}, sort=[("version", -1)]
+    )
+    return 1 if latest_model is None else latest_model["version"] + 1
\ No newline at end of file
@@ -0,0 +1,258 @@
+from os import environ
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import os
+import tempfile
+import time
+import numpy as np
+from bson import ObjectId
+from pydantic import BaseModel, model_validator
+from app.controller.artifact_cache import artifact_cache, download_to
+from app.controller.blob_store import BlobStore
+from app.controller.database import DatabaseController
+from app.controller.inference_controller import InferenceController
+from app.controller.inference_executor import inference_executor
+from app.controller.result_cache import result_cache
+from app.controller.routing_table import routing_table
+from app.controller.session_cache import load_session, session_cache
+from app.controller.session_config import build_session_options
+from app.controller.warmup_controller import synthetic_inputs
+from app.util.errors import BadRequestError, NotFoundError
+from app.util.file_utils import convert_size
+from app.util.model_signature import session_signature
+from app.util.model_variants import VARIANT_ORIGINAL, build_variant, parse_variants, select_variant, variant_file_name
+
+logger = logging.getLogger("uvicorn")
+
+# Variants generated for uploaded and MLflow synced models if none are requested, e.g. "int8,optimized"
+DEFAULT_MODEL_VARIANTS = environ.get("NEXON_MODEL_VARIANTS", "")
+# Timed runs per variant of a comparison
+COMPARE_RUNS = 20
+
+
+class VariantsRequest(BaseModel):
+    variants: List[str]
+
+
+class DefaultVariantRequest(BaseModel):
+    variant: Optional[str] = None  # None or "original" serves the original model
+
+
+class CompareRequest(BaseModel):
+    input: Optional[list] = None  # Sample tensor for the first model input
+    inputs: Optional[Dict[str, Any]] = None  # Sample tensors by model input name
+
+    @model_validator(mode="after")
+    def check_inputs(self):
+        if self.input is not None and self.inputs is not None:
+            raise ValueError("At most one of 'input' or 'inputs' can be given")
+        return self
+
+
+def sample_inputs(session, seed: int = 0) -> dict | None:
+  """
+  Generates inputs from the model's input signature, normally distributed for float inputs and zero-filled otherwise.
+  """
+  feeds = synthetic_inputs(session)
+  if feeds is None:
+    return None
+  rng = np.random.default_rng(seed)
+  for name, value in feeds.items():
+    if np.issubdtype(value.dtype, np.floating):
+      feeds[name] = rng.standard_normal(value.shape).astype(value.dtype)
+  return feeds
+
+
+def time_runs(session, feeds: dict, output_names: list, runs: int) -> tuple[list, list[float]]:
+  """
+  Runs the session once untimed and then runs times, returning the results and the latencies in seconds.
+  """
+  results = session.run(output_names, feeds)
+  latencies = []
+  for _ in range(runs):
+    start = time.perf_counter()
+    session.run(output_names, feeds)
+    latencies.append(time.perf_counter() - start)
+  return results, latencies
+
+
+def compare_results(expected: list, actual: list) -> dict:
+  """
+  Compares the outputs of a variant with those of the original:
+  the largest and mean absolute differences of float outputs and the share of equal values of the others, e.g. class labels.
+  """
+  max_abs_error = 0.0
+  errors = []
+  agreement = []
+  for expected_output, actual_output in zip(expected, actual):
+    if not isinstance(expected_output, np.ndarray) or not isinstance(actual_output, np.ndarray):
+      continue
+    if np.issubdtype(expected_output.dtype, np.floating):
+      difference = np.abs(expected_output.astype(np.float64) - actual_output.astype(np.float64))
+      if difference.size:
+        max_abs_error = max(max_abs_error, float(difference.max()))
+        errors.append(float(difference.mean()))
+    elif expected_output.shape == actual_output.shape:
+      agreement.append(float(np.mean(expected_output == actual_output)) if expected_output.size else 1.0)
+  return {
+    "max_abs_error": max_abs_error,
+    "mean_abs_error": float(np.mean(errors)) if errors else 0.0,
+    "agreement": float(np.mean(agreement)) if agreement else None,
+  }
+
+
+def latency_summary(latencies: list[float]) -> dict:
+  latencies_ms = np.array(latencies) * 1000
+  return {
+    "mean": round(float(latencies_ms.mean()), 4),
+    "p50": round(float(np.percentile(latencies_ms, 50)), 4),
+    "p95": round(float(np.percentile(latencies_ms, 95)), 4),
+  }
+
+
+class VariantController:
+  def __init__(self, db_controller: DatabaseController):
+    self.db_controller = db_controller
+
+  async def generate_variants(self, file_name: str, model_path: str, variants: list[str]) -> dict:
+    """
+    Builds the given variants of the model file at model_path and stores them in GridFS next to the original.
+    Returns the variants to record on the model document. Variants that cannot be built for the model are skipped.
+    """
+    stored = {}
+    with tempfile.TemporaryDirectory(prefix="nexon-variant-") as directory:
+      for variant in variants:
+        variant_path = os.path.join(directory, variant_file_name(os.path.basename(model_path), variant))
+        try:
+          await asyncio.to_thread(build_variant, model_path, variant, variant_path)
+        except Exception as e:
+          logger.warning(f"Could not build the {variant} variant of {file_name}: {e}")
+          continue
+        with open(variant_path, "rb") as variant_file:
+          file_id = await BlobStore(self.db_controller).store(variant_file_name(file_name, variant), variant_file, {"variant": variant}, ingest="variant")
+        stored[variant] = {"file_id": str(file_id), "size": convert_size(os.path.getsize(variant_path))}
+        logger.info(f"Stored the {variant} variant of {file_name}: {convert_size(os.path.getsize(model_path))} -> {stored[variant]['size']}")
+    return stored
+
+  async def generate_model_variants(self, model_name: str, model_version: int, variants: list[str], model_path: str = None):
+    """
+    Generates the variants of a registered model and records them on it, e.g. in the background after an upload,
+    so the upload does not wait for them. The model file is downloaded unless a local copy is given.
+    Failures are logged, the model is served without the variants. Returns the variants recorded on the model.
+    """
+    try:
+      model = await self._find_model(model_name, model_version)
+      if model_path is None:
+        generated = await self._generate_from_gridfs(model, variants)
+      else:
+        generated = await self.generate_variants(model["name"], model_path, variants)
+      return await self._record_variants(model, generated) if generated else model.get("variants")
+    except Exception as e:
+      logger.error(f"Could not generate the variants {variants} of model {model_name} (v{model_version}): {e}")
+      return None
+
+  async def add_variants(self, model_name: str, model_version: int, request: VariantsRequest):
+    """
+    Generates variants of an uploaded model, replacing variants of the same name.
+    """
+    variants = parse_variants(request.variants)
+    model = await self._find_model(model_name, model_version)
+    generated = await self._generate_from_gridfs(model, variants)
+    if not generated:
+      raise BadRequestError(f"None of the variants {variants} could be built for this model.")
+    all_variants = await self._record_variants(model, generated)
+    return {"message": f"Variants {list(generated)} of model '{model_name}' (v{model_version}) generated.", "variants": all_variants}
+
+  async def set_default_variant(self, model_name: str, model_version: int, request: DefaultVariantRequest):
+    """
+    Sets the variant that serves the requests to a model which do not select one themselves.
+    """
+    model = await self._find_model(model_name, model_version)
+    variant = None if request.variant in (None, VARIANT_ORIGINAL) else request.variant
+    if variant is not None:
+      select_variant(model, variant)
+    await self.db_controller.update_one({"_id": model["_id"]}, {"$set": {"default_variant": variant}})
+    routing_table.update({**model, "default_variant": variant})
+    return {"message": f"Default variant of model '{model_name}' (v{model_version}) updated.", "default_variant": variant or VARIANT_ORIGINAL}
+
+  async def compare_variants(self, model_name: str, model_version: int, request: CompareRequest = None, runs: int = COMPARE_RUNS):
+    """
+    Runs the original model and each of its variants on a sample input, given or generated from the signature,
+    and reports their latencies and the differences of their outputs from those of the original.
+    Sessions are built for the comparison only, so the cached sessions of deployed models are left as they are.
+    """
+    if runs < 1:
+      raise BadRequestError("The number of runs must be at least 1.")
+    model = await self._find_model(model_name, model_version)
+    options = build_session_options(model.get("session_config"), len(routing_table.ids))
+    inference_controller = InferenceController(self.db_controller)
+
+    feeds = None
+    output_names = None
+    expected = None
+    report = {}
+    for variant in [VARIANT_ORIGINAL, *(model.get("variants") or {})]:
+      target = select_variant(model, variant)
+      model_source = await inference_controller._model_source(target)
+      session, _ = await inference_executor.submit(load_session, model_source, options)
+      if feeds is None:
+        signature = model.get("signature") or session_signature(session)
+        if request is not None and (request.input is not None or request.inputs is not None):
+          feeds = inference_controller._feeds(signature, request.inputs if request.inputs is not None else request.input)
+        else:
+          feeds = sample_inputs(session)
+          if feeds is None:
+            raise BadRequestError("The model has inputs without a NumPy dtype, a sample input is required.")
+        output_names = [model_output["name"] for model_output in signature["outputs"]]
+
+      try:
+        results, latencies = await inference_executor.submit(time_runs, session, feeds, output_names, runs)
+      except Exception as e:
+        if expected is None:
+          raise BadRequestError(f"Inference error: {str(e)}")
+        report[variant] = {"error": f"Inference error: {str(e)}"}
+        continue
+      size = os.path.getsize(model_source) if isinstance(model_source, str) else len(model_source)
+      entry = {"size": convert_size(size), "latency_ms": latency_summary(latencies)}
+      if expected is None:
+        expected = results
+      else:
+        entry.update(compare_results(expected, results))
+        if report[VARIANT_ORIGINAL]["latency_ms"]["mean"]:
+          entry["speedup"] = round(report[VARIANT_ORIGINAL]["latency_ms"]["mean"] / entry["latency_ms"]["mean"], 3)
+      report[variant] = entry
+    return {"runs": runs, "variants": report}
+
+  async def _generate_from_gridfs(self, model: dict, variants: list[str]) -> dict:
+    """
+    Streams the model file from GridFS to a temporary file and builds the variants from it.
+    """
+    with tempfile.TemporaryDirectory(prefix="nexon-variant-source-") as directory:
+      model_path = os.path.join(directory, "model.onnx")
+      await download_to(model_path, await self.db_controller.download_file(ObjectId(model["file_id"])))
+      return await self.generate_variants(model["name"], model_path, variants)
+
+  async def _record_variants(self, model: dict, generated: dict) -> dict:
+    """
+    Records generated variants on the model document, replacing and releasing variants of the same name.
+    Returns all variants of the model.
+    """
+    previous_variants = model.get("variants") or {}
+    all_variants = {**previous_variants, **generated}
+    await self.db_controller.update_one({"_id": model["_id"]}, {"$set": {"variants": all_variants}})
+    routing_table.update({**model, "variants": all_variants})
+    for variant in generated:
+      replaced = previous_variants.get(variant)
+      # A replaced variant built to the same bytes is still referenced by the new one
+      if replaced is not None and await BlobStore(self.db_controller).release(replaced["file_id"]):
+        session_cache.invalidate(replaced["file_id"])
+        result_cache.invalidate(replaced["file_id"])
+        artifact_cache.remove(replaced["file_id"])
+    return all_variants
+
+  async def _find_model(self, model_name: str, model_version: int) -> dict:
+    model = await self.db_controller.find_one({"name": model_name, "version": model_version})
+    if not model:
+      raise NotFoundError("Model not found.")
+    return model
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+import numpy as np
+from app.controller.database import DatabaseController
+from app.controller.inference_controller import InferenceController, onnx_to_numpy_dtype
+from app.controller.model_states import model_states
+from app.controller.routing_table import routing_table
+from app.util.constants import MODEL_STATE_FAILED, MODEL_STATE_READY, MODEL_STATE_WARMING
+from app.util.model_variants import select_variant
+
+logger = logging.getLogger("uvicorn")
+
+# Keeps scheduled warm-ups from being garbage collected before they finish
+warmup_tasks: set[asyncio.Task] = set()
+
+
+def synthetic_inputs(session) -> dict | None:
+  """
+  Generates zero-filled inputs from the model's input signature.
+  Symbolic or unknown dimensions are set to 1. Returns None if an input is not a tensor with a NumPy dtype.
+  """
+  feeds = {}
+  for model_input in session.get_inputs():
+    if model_input.type not in onnx_to_numpy_dtype:
+      return None
+    shape = [dim if isinstance(dim, int) and dim > 0 else 1 for dim in model_input.shape]
+    if model_input.type == "tensor(string)":
+      feeds[model_input.name] = np.full(shape, "", dtype=object)
+    else:
+      feeds[model_input.name] = np.zeros(shape, dtype=onnx_to_numpy_dtype[model_input.type])
+  return feeds
+
+
+class WarmupController:
+  def __init__(self, db_controller: DatabaseController):
+    self.db_controller = db_controller
+
+  def mark_warming(self, model: dict):
+    if model.get("file_id"):
+      model_states.set(model["file_id"], MODEL_STATE_WARMING)
+
+  async def warm_up(self, model: dict):
+    """
+    Loads the session of a deployed model and runs a synthetic inference,
+    so the first real request does not pay the cold start. Models with a default variant warm up that variant.
+    """
+    file_id = model.get("file_id")
+    if not file_id:
+      return
+    model_states.set(file_id, MODEL_STATE_WARMING)
+    try:
+      start = time.perf_counter()
+      inference_controller = InferenceController(self.db_controller)
+      target = select_variant(model)
+      session = await inference_controller.get_session(target)
+      feeds = synthetic_inputs(session)
+      if feeds is None:
+        logger.info(f"Model {model['name']} (v{model['version']}) has inputs without a NumPy dtype, skipping warm-up inference.")
+      else:
+        await inference_controller.run_session(target, session, feeds, None)
+      model_states.set(file_id, MODEL_STATE_READY)
+      logger.info(f"Model {model['name']} (v{model['version']}) warmed up in {time.perf_counter() - start:.3f}s.")
+    except Exception as e:
+      model_states.set(file_id, MODEL_STATE_FAILED, str(e))
+      logger.error(f"Warm-up of model {model['name']} (v{model['version']}) failed: {e}")
+
+  def schedule(self, model: dict):
+    """
+    Warms up a newly routed model in the background, e.g. one deployed by another server instance.
+    Models already warming up are skipped.
+    """
+    if not model.get("file_id") or model_states.get(model["file_id"]) == MODEL_STATE_WARMING:
+      return
+    self.mark_warming(model)
+    task = asyncio.create_task(self.warm_up(model))
+    warmup_tasks.add(task)
+    task.add_done_callback(warmup_tasks.discard)
+
+  async def warm_up_deployed(self):
+    """
+    Warms up all deployed models, e.g. after a server start.
+    """
+    models = [routing_table.resolve(name, version) for name, version in list(routing_table.ids.values())]
+    for model in models:
+      self.mark_warming(model)
+    for model in models:
+      await self.warm_up(model)
@@ -0,0 +1,509 @@
+"""
+Multi-process inference engine.
+The FastAPI process dispatches session runs to worker processes that each own the sessions of a subset of models.
+Models are assigned to workers with a consistent hash ring, so a model is only loaded in as few workers as possible.
+Tensors are passed through shared memory instead of being pickled.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
+from os import environ
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import numpy as np
+from app.controller.single_flight import SingleFlight
+from app.util.errors import ServiceUnavailableError
+from app.util.metrics import inference_stage_seconds, model_labels
+
+logger = logging.getLogger("uvicorn")
+
+# Number of worker processes, 0 runs inference in the FastAPI process
+INFERENCE_WORKERS = int(environ.get("NEXON_INFERENCE_WORKERS", "0"))
+# Number of workers each model is loaded in
+WORKER_REPLICAS = int(environ.get("NEXON_WORKER_REPLICAS", "1"))
+# Threads running sessions within each worker
+WORKER_THREADS = int(environ.get("NEXON_WORKER_THREADS", str(max(1, (os.cpu_count() or 1) // max(1, INFERENCE_WORKERS)))))
+# Seconds between worker health checks and seconds a worker may take to answer one
+WORKER_HEALTH_INTERVAL = float(environ.get("NEXON_WORKER_HEALTH_INTERVAL", "2"))
+WORKER_PING_TIMEOUT = float(environ.get("NEXON_WORKER_PING_TIMEOUT", "10"))
+
+# Points per worker on the hash ring, to spread models evenly
+VIRTUAL_NODES = 64
+
+COMMAND_LOAD = "load"
+COMMAND_RUN = "run"
+COMMAND_PING = "ping"
+COMMAND_INVALIDATE = "invalidate"
+COMMAND_STOP = "stop"
+
+ERROR_NOT_LOADED = "NotLoaded"
+
+
+class ModelNotLoadedError(Exception):
+  """Raised when a worker was asked to run a model whose session it does not hold."""
+
+
+def pack_value(value):
+  """
+  Prepares a tensor for another process. Arrays are copied into a new shared memory segment,
+  other values (e.g. ZipMap outputs or string tensors) are pickled.
+  Returns the description of the value and the segment, which the caller has to close.
+  """
+  if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+    value = np.ascontiguousarray(value)
+    segment = shared_memory.SharedMemory(create=True, size=max(value.nbytes, 1))
+    np.ndarray(value.shape, dtype=value.dtype, buffer=segment.buf)[...] = value
+    return ("shm", segment.name, value.dtype.str, value.shape), segment
+  return ("value", value), None
+
+
+def unpack_value(packed, copy: bool):
+  """
+  Reads a value prepared by pack_value. Without copy the array is a view into the segment,
+  which has to stay open until the array is no longer used.
+  """
+  if packed[0] == "value":
+    return packed[1], None
+  _, name, dtype, shape = packed
+  segment = shared_memory.SharedMemory(name=name)
+  array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+  if copy:
+    array = array.copy()
+  return array, segment
+
+
+def discard_value(packed):
+  """Releases the shared memory of a value that will not be read."""
+  if packed[0] == "shm":
+    try:
+      segment = shared_memory.SharedMemory(name=packed[1])
+      segment.close()
+      segment.unlink()
+    except FileNotFoundError:
+      pass
+
+
+def signature(session) -> dict:
+  return {
+    "inputs": [(node.name, node.type, node.shape) for node in session.get_inputs()],
+    "outputs": [(node.name, node.type, node.shape) for node in session.get_outputs()],
+  }
+
+
+def worker_main(worker_id: int, connection, threads: int, cache_max_bytes: int):
+  """
+  Entry point of a worker process. Session loads and runs are handled on a thread pool,
+  pings and invalidations directly, so a worker busy with long inferences still answers health checks.
+  """
+  from app.controller.session_cache import SessionCache, load_session
+  from app.controller.session_config import build_session_options
+
+  sessions = SessionCache(cache_max_bytes)
+  send_lock = threading.Lock()
+  pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"nexon-worker-{worker_id}")
+
+  def reply(request_id, ok, payload):
+    with send_lock:
+      connection.send((request_id, ok, payload))
+
+  def load(payload):
+    if payload.get("path") is not None:
+      model = payload["path"]
+    else:
+      segment = shared_memory.SharedMemory(name=payload["model"])
+      try:
+        model = bytes(segment.buf[:payload["size"]])
+      finally:
+        segment.close()
+    options = build_session_options(payload["session_config"], payload["loaded_models"])
+    session, footprint = load_session(model, options)
+    sessions.put(payload["file_id"], payload["model_name"], session, footprint)
+    return signature(session)
+
+  def run(payload):
+    session = sessions.get(payload["file_id"])
+    if session is None:
+      raise ModelNotLoadedError(payload["file_id"])
+    feeds = {}
+    segments = []
+    try:
+      for name, packed in payload["feeds"].items():
+        feeds[name], segment = unpack_value(packed, copy=False)
+        if segment is not None:
+          segments.append(segment)
+      results = session.run(payload["output_names"], feeds)
+    finally:
+      # Views into the segments have to be released before closing them
+      feeds.clear()
+      for segment in segments:
+        segment.close()
+    outputs = []
+    for result in results:
+      packed, segment = pack_value(result)
+      if segment is not None:
+        segment.close()
+      outputs.append(packed)
+    return {"outputs": outputs}
+
+  def handle(request_id, command, payload):
+    try:
+      result = load(payload) if command == COMMAND_LOAD else run(payload)
+      reply(request_id, True, result)
+    except ModelNotLoadedError as e:
+      reply(request_id, False, (ERROR_NOT_LOADED, str(e)))
+    except Exception as e:
+      reply(request_id, False, (type(e).__name__, str(e)))
+
+  while True:
+    try:
+      request_id, command, payload = connection.recv()
+    except (EOFError, OSError):
+      break
+    if command == COMMAND_STOP:
+      break
+    elif command == COMMAND_PING:
+      reply(request_id, True, os.getpid())
+    elif command == COMMAND_INVALIDATE:
+      sessions.invalidate(payload)
+    else:
+      pool.submit(handle, request_id, command, payload)
+  pool.shutdown(wait=False, cancel_futures=True)
+
+
+class TensorInfo():
+  """Name, type and shape of a model input or output, like onnxruntime's NodeArg."""
+  def __init__(self, name: str, type: str, shape: list):
+    self.name = name
+    self.type = type
+    self.shape = shape
+
+
+class RemoteSession():
+  """
+  Stand-in for an inference session that lives in the worker processes.
+  """
+  def __init__(self, pool, model: dict, loaded_models: int, loader):
+    self.pool = pool
+    self.file_id = str(model["file_id"])
+    self.model_name = model["name"]
+    self.session_config = model.get("session_config")
+    self.loaded_models = loaded_models
+    self.loader = loader
+    self.inputs: list[TensorInfo] = []
+    self.outputs: list[TensorInfo] = []
+
+  def get_inputs(self) -> list[TensorInfo]:
+    return self.inputs
+
+  def get_outputs(self) -> list[TensorInfo]:
+    return self.outputs
+
+  async def run(self, output_names: list, feeds: dict) -> list:
+    return await self.pool.run(self, output_names, feeds)
+
+
+class WorkerHandle():
+  def __init__(self, worker_id: int):
+    self.worker_id = worker_id
+    self.process = None
+    self.connection = None
+    self.reader: threading.Thread = None
+    self.pending: dict[int, asyncio.Future] = {}
+    self.loaded: set[str] = set()
+    self.restarts = 0
+    self.send_lock = threading.Lock()
+
+  def send(self, message):
+    with self.send_lock:
+      self.connection.send(message)
+
+
+class WorkerPool():
+  """
+  Dispatches session runs to worker processes with consistent-hash model affinity,
+  monitors the workers and restarts them when they die or stop answering.
+  """
+  def __init__(self, size: int, replicas: int, threads: int, cache_max_bytes: int):
+    self.size = size
+    self.replicas = max(1, min(replicas, size)) if size else 0
+    self.threads = threads
+    self.cache_max_bytes = cache_max_bytes
+    self.workers = [WorkerHandle(worker_id) for worker_id in range(size)]
+    self.sessions: dict[str, RemoteSession] = {}
+    self.loads = SingleFlight("worker")
+    self.ring = sorted((self._hash(f"worker-{worker_id}-{node}"), worker_id) for worker_id in range(size) for node in range(VIRTUAL_NODES))
+    self.ring_keys = [point for point, _ in self.ring]
+    self.request_ids = itertools.count()
+    self.context = multiprocessing.get_context("spawn")
+    self.loop: asyncio.AbstractEventLoop = None
+    self.monitor_task: asyncio.Task = None
+
+  @property
+  def enabled(self) -> bool:
+    return self.size > 0
+
+  def start(self):
+    self.loop = asyncio.get_running_loop()
+    for worker in self.workers:
+      self._spawn(worker)
+    self.monitor_task = asyncio.create_task(self._monitor())
+    logger.info(f"Started {self.size} inference workers with {self.threads} threads each.")
+
+  async def stop(self):
+    if self.monitor_task is not None:
+      self.monitor_task.cancel()
+      self.monitor_task = None
+    for worker in self.workers:
+      if worker.process is None:
+        continue
+      try:
+        worker.send((None, COMMAND_STOP, None))
+      except (OSError, ValueError):
+        pass
+      await asyncio.to_thread(worker.process.join, 5)
+      if worker.process.is_alive():
+        worker.process.kill()
+      self._fail_pending(worker, "Inference workers are shutting down.")
+      worker.connection.close()
+      worker.process = None
+    self.sessions.clear()
+
+  async def session(self, model: dict, loaded_models: int, loader) -> RemoteSession:
+    """
+    Returns the remote session of a model, loading it in its primary worker if necessary.
+    loader is a coroutine function returning the serialized model or the path of the model file in the artifact cache.
+    """
+    file_id = str(model["file_id"])
+    session = self.sessions.get(file_id)
+    if session is not None:
+      return session
+    return await self.loads.load(file_id, partial(self._load_session, model, loaded_models, loader))
+
+  async def _load_session(self, model: dict, loaded_models: int, loader) -> RemoteSession:
+    file_id = str(model["file_id"])
+    session = RemoteSession(self, model, loaded_models, loader)
+    # Includes the download by the loader, which is also observed on its own
+    with inference_stage_seconds.time(**model_labels(model), stage="session"):
+      await self._load_on(self._candidates(file_id)[0], session)
+    self.sessions[file_id] = session
+    return session
+
+  async def run(self, session: RemoteSession, output_names: list, feeds: dict) -> list:
+    """
+    Runs a session on one of the workers the model is assigned to.
+    """
+    worker = self._pick(session.file_id)
+    packed_feeds = {}
+    segments = []
+    try:
+      for name, value in feeds.items():
+        packed_feeds[name], segment = pack_value(value)
+        if segment is not None:
+          segments.append(segment)
+      payload = {"file_id": session.file_id, "output_names": output_names, "feeds": packed_feeds}
+      try:
+        result = await self._request(worker, COMMAND_RUN, payload)
+      except ModelNotLoadedError:
+        # The worker restarted or evicted the session, concurrent runs on the worker share the reload
+        await self.loads.load(f"{worker.worker_id}:{session.file_id}", partial(self._load_on, worker, session))
+        result = await self._request(worker, COMMAND_RUN, payload)
+    finally:
+      for segment in segments:
+        segment.close()
+        segment.unlink()
+
+    outputs = []
+    for packed in result["outputs"]:
+      value, segment = unpack_value(packed, copy=True)
+      if segment is not None:
+        segment.close()
+        segment.unlink()
+      outputs.append(value)
+    return outputs
+
+  def invalidate(self, file_id: str):
+    """
+    Drops the sessions of a model from all workers.
+    """
+    file_id = str(file_id)
+    self.sessions.pop(file_id, None)
+    for worker in self.workers:
+      if file_id in worker.loaded:
+        worker.loaded.discard(file_id)
+        try:
+          worker.send((None, COMMAND_INVALIDATE, file_id))
+        except (OSError, ValueError):
+          pass
+
+  def stats(self):
+    return {
+      "workers": [
+        {
+          "worker_id": worker.worker_id,
+          "pid": worker.process.pid if worker.process else None,
+          "alive": bool(worker.process and worker.process.is_alive()),
+          "restarts": worker.restarts,
+          "pending": len(worker.pending),
+          "models": sorted(worker.loaded),
+        }
+        for worker in self.workers
+      ],
+      "replicas": self.replicas,
+      "threads": self.threads,
+    }
+
+  async def _load_on(self, worker: WorkerHandle, session: RemoteSession):
+    model = await session.loader()
+    payload = {
+      "file_id": session.file_id,
+      "model_name": session.model_name,
+      "session_config": session.session_config,
+      "loaded_models": session.loaded_models,
+    }
+    if isinstance(model, str):
+      # Workers build the session straight from the file in the artifact cache
+      result = await self._request(worker, COMMAND_LOAD, {**payload, "path": model})
+    else:
+      segment = shared_memory.SharedMemory(create=True, size=max(len(model), 1))
+      try:
+        segment.buf[:len(model)] = model
+        result = await self._request(worker, COMMAND_LOAD, {**payload, "model": segment.name, "size": len(model)})
+      finally:
+        segment.close()
+        segment.unlink()
+    session.inputs = [TensorInfo(*node) for node in result["inputs"]]
+    session.outputs = [TensorInfo(*node) for node in result["outputs"]]
+    worker.loaded.add(session.file_id)
+
+  async def _request(self, worker: WorkerHandle, command: str, payload):
+    if worker.process is None or not worker.process.is_alive():
+      raise ServiceUnavailableError("Inference worker is restarting, please try again later.")
+    request_id = next(self.request_ids)
+    future = self.loop.create_future()
+    worker.pending[request_id] = future
+    try:
+      try:
+        worker.send((request_id, command, payload))
+      except (OSError, ValueError):
+        # The worker died after the liveness check above, the health check restarts it
+        raise ServiceUnavailableError("Inference worker is restarting, please try again later.")
+      ok, result = await future
+    finally:
+      worker.pending.pop(request_id, None)
+    if not ok:
+      error_type, message = result
+      if error_type == ERROR_NOT_LOADED:
+        worker.loaded.discard(payload["file_id"])
+        raise ModelNotLoadedError(message)
+      raise Exception(message)
+    return result
+
+  def _candidates(self, file_id: str) -> list[WorkerHandle]:
+    """
+    Returns the workers a model is assigned to, walking the hash ring clockwise from the model's hash.
+    """
+    candidates = []
+    index = bisect.bisect(self.ring_keys, self._hash(file_id))
+    for offset in range(len(self.ring)):
+      worker_id = self.ring[(index + offset) % len(self.ring)][1]
+      if worker_id not in candidates:
+        candidates.append(worker_id)
+        if len(candidates) == self.replicas:
+          break
+    return [self.workers[worker_id] for worker_id in candidates]
+
+  def _pick(self, file_id: str) -> WorkerHandle:
+    candidates = self._candidates(file_id)
+    alive = [worker for worker in candidates if worker.process is not None and worker.process.is_alive()]
+    return min(alive or candidates, key=lambda worker: len(worker.pending))
+
+  def _hash(self, key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+  def _spawn(self, worker: WorkerHandle):
+    front, back = self.context.Pipe()
+    worker.process = self.context.Process(
+      target=worker_main,
+      args=(worker.worker_id, back, self.threads, self.cache_max_bytes),
+      name=f"nexon-worker-{worker.worker_id}",
+      daemon=True,
+    )
+    worker.process.start()
+    back.close()
+    worker.connection = front
+    worker.loaded = set()
+    worker.reader = threading.Thread(target=self._read, args=(worker, front), name=f"nexon-worker-reader-{worker.worker_id}", daemon=True)
+    worker.reader.start()
+
+  def _read(self, worker: WorkerHandle, connection):
+    while True:
+      try:
+        request_id, ok, payload = connection.recv()
+      except (EOFError, OSError):
+        break
+      self.loop.call_soon_threadsafe(self._resolve, worker, request_id, ok, payload)
+
+  def _resolve(self, worker: WorkerHandle, request_id: int, ok: bool, payload):
+    future = worker.pending.get(request_id)
+    if future is not None and not future.done():
+      future.set_result((ok, payload))
+    elif ok and isinstance(payload, dict) and "outputs" in payload:
+      # Nobody waits for these outputs anymore, e.g. after a timeout
+      for packed in payload["outputs"]:
+        discard_value(packed)
+
+  def _fail_pending(self, worker: WorkerHandle, message: str):
+    for future in worker.pending.values():
+      if not future.done():
+        future.set_exception(ServiceUnavailableError(message))
+    worker.pending.clear()
+
+  async def _restart(self, worker: WorkerHandle):
+    logger.warning(f"Restarting inference worker {worker.worker_id}.")
+    if worker.process.is_alive():
+      worker.process.kill()
+    await asyncio.to_thread(worker.process.join, 1)
+    worker.connection.close()
+    self._fail_pending(worker, "Inference worker crashed, please try again.")
+    worker.restarts += 1
+    self._spawn(worker)
+
+  async def _monitor(self):
+    while True:
+      await asyncio.sleep(WORKER_HEALTH_INTERVAL)
+      results = await asyncio.gather(*[self._check(worker) for worker in self.workers], return_exceptions=True)
+      for worker, result in zip(self.workers, results):
+        if isinstance(result, Exception):
+          logger.error(f"Health check of inference worker {worker.worker_id} failed: {result}")
+
+  async def _check(self, worker: WorkerHandle):
+    if not worker.process.is_alive():
+      logger.warning(f"Inference worker {worker.worker_id} exited with code {worker.process.exitcode}.")
+      await self._restart(worker)
+      return
+    try:
+      await asyncio.wait_for(self._request(worker, COMMAND_PING, None), WORKER_PING_TIMEOUT)
+    except asyncio.TimeoutError:
+      logger.warning(f"Inference worker {worker.worker_id} did not answer within {WORKER_PING_TIMEOUT}s.")
+      await self._restart(worker)
+    except ServiceUnavailableError:
+      # The worker died during the check, e.g. the ping hit a broken pipe
+      await asyncio.to_thread(worker.process.join, 1)
+      if not worker.process.is_alive():
+        logger.warning(f"Inference worker {worker.worker_id} exited with code {worker.process.exitcode}.")
+        await self._restart(worker)
+
+
+def create_worker_pool() -> WorkerPool:
+  from app.controller.session_cache import SESSION_CACHE_MAX_MB
+  cache_max_bytes = SESSION_CACHE_MAX_MB * 1024 * 1024 // max(1, INFERENCE_WORKERS)
+  return WorkerPool(INFERENCE_WORKERS, WORKER_REPLICAS, WORKER_THREADS, cache_max_bytes)
+
+
+worker_pool = create_worker_pool()
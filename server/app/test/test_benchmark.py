@@ -0,0 +1,53 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from app.api.inference import app as inference_app
+from benchmark.compare import compare
+from benchmark.run import parse_args, run_benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+  def tearDown(self):
+      inference_app.dependency_overrides = {}
+
+  def test_generated_models(self):
+      args = parse_args(["--models", "mlp-4x8x2", "--concurrency", "1,4", "--requests", "20", "--batch", "1,3", "--warmup", "2"])
+      report = asyncio.run(run_benchmark(args))
+      assert [result["scenario"] for result in report["results"]] == [
+          "mlp-4x8x2 batch=1 concurrency=1", "mlp-4x8x2 batch=1 concurrency=4",
+          "mlp-4x8x2 batch=3 concurrency=1", "mlp-4x8x2 batch=3 concurrency=4",
+      ]
+      for result in report["results"]:
+          assert result["errors"] == 0
+          assert result["requests"] == 20
+          assert result["latency_ms"]["p50"] <= result["latency_ms"]["p99"]
+          assert result["memory"]["rss_peak_mb"] > 0
+      assert len(compare(report, report)) == 5
+
+  def test_replay(self):
+      with tempfile.TemporaryDirectory() as directory:
+          replay = os.path.join(directory, "traffic.jsonl")
+          with open(replay, "w") as replay_file:
+              replay_file.write(json.dumps({"model": "bench-mlp-2x4x2", "body": {"input": [[1, 2]]}}) + "\n")
+              replay_file.write(json.dumps({"path": "/inference/infer/bench-mlp-2x4x2/1", "body": {"input": [[3, 4]]}}) + "\n")
+              replay_file.write(json.dumps({"model": "unknown", "body": {"input": [[1, 2]]}}) + "\n")
+          args = parse_args(["--models", "", "--model-file", f"bench-mlp-2x4x2={self.model_file(directory)}", "--replay", replay, "--concurrency", "2", "--requests", "0", "--warmup", "0"])
+          report = asyncio.run(run_benchmark(args))
+      result = report["results"][0]
+      assert result["scenario"] == "replay traffic.jsonl concurrency=2"
+      assert result["requests"] == 2
+      assert result["errors"] == 1
+      assert result["first_error"].startswith("404")
+
+  def model_file(self, directory):
+      from benchmark.models import build_model
+      path = os.path.join(directory, "model.onnx")
+      with open(path, "wb") as model_file:
+          model_file.write(build_model("mlp-2x4x2")[0])
+      return path
+
+
+if __name__ == "__main__":
+    unittest.main()
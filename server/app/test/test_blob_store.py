@@ -0,0 +1,155 @@
+from types import SimpleNamespace
+import asyncio
+import hashlib
+import io
+import unittest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from fastapi import status
+from pymongo.errors import DuplicateKeyError
+from app.api.models import app as models_app
+from app.api.upload import app as upload_app
+from app.controller.blob_store import BlobStore
+from app.controller.database import get_db_controller
+from app.test.test_inference import build_double_model
+
+
+def matches(document: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        value = document.get(key)
+        if isinstance(condition, dict):
+            if "$gt" in condition and not value > condition["$gt"]:
+                return False
+            if "$lte" in condition and not value <= condition["$lte"]:
+                return False
+        elif isinstance(value, list):
+            if condition not in value:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class MockDBController:
+    def __init__(self):
+        self.files = {}
+        self.blobs = {}
+        self.models = []
+
+    async def upload_file(self, filename, file, metadata=None):
+        file_id = ObjectId()
+        self.files[file_id] = {"data": file if isinstance(file, bytes) else file.read(), "metadata": metadata}
+        return file_id
+
+    async def delete_file(self, file_id):
+        del self.files[file_id]
+
+    async def insert_blob(self, blob):
+        if blob["_id"] in self.blobs:
+            raise DuplicateKeyError("duplicate key")
+        self.blobs[blob["_id"]] = dict(blob)
+
+    async def find_blob(self, query):
+        return next((blob for blob in self.blobs.values() if matches(blob, query)), None)
+
+    async def update_blob(self, query, update):
+        blob = await self.find_blob(query)
+        if blob is None:
+            return None
+        for key, amount in update.get("$inc", {}).items():
+            blob[key] += amount
+        for key, value in update.get("$addToSet", {}).items():
+            if value not in blob[key]:
+                blob[key].append(value)
+        blob.update(update.get("$set", {}))
+        return dict(blob)
+
+    async def delete_blob(self, query):
+        blob = await self.find_blob(query)
+        if blob is not None:
+            del self.blobs[blob["_id"]]
+
+    async def find_one(self, query, sort=None):
+        models = [model for model in self.models if all(model.get(key) == value for key, value in query.items())]
+        return max(models, key=lambda model: model["version"]) if models else None
+
+    async def insert_model(self, model_metadata):
+        model_id = str(ObjectId())
+        self.models.append({"_id": model_id, **model_metadata.to_dict()})
+        return model_id
+
+    async def delete_one(self, query):
+        self.models = [model for model in self.models if model["_id"] != query["_id"]]
+        return SimpleNamespace(deleted_count=1)
+
+
+mock_controller = MockDBController()
+
+async def get_mock_controller():
+    return mock_controller
+
+
+class TestBlobStore(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+      for api in (upload_app, models_app):
+          api.dependency_overrides[get_db_controller] = get_mock_controller
+      cls.upload_client = TestClient(upload_app)
+      cls.models_client = TestClient(models_app)
+
+  @classmethod
+  def tearDownClass(cls):
+      for api in (upload_app, models_app):
+          api.dependency_overrides = {}
+
+  def setUp(self):
+      mock_controller.__init__()
+
+  def upload(self, model_bytes: bytes):
+      response = self.upload_client.post("/", files={"file": ("double.onnx", io.BytesIO(model_bytes), "application/octet-stream")})
+      assert response.status_code == status.HTTP_200_OK
+      return response.json()
+
+  def test_identical_uploads_share_one_file(self):
+      model_bytes = build_double_model()
+      first = self.upload(model_bytes)
+      second = self.upload(model_bytes)
+      assert (first["version"], second["version"]) == (1, 2)
+      assert first["file_id"] == second["file_id"]
+      assert len(mock_controller.files) == 1
+      sha256 = hashlib.sha256(model_bytes).hexdigest()
+      assert mock_controller.files[ObjectId(first["file_id"])]["metadata"] == {"sha256": sha256}
+      assert mock_controller.blobs[sha256]["refs"] == 2
+
+      # The file is deleted with the last model referencing it
+      assert self.models_client.delete("/deleteModel/double.onnx/1").status_code == status.HTTP_200_OK
+      assert len(mock_controller.files) == 1
+      assert mock_controller.blobs[sha256]["refs"] == 1
+      assert self.models_client.delete("/deleteModel/double.onnx/2").status_code == status.HTTP_200_OK
+      assert mock_controller.files == {}
+      assert mock_controller.blobs == {}
+
+  def test_register_deletes_duplicate_file(self):
+      blob_store = BlobStore(mock_controller)
+      stored_id = asyncio.run(blob_store.store("model.onnx", b"model", origin="runs:/1/model.onnx#5"))
+      duplicate_id = asyncio.run(mock_controller.upload_file("model.onnx", b"model"))
+      assert asyncio.run(blob_store.register(hashlib.sha256(b"model").hexdigest(), str(duplicate_id), 5)) == stored_id
+      assert list(mock_controller.files) == [ObjectId(stored_id)]
+
+      assert asyncio.run(blob_store.find_origin("runs:/1/model.onnx#5"))["file_id"] == stored_id
+      assert asyncio.run(blob_store.find_origin("runs:/2/model.onnx#5")) is None
+      assert asyncio.run(blob_store.acquire(stored_id)) is True
+      assert asyncio.run(blob_store.release(stored_id)) is False
+      assert asyncio.run(blob_store.release(stored_id)) is False
+      assert asyncio.run(blob_store.release(stored_id)) is True
+      assert asyncio.run(blob_store.find_origin("runs:/1/model.onnx#5")) is None
+      assert asyncio.run(blob_store.acquire(stored_id)) is False
+
+  def test_release_deletes_files_without_record(self):
+      file_id = asyncio.run(mock_controller.upload_file("legacy.onnx", b"legacy"))
+      assert asyncio.run(BlobStore(mock_controller).release(str(file_id))) is True
+      assert mock_controller.files == {}
+
+
+if __name__ == "__main__":
+    unittest.main()
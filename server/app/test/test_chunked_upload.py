@@ -0,0 +1,222 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import patch
+import hashlib
+import tempfile
+import unittest
+from fastapi.testclient import TestClient
+from fastapi import status
+from app.api.upload import app
+from app.controller import chunked_upload_controller
+from app.controller.database import get_db_controller
+from app.test.test_external_data import build_external_data_model
+from app.test.test_inference import build_double_model
+
+CHUNK_SIZE = 16
+MOCKED_ID = "mocked_id"
+
+
+class MockDBController:
+    def __init__(self):
+        self.uploads = {}
+        self.chunks = {}
+        self.files = {}
+        self.models = []
+
+    async def insert_upload(self, upload):
+        self.uploads[upload["_id"]] = upload
+        return str(upload["_id"])
+
+    async def find_upload(self, query):
+        return self.uploads.get(query["_id"])
+
+    async def find_uploads(self, query):
+        return [upload for upload in self.uploads.values() if upload["model_upload_id"] == query["model_upload_id"]]
+
+    async def update_upload(self, query, update):
+        upload = self.uploads.get(query["_id"])
+        if upload is None:
+            return SimpleNamespace(modified_count=0)
+        if "$addToSet" in update and update["$addToSet"]["received"] not in upload["received"]:
+            upload["received"].append(update["$addToSet"]["received"])
+        upload.update(update.get("$set", {}))
+        return SimpleNamespace(modified_count=1)
+
+    async def claim_upload(self, query, update):
+        upload = self.uploads.get(query["_id"])
+        if upload is None or upload["finalizing"]:
+            return None
+        upload.update(update["$set"])
+        return upload
+
+    async def delete_upload(self, query):
+        self.uploads.pop(query["_id"], None)
+
+    async def put_file_chunk(self, file_id, n, data):
+        self.chunks[(file_id, n)] = data
+
+    async def find_file_chunks(self, file_id):
+        for (chunk_file_id, n), data in sorted(self.chunks.items(), key=lambda item: item[0][1]):
+            if chunk_file_id == file_id:
+                yield {"files_id": file_id, "n": n, "data": data}
+
+    async def delete_file_chunks(self, file_id):
+        self.chunks = {key: data for key, data in self.chunks.items() if key[0] != file_id}
+
+    async def insert_file(self, file_id, filename, length, chunk_size, metadata=None):
+        self.files[file_id] = {"length": length, "chunkSize": chunk_size, "filename": filename, "metadata": metadata}
+
+    async def insert_blob(self, blob):
+        pass
+
+    async def update_blob(self, query, update):
+        return None
+
+    async def delete_blob(self, query):
+        pass
+
+    async def find_one(self, query, sort=None):
+        return None
+
+    async def insert_model(self, model_metadata):
+        self.models.append(model_metadata.to_dict())
+        return MOCKED_ID
+
+
+mock_controller = MockDBController()
+
+async def get_mock_controller():
+    return mock_controller
+
+
+class TestChunkedUploadApi(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+      app.dependency_overrides[get_db_controller] = get_mock_controller
+      cls.client = TestClient(app)
+      cls.chunk_size = patch.object(chunked_upload_controller, "UPLOAD_CHUNK_SIZE", CHUNK_SIZE)
+      cls.chunk_size.start()
+
+  @classmethod
+  def tearDownClass(cls):
+      app.dependency_overrides = {}
+      cls.chunk_size.stop()
+
+  def create_upload(self, model_bytes: bytes, **request):
+      response = self.client.post("/chunked", json={"file_name": "double.onnx", "size": len(model_bytes), **request})
+      assert response.status_code == status.HTTP_200_OK
+      return response.json()
+
+  def upload_chunks(self, upload: dict, content: bytes):
+      for offset in upload["missing_offsets"]:
+          assert self.put_chunk(upload["upload_id"], content, offset).status_code == status.HTTP_200_OK
+
+  def put_chunk(self, upload_id: str, model_bytes: bytes, offset: int):
+      return self.client.put(f"/chunked/{upload_id}", params={"offset": offset}, content=model_bytes[offset:offset + CHUNK_SIZE])
+
+  def test_parallel_chunked_upload(self):
+      model_bytes = build_double_model()
+      upload = self.create_upload(model_bytes, sha256=hashlib.sha256(model_bytes).hexdigest())
+      assert upload["chunk_size"] == CHUNK_SIZE
+      offsets = upload["missing_offsets"]
+      assert len(offsets) == upload["chunks"] > 2
+
+      # The first chunk is sent again after the others, so the running checksum is discarded and the file hashed when finalized
+      with ThreadPoolExecutor(4) as executor:
+          responses = list(executor.map(lambda offset: self.put_chunk(upload["upload_id"], model_bytes, offset), reversed(offsets)))
+      assert all(response.status_code == status.HTTP_200_OK for response in responses)
+      assert self.put_chunk(upload["upload_id"], model_bytes, 0).status_code == status.HTTP_200_OK
+
+      state = self.client.get(f"/chunked/{upload['upload_id']}").json()
+      assert state["missing_offsets"] == []
+      assert state["received_bytes"] == len(model_bytes)
+
+      response = self.client.post(f"/chunked/{upload['upload_id']}/finalize")
+      assert response.status_code == status.HTTP_200_OK
+      assert response.json()["sha256"] == hashlib.sha256(model_bytes).hexdigest()
+      assert response.json()["signature"]["inputs"][0]["name"] == "input"
+      file_id = next(file_id for file_id in mock_controller.files if str(file_id) == response.json()["file_id"])
+      assert mock_controller.files[file_id]["metadata"] == {"sha256": response.json()["sha256"]}
+      assert b"".join(data for (chunk_file_id, _), data in sorted(mock_controller.chunks.items(), key=lambda item: item[0][1]) if chunk_file_id == file_id) == model_bytes
+      assert self.client.get(f"/chunked/{upload['upload_id']}").status_code == status.HTTP_404_NOT_FOUND
+
+  def test_resume_upload(self):
+      model_bytes = build_double_model()
+      upload = self.create_upload(model_bytes)
+      self.put_chunk(upload["upload_id"], model_bytes, 0)
+
+      response = self.client.post(f"/chunked/{upload['upload_id']}/finalize")
+      assert response.status_code == status.HTTP_400_BAD_REQUEST
+      missing_offsets = self.client.get(f"/chunked/{upload['upload_id']}").json()["missing_offsets"]
+      assert missing_offsets[0] == CHUNK_SIZE
+      for offset in missing_offsets:
+          self.put_chunk(upload["upload_id"], model_bytes, offset)
+      response = self.client.post(f"/chunked/{upload['upload_id']}/finalize")
+      assert response.status_code == status.HTTP_200_OK
+      assert response.json()["sha256"] == hashlib.sha256(model_bytes).hexdigest()
+
+  def test_invalid_chunks(self):
+      model_bytes = build_double_model()
+      upload = self.create_upload(model_bytes)
+      assert self.put_chunk(upload["upload_id"], model_bytes, 1).status_code == status.HTTP_400_BAD_REQUEST
+      assert self.client.put(f"/chunked/{upload['upload_id']}", params={"offset": 0}, content=b"short").status_code == status.HTTP_400_BAD_REQUEST
+      assert self.put_chunk("unknown", model_bytes, 0).status_code == status.HTTP_404_NOT_FOUND
+      assert self.client.post("/chunked", json={"file_name": "model.bin", "size": 1}).status_code == status.HTTP_400_BAD_REQUEST
+
+  def test_checksum_mismatch_discards_upload(self):
+      model_bytes = build_double_model()
+      upload = self.create_upload(model_bytes, sha256="0" * 64)
+      for offset in upload["missing_offsets"]:
+          self.put_chunk(upload["upload_id"], model_bytes, offset)
+      response = self.client.post(f"/chunked/{upload['upload_id']}/finalize")
+      assert response.status_code == status.HTTP_400_BAD_REQUEST
+      assert self.client.get(f"/chunked/{upload['upload_id']}").status_code == status.HTTP_404_NOT_FOUND
+      assert not any(str(file_id) == upload["upload_id"] for file_id, _ in mock_controller.chunks)
+
+  def test_concurrent_finalize_is_rejected(self):
+      model_bytes = build_double_model()
+      upload = self.create_upload(model_bytes)
+      self.upload_chunks(upload, model_bytes)
+      # Another call is finalizing the upload
+      mock_controller.uploads[next(upload_id for upload_id in mock_controller.uploads if str(upload_id) == upload["upload_id"])]["finalizing"] = True
+      models = len(mock_controller.models)
+      assert self.client.post(f"/chunked/{upload['upload_id']}/finalize").status_code == status.HTTP_400_BAD_REQUEST
+      assert self.put_chunk(upload["upload_id"], model_bytes, 0).status_code == status.HTTP_400_BAD_REQUEST
+      assert len(mock_controller.models) == models
+
+  def test_upload_with_external_data(self):
+      with tempfile.TemporaryDirectory() as directory:
+          model_bytes, weights_bytes = build_external_data_model(directory)
+      upload = self.create_upload(model_bytes, file_name="bias.onnx")
+      self.upload_chunks(upload, model_bytes)
+
+      # The model references weights.data, which was not uploaded yet
+      response = self.client.post(f"/chunked/{upload['upload_id']}/finalize")
+      assert response.status_code == status.HTTP_400_BAD_REQUEST
+      assert self.client.post("/chunked", json={"file_name": "../weights.data", "size": 1, "model_upload_id": upload["upload_id"]}).status_code == status.HTTP_400_BAD_REQUEST
+      weights_upload = self.client.post(
+          "/chunked", json={"file_name": "weights.data", "size": len(weights_bytes), "sha256": hashlib.sha256(weights_bytes).hexdigest(), "model_upload_id": upload["upload_id"]}
+      ).json()
+      assert weights_upload["model_upload_id"] == upload["upload_id"]
+      self.upload_chunks(weights_upload, weights_bytes)
+      assert self.client.post(f"/chunked/{weights_upload['upload_id']}/finalize").status_code == status.HTTP_400_BAD_REQUEST
+
+      response = self.client.post(f"/chunked/{upload['upload_id']}/finalize")
+      assert response.status_code == status.HTTP_200_OK
+      external_data = response.json()["external_data"]
+      assert [(entry["location"], entry["file_id"], entry["size"]) for entry in external_data] == [("weights.data", weights_upload["upload_id"], len(weights_bytes))]
+      file = next(file for file_id, file in mock_controller.files.items() if str(file_id) == weights_upload["upload_id"])
+      assert file["metadata"] == {"external_data": "weights.data", "sha256": hashlib.sha256(weights_bytes).hexdigest()}
+      assert response.json()["signature"]["inputs"][0]["shape"] == [None, 256]
+      assert not any(str(upload_id) in (upload["upload_id"], weights_upload["upload_id"]) for upload_id in mock_controller.uploads)
+
+  def test_abort_upload(self):
+      model_bytes = build_double_model()
+      upload = self.create_upload(model_bytes)
+      self.put_chunk(upload["upload_id"], model_bytes, 0)
+      assert self.client.delete(f"/chunked/{upload['upload_id']}").status_code == status.HTTP_200_OK
+      assert not any(str(file_id) == upload["upload_id"] for file_id, _ in mock_controller.chunks)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import asyncio
 import io
 from types import SimpleNamespace
 import unittest
@@ -7,6 +8,7 @@ from fastapi import status
 from app.api.deployment import app
 from app.api.upload import app as upload_app
 from app.controller.database import ModelMetadata, get_db_controller
+from app.controller.routing_table import routing_table
 from app.util.constants import STATUS_DEPLOYED
 
 MOCKED_ID = str(ObjectId())
@@ -44,8 +46,17 @@ class MockDBController:
       })
       return MOCKED_ID
     
-    async def upload_file(self, filename, file):
+    async def upload_file(self, filename, file, metadata=None):
       return MOCKED_FILE_ID
+
+    async def insert_blob(self, blob):
+      pass
+
+    async def update_blob(self, query, update):
+      return None
+
+    async def delete_blob(self, query):
+      pass
       
 class TestDeploymentApi(unittest.TestCase):
   @classmethod
@@ -115,6 +126,44 @@ class TestDeploymentApi(unittest.TestCase):
       )
       assert response.status_code == status.HTTP_200_OK
       assert response.json()['message'] == "Model 'model.onnx' (v1) undeployed successfully."
+
+  def test_set_concurrency(self):
+      asyncio.run(get_mock_controller())
+      cached_mock_controller.find_one_result = {
+          "_id": MOCKED_ID,
+          "name": "model.onnx",
+          "version": 1,
+          "status": STATUS_DEPLOYED,
+          "file_id": MOCKED_FILE_ID,
+      }
+      response = self.client.put(
+          "/concurrency/model.onnx/1",
+          json={"max_in_flight": 2, "max_queue": 8, "max_queue_wait_ms": 250}
+      )
+      assert response.status_code == status.HTTP_200_OK
+      assert response.json()['concurrency'] == {"max_in_flight": 2, "max_queue": 8, "max_queue_wait_ms": 250}
+
+      response = self.client.put("/concurrency/model.onnx/1", json={"max_in_flight": 0})
+      assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+  def test_set_result_cache(self):
+      asyncio.run(get_mock_controller())
+      cached_mock_controller.find_one_result = {
+          "_id": MOCKED_ID,
+          "name": "model.onnx",
+          "version": 1,
+          "status": STATUS_DEPLOYED,
+          "file_id": MOCKED_FILE_ID,
+      }
+      response = self.client.put("/result-cache/model.onnx/1", json={"enabled": True, "ttl_seconds": 60})
+      assert response.status_code == status.HTTP_200_OK
+      assert response.json()['result_cache'] == {"enabled": True, "ttl_seconds": 60}
+      assert routing_table.resolve("model.onnx", 1)["result_cache"] == {"enabled": True, "ttl_seconds": 60}
+      routing_table.remove(MOCKED_ID)
+
+      response = self.client.put("/result-cache/model.onnx/1", json={"enabled": True, "ttl_seconds": 0})
+      assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
       
       
 if __name__ == "__main__":
@@ -0,0 +1,137 @@
+from unittest.mock import patch
+import io
+import os
+import tempfile
+import unittest
+import numpy as np
+import onnx
+from onnx import helper, numpy_helper, TensorProto
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from fastapi import status
+from app.api.inference import app as inference_app
+from app.api.upload import app as upload_app
+from app.controller.database import get_db_controller
+from app.controller.model_bundles import MANIFEST_FILE, bundle_cache
+from app.controller.routing_table import routing_table
+from app.controller.session_cache import session_cache
+from app.test.test_inference import MockGridOut
+from app.util.constants import STATUS_DEPLOYED
+from app.util.errors import BadRequestError
+from app.util.external_data import check_location, external_data_locations
+
+MOCKED_ID = "external_data_model_id"
+
+
+def build_external_data_model(directory: str) -> tuple[bytes, bytes]:
+    """
+    Builds a model adding a constant vector whose values are stored in the external data file weights.data.
+    """
+    graph = helper.make_graph(
+        [helper.make_node("Add", ["input", "bias"], ["output"])],
+        "bias",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [None, 256])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, [None, 256])],
+        [numpy_helper.from_array(np.arange(256, dtype=np.float32), "bias")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    path = os.path.join(directory, "bias.onnx")
+    onnx.save_model(model, path, save_as_external_data=True, all_tensors_to_one_file=True, location="weights.data", size_threshold=0)
+    with open(path, "rb") as model_file, open(os.path.join(directory, "weights.data"), "rb") as weights_file:
+        return model_file.read(), weights_file.read()
+
+
+class MockDBController:
+    def __init__(self):
+        self.files = {}
+        self.model = None
+
+    async def upload_file(self, filename, file, metadata=None):
+        file_id = ObjectId()
+        self.files[file_id] = file if isinstance(file, bytes) else file.read()
+        return file_id
+
+    async def download_file(self, file_id):
+        return MockGridOut(self.files[file_id])
+
+    async def insert_blob(self, blob):
+        pass
+
+    async def update_blob(self, query, update):
+        return None
+
+    async def find_one(self, query, sort=None):
+        return None
+
+    async def insert_model(self, model_metadata):
+        self.model = {"_id": MOCKED_ID, **model_metadata.to_dict()}
+        return MOCKED_ID
+
+
+mock_controller = MockDBController()
+
+async def get_mock_controller():
+    return mock_controller
+
+
+class TestExternalData(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+      for api in (upload_app, inference_app):
+          api.dependency_overrides[get_db_controller] = get_mock_controller
+      cls.upload_client = TestClient(upload_app)
+      cls.inference_client = TestClient(inference_app)
+      cls.directory = tempfile.TemporaryDirectory()
+      cls.model_bytes, cls.weights_bytes = build_external_data_model(cls.directory.name)
+      cls.bundle_directory = patch.object(bundle_cache, "directory", os.path.join(cls.directory.name, "bundles"))
+      cls.bundle_directory.start()
+
+  @classmethod
+  def tearDownClass(cls):
+      for api in (upload_app, inference_app):
+          api.dependency_overrides = {}
+      cls.bundle_directory.stop()
+      cls.directory.cleanup()
+      routing_table.remove(MOCKED_ID)
+
+  def upload(self, external_files: list[tuple[str, bytes]]):
+      files = [("file", ("bias.onnx", io.BytesIO(self.model_bytes), "application/octet-stream"))]
+      files += [("external_data", (name, io.BytesIO(content), "application/octet-stream")) for name, content in external_files]
+      return self.upload_client.post("/", files=files)
+
+  def test_upload_and_infer(self):
+      session_cache.clear()
+      response = self.upload([("weights.data", self.weights_bytes)])
+      assert response.status_code == status.HTTP_200_OK
+      external_data = response.json()["external_data"]
+      assert [entry["location"] for entry in external_data] == ["weights.data"]
+      assert mock_controller.files[ObjectId(external_data[0]["file_id"])] == self.weights_bytes
+      assert response.json()["signature"]["inputs"][0]["shape"] == [None, 256]
+
+      routing_table.update({**mock_controller.model, "status": STATUS_DEPLOYED})
+      response = self.inference_client.post("/infer/bias.onnx", json={"input": np.ones((1, 256)).tolist()})
+      assert response.status_code == status.HTTP_200_OK
+      np.testing.assert_array_equal(response.json()["results"][0], [np.arange(256) + 1])
+
+      model_path = bundle_cache.model_path(mock_controller.model["file_id"])
+      assert os.path.exists(os.path.join(os.path.dirname(model_path), "weights.data"))
+      assert os.path.exists(os.path.join(os.path.dirname(model_path), MANIFEST_FILE))
+      bundle_cache.remove(mock_controller.model["file_id"])
+      assert not os.path.exists(os.path.dirname(model_path))
+
+  def test_upload_requires_external_data(self):
+      assert self.upload([]).status_code == status.HTTP_400_BAD_REQUEST
+      assert self.upload([("weights.data", self.weights_bytes), ("other.data", b"")]).status_code == status.HTTP_400_BAD_REQUEST
+
+  def test_external_data_locations(self):
+      assert external_data_locations(io.BytesIO(self.model_bytes)) == ["weights.data"]
+      assert external_data_locations(io.BytesIO(b"not a model")) == []
+      assert check_location("weights/./part.data") == "weights/part.data"
+      for location in ("../weights.data", "/etc/weights.data", "weights/../../weights.data"):
+          with self.assertRaises(BadRequestError):
+              check_location(location)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,696 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from functools import partial
+from unittest.mock import patch
+import numpy as np
+from onnx import helper, TensorProto
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+from fastapi.testclient import TestClient
+from fastapi import Request, status
+from app.api.inference import app, request_deadline
+from app.controller.database import get_db_controller
+from app.controller.session_cache import session_cache, session_footprint
+from app.controller.artifact_cache import ArtifactCache
+from app.controller.routing_table import RoutingTable, routing_table
+from app.controller.result_cache import ResultCache, result_cache
+from app.controller.inference_controller import InferenceController
+from app.controller.inference_executor import Deadline, InferenceExecutor, ModelLimiter, inference_executor
+from app.controller.batching import BatchScheduler
+from app.controller.single_flight import SingleFlight, session_loads
+from app.controller.warmup_controller import WarmupController, synthetic_inputs
+from app.controller.model_states import model_states
+from app.controller.worker_pool import WorkerPool, pack_value, unpack_value
+from app.util.errors import ClientClosedRequestError, ServiceUnavailableError, TooManyRequestsError
+from app.util.json_codec import encode_json
+from app.util.metrics import Histogram, inference_in_flight, inference_stage_seconds, registry
+from app.util.model_signature import read_signature, session_signature
+from app.util.constants import STATUS_DEPLOYED
+
+MOCKED_ID = "mocked_id"
+MOCKED_FILE_ID = str(ObjectId())
+
+
+def build_double_model():
+    """Builds an ONNX model computing output = input * 2 for float inputs of shape [None, 3]."""
+    two = helper.make_tensor("two", TensorProto.FLOAT, [1], [2.0])
+    node = helper.make_node("Mul", ["input", "two"], ["output"])
+    graph = helper.make_graph(
+        [node],
+        "double",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [None, 3])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, [None, 3])],
+        initializer=[two],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    return model.SerializeToString()
+
+def build_arithmetic_model():
+    """Builds an ONNX model with inputs a, b and outputs sum = a + b, product = a * b."""
+    graph = helper.make_graph(
+        [helper.make_node("Add", ["a", "b"], ["sum"]), helper.make_node("Mul", ["a", "b"], ["product"])],
+        "arithmetic",
+        [helper.make_tensor_value_info(name, TensorProto.FLOAT, [None, 2]) for name in ("a", "b")],
+        [helper.make_tensor_value_info(name, TensorProto.FLOAT, [None, 2]) for name in ("sum", "product")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    return model.SerializeToString()
+
+def build_typed_model():
+    """Builds an ONNX model with int32, uint8 and float16 inputs, each added to itself."""
+    types = {"counts": TensorProto.INT32, "pixels": TensorProto.UINT8, "half": TensorProto.FLOAT16}
+    graph = helper.make_graph(
+        [helper.make_node("Add", [name, name], [f"{name}_doubled"]) for name in types],
+        "typed",
+        [helper.make_tensor_value_info(name, elem_type, [None, 2]) for name, elem_type in types.items()],
+        [helper.make_tensor_value_info(f"{name}_doubled", elem_type, [None, 2]) for name, elem_type in types.items()],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 14)])
+    model.ir_version = 8
+    return model.SerializeToString()
+
+MODEL_BYTES = build_double_model()
+ARITHMETIC_FILE_ID = str(ObjectId())
+TYPED_FILE_ID = str(ObjectId())
+FILES = {
+    MOCKED_FILE_ID: MODEL_BYTES,
+    ARITHMETIC_FILE_ID: build_arithmetic_model(),
+    TYPED_FILE_ID: build_typed_model(),
+}
+
+cached_mock_controller = None
+
+async def get_mock_controller():
+    global cached_mock_controller
+    if not cached_mock_controller:
+        cached_mock_controller = MockDBController()
+    return cached_mock_controller
+
+class MockGridOut:
+    def __init__(self, content):
+        self.content = content
+        self.length = len(content)
+        self.metadata = None
+
+    async def read(self):
+        return self.content
+
+    async def __aiter__(self):
+        for position in range(0, len(self.content), 64):
+            yield self.content[position:position + 64]
+
+class MockDBController:
+    def __init__(self):
+        self.downloads = 0
+        self.lookups = 0
+        self.models = {
+            "double": {
+                "_id": MOCKED_ID,
+                "file_id": MOCKED_FILE_ID,
+                "name": "double",
+                "version": 1,
+                "status": STATUS_DEPLOYED
+            },
+            "arithmetic": {
+                "_id": MOCKED_ID + "2",
+                "file_id": ARITHMETIC_FILE_ID,
+                "name": "arithmetic",
+                "version": 1,
+                "status": STATUS_DEPLOYED
+            },
+            "typed": {
+                "_id": MOCKED_ID + "3",
+                "file_id": TYPED_FILE_ID,
+                "name": "typed",
+                "version": 1,
+                "status": STATUS_DEPLOYED
+            },
+        }
+
+    async def find_one(self, query, sort=None):
+        self.lookups += 1
+        return self.models.get(query["name"])
+
+    async def find_and_sort(self, query, sort):
+        self.lookups += 1
+        model = self.models.get(query["name"])
+        return [model] if model else []
+
+    async def download_file(self, file_id):
+        self.downloads += 1
+        return MockGridOut(FILES[str(file_id)])
+
+class TestInferenceApi(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+      app.dependency_overrides[get_db_controller] = get_mock_controller
+      cls.client = TestClient(app)
+
+  @classmethod
+  def tearDownClass(cls):
+      app.dependency_overrides = {}
+
+  def setUp(self):
+      session_cache.clear()
+      routing_table.remove(MOCKED_ID)
+      routing_table.remove(MOCKED_ID + "2")
+      routing_table.remove(MOCKED_ID + "3")
+      model_states.states.clear()
+
+  def test_infer(self):
+      response = self.client.post("/infer/double", json={"input": [[1, 2, 3]]})
+      assert response.status_code == status.HTTP_200_OK
+      assert response.json()['results'] == [[[2.0, 4.0, 6.0]]]
+
+  def test_infer_version(self):
+      response = self.client.post("/infer/double/1", json={"input": [[1, 2, 3], [4, 5, 6]]})
+      assert response.status_code == status.HTTP_200_OK
+      assert np.allclose(response.json()['results'][0], [[2, 4, 6], [8, 10, 12]])
+
+  def test_infer_named_inputs_and_outputs(self):
+      response = self.client.post(
+          "/infer/arithmetic",
+          json={"inputs": {"a": [[1, 2]], "b": [[3, 4]]}, "outputs": ["product", "sum"]},
+      )
+      assert response.status_code == status.HTTP_200_OK
+      assert response.json()['outputs'] == ["product", "sum"]
+      assert response.json()['results'] == [[[3.0, 8.0]], [[4.0, 6.0]]]
+
+      response = self.client.post("/infer/arithmetic", json={"inputs": {"a": [[1, 2]], "b": [[3, 4]]}})
+      assert response.json()['outputs'] == ["sum"]
+
+  def test_infer_non_float_inputs(self):
+      response = self.client.post(
+          "/infer/typed",
+          json={"inputs": {"counts": [[1, 2]], "pixels": [[3, 4]], "half": [[0.5, 1.5]]}, "outputs": ["counts_doubled", "pixels_doubled", "half_doubled"]},
+      )
+      assert response.status_code == status.HTTP_200_OK
+      assert response.json()['results'] == [[[2, 4]], [[6, 8]], [[1.0, 3.0]]]
+
+  def test_infer_precision(self):
+      response = self.client.post("/infer/double?precision=2", json={"input": [[0.1234, 1.0 / 3, 2]]})
+      assert response.status_code == status.HTTP_200_OK
+      assert response.text == '{"results":[[[0.25,0.67,4.0]]],"outputs":["output"]}'
+      response = self.client.post("/infer/double?precision=-1", json={"input": [[1, 2, 3]]})
+      assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+  def test_encode_json_numpy_values(self):
+      document = {"half": np.ones(2, dtype=np.float16), "transposed": np.arange(4, dtype=np.int32).reshape(2, 2).T, "zipmap": [{0: np.float32(0.5)}]}
+      assert json.loads(encode_json(document)) == {"half": [1.0, 1.0], "transposed": [[0, 2], [1, 3]], "zipmap": [{"0": 0.5}]}
+
+  def test_infer_shape_mismatch(self):
+      response = self.client.post("/infer/double", json={"input": [[1, 2]]})
+      assert response.status_code == status.HTTP_400_BAD_REQUEST
+      assert response.json()['detail'] == "Input 'input' has shape [1, 2], the model expects ['?', 3]."
+      response = self.client.post("/infer/double", json={"input": [[1, 2, 3], [4, 5]]})
+      assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+  def test_stored_signature_matches_session(self):
+      db_controller = asyncio.run(get_mock_controller())
+      session = asyncio.run(InferenceController(db_controller).get_session(db_controller.models["typed"]))
+      assert read_signature(io.BytesIO(FILES[TYPED_FILE_ID])) == session_signature(session)
+
+  def test_result_cache(self):
+      result_cache.clear()
+      db_controller = asyncio.run(get_mock_controller())
+      routing_table.update({**db_controller.models["double"], "result_cache": {"enabled": True}})
+      run_session = InferenceController.run_session
+      with patch.object(InferenceController, "run_session", autospec=True, side_effect=run_session) as runs:
+          first = self.client.post("/infer/double", json={"input": [[1, 2, 3]]})
+          second = self.client.post("/infer/double", json={"input": [[1, 2, 3]]})
+          other = self.client.post("/infer/double", json={"input": [[1, 2, 4]]})
+      assert first.json() == second.json()
+      assert other.json()['results'] == [[[2.0, 4.0, 8.0]]]
+      assert runs.call_count == 2
+      assert self.client.get("/result-cache").json()["models"]["double"] == {"hits": 1, "misses": 2, "hit_rate": 1 / 3}
+
+  def test_result_cache_eviction(self):
+      cache = ResultCache(max_bytes=24, ttl_seconds=10)
+      feeds = [{"input": np.full((1, 3), i, dtype=np.float32)} for i in range(3)]
+      keys = [cache.key("file", feed, ["output"]) for feed in feeds]
+      assert cache.key("file", feeds[0], ["output"]) == keys[0]
+      assert cache.key("file", {"input": feeds[0]["input"].astype(np.float64)}, ["output"]) != keys[0]
+      for key, feed in zip(keys, feeds):
+          cache.put(key, "double", [feed["input"] * 2])
+      assert cache.get(keys[0], "double") is None
+      assert cache.get(keys[2], "double") is not None
+      with patch("app.controller.result_cache.time.monotonic", return_value=time.monotonic() + 11):
+          assert cache.get(keys[2], "double") is None
+      assert cache.stats()["evictions"] == 1
+      assert cache.stats()["expirations"] == 1
+
+  def test_metrics(self):
+      stage_count = lambda stage: inference_stage_seconds.values.get(("double", "1", stage), ([], 0.0))[0]
+      runs = sum(stage_count("run"))
+      response = self.client.post("/infer/double", json={"input": [[1, 2, 3]]})
+      assert response.status_code == status.HTTP_200_OK
+      for stage in ("routing", "download", "session", "input_conversion", "run", "serialization"):
+          assert sum(stage_count(stage)) >= 1, stage
+      assert sum(stage_count("run")) == runs + 1
+      assert inference_in_flight.values[("double", "1")] == 0
+
+      metrics = registry.render()
+      assert 'nexon_inference_requests_total{model="double",version="1",outcome="success"}' in metrics
+      assert 'nexon_inference_stage_seconds_bucket{model="double",version="1",stage="run",le="+Inf"}' in metrics
+      assert "nexon_session_cache_sessions 1" in metrics
+
+  def test_histogram_rendering(self):
+      histogram = Histogram("latency_seconds", "Latency.", ("model",), buckets=(0.1, 1.0))
+      histogram.observe(0.05, model="a")
+      histogram.observe(0.5, model="a")
+      histogram.observe(5, model="a")
+      assert histogram.render().splitlines() == [
+          "# HELP latency_seconds Latency.",
+          "# TYPE latency_seconds histogram",
+          'latency_seconds_bucket{model="a",le="0.1"} 1',
+          'latency_seconds_bucket{model="a",le="1"} 2',
+          'latency_seconds_bucket{model="a",le="+Inf"} 3',
+          'latency_seconds_sum{model="a"} 5.55',
+          'latency_seconds_count{model="a"} 3',
+      ]
+
+  def test_infer_invalid_names(self):
+      response = self.client.post("/infer/arithmetic", json={"inputs": {"a": [[1, 2]]}})
+      assert response.status_code == status.HTTP_400_BAD_REQUEST
+      response = self.client.post("/infer/arithmetic", json={"inputs": {"a": [[1, 2]], "b": [[3, 4]]}, "outputs": ["ratio"]})
+      assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+  def test_infer_npz(self):
+      body = io.BytesIO()
+      np.savez(body, a=np.array([[1, 2]], dtype=np.float32), b=np.array([[3, 4]], dtype=np.float32))
+      response = self.client.post(
+          "/infer/arithmetic?outputs=sum,product",
+          content=body.getvalue(),
+          headers={"Content-Type": "application/x-npz", "Accept": "application/x-npz"},
+      )
+      assert response.status_code == status.HTTP_200_OK
+      with np.load(io.BytesIO(response.content)) as results:
+          assert np.array_equal(results["sum"], [[4, 6]])
+          assert np.array_equal(results["product"], [[3, 8]])
+
+  def test_infer_npy(self):
+      body = io.BytesIO()
+      np.save(body, np.array([[1, 2, 3]], dtype=np.float32))
+      response = self.client.post(
+          "/infer/double",
+          content=body.getvalue(),
+          headers={"Content-Type": "application/x-npy", "Accept": "application/x-npy"},
+      )
+      assert response.status_code == status.HTTP_200_OK
+      assert response.headers['content-type'] == "application/x-npy"
+      assert np.array_equal(np.load(io.BytesIO(response.content)), [[2, 4, 6]])
+
+  def test_infer_raw_tensor(self):
+      response = self.client.post(
+          "/infer/double",
+          content=np.array([[1, 2, 3], [4, 5, 6]], dtype=np.float32).tobytes(),
+          headers={"Content-Type": "application/octet-stream", "X-Tensor-Dtype": "<f4", "X-Tensor-Shape": "2,3"},
+      )
+      assert response.status_code == status.HTTP_200_OK
+      assert response.json()['results'] == [[[2.0, 4.0, 6.0], [8.0, 10.0, 12.0]]]
+
+      response = self.client.post(
+          "/infer/double",
+          content=b"1234",
+          headers={"Content-Type": "application/octet-stream", "X-Tensor-Dtype": "<f4", "X-Tensor-Shape": "2,3"},
+      )
+      assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+  def test_infer_unsupported_content_type(self):
+      response = self.client.post("/infer/double", content=b"1,2,3", headers={"Content-Type": "text/csv"})
+      assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+  def test_infer_invalid_json(self):
+      response = self.client.post("/infer/double", json={"data": [[1, 2, 3]]})
+      assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+  def test_session_is_cached(self):
+      downloads = cached_mock_controller.downloads if cached_mock_controller else 0
+      self.client.post("/infer/double", json={"input": [[1, 2, 3]]})
+      self.client.post("/infer/double", json={"input": [[1, 2, 3]]})
+      assert cached_mock_controller.downloads == downloads + 1
+
+      stats = self.client.get("/cache").json()
+      assert stats['size'] == 1
+      assert stats['sessions'][0]['file_id'] == MOCKED_FILE_ID
+      assert stats['sessions'][0]['footprint'] == session_footprint(len(MODEL_BYTES))
+
+  def test_artifact_cache(self):
+      with tempfile.TemporaryDirectory() as directory:
+          with patch("app.controller.inference_controller.artifact_cache", ArtifactCache(directory, 10 * len(MODEL_BYTES))) as cache:
+              self.client.post("/infer/double", json={"input": [[1, 2, 3]]})
+              path = os.path.join(directory, f"{MOCKED_FILE_ID}.onnx")
+              with open(path, "rb") as model_file:
+                  assert model_file.read() == MODEL_BYTES
+
+              session_cache.clear()
+              downloads = cached_mock_controller.downloads
+              response = self.client.post("/infer/double", json={"input": [[1, 2, 3]]})
+              assert response.json()['results'] == [[[2.0, 4.0, 6.0]]]
+              assert cached_mock_controller.downloads == downloads
+              assert cache.stats()['hits'] == 1
+
+          # A restarted server verifies the checksums of the files cached before and downloads corrupted files again
+          with open(path, "r+b") as model_file:
+              model_file.write(b"corrupted")
+          with patch("app.controller.inference_controller.artifact_cache", ArtifactCache(directory, len(MODEL_BYTES))) as cache:
+              session_cache.clear()
+              response = self.client.post("/infer/double", json={"input": [[1, 2, 3]]})
+              assert response.json()['results'] == [[[2.0, 4.0, 6.0]]]
+              assert cached_mock_controller.downloads == downloads + 1
+
+              # Files are evicted least recently used first once the disk budget is exceeded
+              self.client.post("/infer/arithmetic", json={"inputs": {"a": [[1.0, 2.0]], "b": [[3.0, 4.0]]}})
+              assert not os.path.exists(path)
+              assert cache.stats()['evictions'] == 1
+
+  def test_concurrent_cold_requests_share_one_load(self):
+      asyncio.run(get_mock_controller())
+      downloads = cached_mock_controller.downloads
+      deduplicated = session_loads.deduplicated
+      model = cached_mock_controller.models["double"]
+
+      async def run():
+          controller = InferenceController(cached_mock_controller)
+          return await asyncio.gather(*(controller.get_session(model) for _ in range(8)))
+
+      sessions = asyncio.run(run())
+      assert all(session is sessions[0] for session in sessions)
+      assert cached_mock_controller.downloads == downloads + 1
+      assert session_loads.deduplicated == deduplicated + 7
+      assert session_loads.loads == {}
+
+  def test_single_flight_load_timeout(self):
+      loads = SingleFlight("test", timeout=0.05)
+      started = []
+
+      async def slow_load():
+          started.append(True)
+          await asyncio.sleep(1)
+
+      async def run():
+          return await asyncio.gather(loads.load("model", slow_load), loads.load("model", slow_load), return_exceptions=True)
+
+      errors = asyncio.run(run())
+      assert len(started) == 1
+      assert all(isinstance(error, ServiceUnavailableError) for error in errors)
+      assert loads.stats()['timeouts'] == 1
+      assert loads.stats()['in_progress'] == 0
+
+  def test_routing_table_skips_database(self):
+      self.client.post("/infer/double", json={"input": [[1, 2, 3]]})
+      lookups = cached_mock_controller.lookups
+      self.client.post("/infer/double", json={"input": [[1, 2, 3]]})
+      self.client.post("/infer/double/1", json={"input": [[1, 2, 3]]})
+      assert cached_mock_controller.lookups == lookups
+
+      routes = self.client.get("/routes").json()['routes']
+      assert routes == [{"name": "double", "version": 1, "file_id": MOCKED_FILE_ID}]
+
+  def test_routing_table_retries_change_stream_errors(self):
+      class FailingWatch:
+          def __init__(self):
+              self.errors = [OperationFailure("not authorized", code=13), OperationFailure("only supported on replica sets", code=40573)]
+
+          def watch_models(self):
+              raise self.errors.pop(0)
+
+      async def run():
+          table = RoutingTable()
+          db_controller = FailingWatch()
+          with patch("app.controller.routing_table.ROUTING_RETRY_INTERVAL", 0), patch("app.controller.routing_table.ROUTING_POLL_INTERVAL", 60):
+              task = asyncio.create_task(table._watch(db_controller))
+              await asyncio.sleep(0.05)
+              task.cancel()
+          return table, db_controller
+
+      table, db_controller = asyncio.run(run())
+      assert db_controller.errors == []
+      assert table.mode == "polling"
+
+  def test_readiness_after_warm_up(self):
+      db_controller = asyncio.run(get_mock_controller())
+      model = db_controller.models["arithmetic"]
+      routing_table.update(model)
+      response = self.client.get("/ready")
+      assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+      assert response.json()['models'][0]['state'] == "warming"
+
+      asyncio.run(WarmupController(db_controller).warm_up(model))
+      response = self.client.get("/ready")
+      assert response.status_code == status.HTTP_200_OK
+      assert response.json()['models'][0]['state'] == "ready"
+      assert session_cache.get(ARITHMETIC_FILE_ID) is not None
+
+  def test_readiness_recovers_after_failed_warm_up(self):
+      model = asyncio.run(get_mock_controller()).models["double"]
+      routing_table.update(model)
+      model_states.set(MOCKED_FILE_ID, "failed", "error")
+      assert self.client.get("/ready").status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+      self.client.post("/infer/double", json={"input": [[1, 2, 3]]})
+      assert self.client.get("/ready").status_code == status.HTTP_200_OK
+
+  def test_warm_up_inputs_match_input_types(self):
+      db_controller = asyncio.run(get_mock_controller())
+      session = asyncio.run(InferenceController(db_controller).get_session(db_controller.models["typed"]))
+      feeds = synthetic_inputs(session)
+      assert {name: value.dtype for name, value in feeds.items()} == {"counts": np.int32, "pixels": np.uint8, "half": np.float16}
+
+  def test_route_listener_sees_new_files_only(self):
+      table = RoutingTable()
+      routed = []
+      table.add_route_listener(lambda model: routed.append(model["name"]))
+      model = asyncio.run(get_mock_controller()).models["double"]
+      table.update(model)
+      table.update({**model, "batching": {"enabled": True}})
+      assert routed == ["double"]
+
+  def test_lru_eviction_respects_pins(self):
+      max_bytes = session_cache.max_bytes
+      session_cache.max_bytes = 100
+      try:
+          session_cache.pin("pinned")
+          session_cache.put("a", "pinned", object(), 60)
+          session_cache.put("b", "other", object(), 60)
+          session_cache.put("c", "other", object(), 30)
+          assert session_cache.get("a") is not None
+          assert session_cache.get("b") is None
+          assert session_cache.get("c") is not None
+      finally:
+          session_cache.unpin("pinned")
+          session_cache.max_bytes = max_bytes
+
+  def test_pinning_requires_admin_token(self):
+      with patch("app.util.admin.ADMIN_TOKEN", "secret"):
+          assert self.client.put("/cache/pin/double").status_code == status.HTTP_403_FORBIDDEN
+          assert self.client.delete("/cache/pin/double", headers={"X-Nexon-Admin-Token": "wrong"}).status_code == status.HTTP_403_FORBIDDEN
+          assert self.client.put("/cache/pin/double", headers={"X-Nexon-Admin-Token": "secret"}).status_code == status.HTTP_200_OK
+          assert "double" in session_cache.pinned_models
+          assert self.client.delete("/cache/pin/double", headers={"X-Nexon-Admin-Token": "secret"}).status_code == status.HTTP_200_OK
+          assert "double" not in session_cache.pinned_models
+
+  def test_stream(self):
+      rows = [[1, 2, 3], [4, 5, 6], "invalid", [7, 8, 9]]
+      body = "\n".join(json.dumps(row) if row != "invalid" else "{not json" for row in rows) + "\n"
+      response = self.client.post("/stream/double?batch_size=2", content=body, headers={"Content-Type": "application/x-ndjson"})
+      assert response.status_code == status.HTTP_200_OK
+      assert response.headers["content-type"].startswith("application/x-ndjson")
+      lines = [json.loads(line) for line in response.text.splitlines()]
+      assert len(lines) == 4
+      assert lines[0]["results"] == [[2.0, 4.0, 6.0]]
+      assert lines[1]["results"] == [[8.0, 10.0, 12.0]]
+      assert "error" in lines[2]
+      assert lines[3]["results"] == [[14.0, 16.0, 18.0]]
+
+  def test_stream_named_inputs(self):
+      body = "\n".join(json.dumps({"a": [i, i], "b": [1, 2]}) for i in range(3))
+      response = self.client.post("/stream/arithmetic/1?outputs=sum,product", content=body)
+      assert response.status_code == status.HTTP_200_OK
+      lines = [json.loads(line) for line in response.text.splitlines()]
+      assert [line["results"] for line in lines] == [[[i + 1.0, i + 2.0], [i * 1.0, i * 2.0]] for i in range(3)]
+
+  def test_stream_unknown_model(self):
+      response = self.client.post("/stream/unknown", content="[1, 2, 3]\n")
+      assert response.status_code == status.HTTP_404_NOT_FOUND
+
+  def test_limiter_rejects_when_queue_is_full(self):
+      async def run():
+          limiter = ModelLimiter(max_in_flight=1, max_queue=0)
+          async with limiter.slot():
+              with self.assertRaises(TooManyRequestsError):
+                  async with limiter.slot():
+                      pass
+          return limiter.stats()
+
+      stats = asyncio.run(run())
+      assert stats['rejected'] == 1
+      assert stats['in_flight'] == 0
+
+  def test_limiter_sheds_requests_past_deadline(self):
+      async def run():
+          limiter = ModelLimiter(max_in_flight=1, max_queue=4, max_queue_wait_ms=20)
+          limiter.average_run_time = 1.0
+          async with limiter.slot():
+              # The expected wait for the busy slot exceeds the deadline
+              with self.assertRaises(ServiceUnavailableError):
+                  async with limiter.slot(Deadline(100)):
+                      pass
+              # Without a deadline the request waits up to max_queue_wait_ms
+              with self.assertRaises(ServiceUnavailableError):
+                  async with limiter.slot():
+                      pass
+          return limiter.stats()
+
+      stats = asyncio.run(run())
+      assert stats['shed'] == 1
+      assert stats['timed_out'] == 1
+      assert stats['queued'] == 0
+
+  def test_deadline_terminates_run(self):
+      def run_until_terminated(output_names, feeds, run_options):
+          while not run_options.terminate:
+              time.sleep(0.001)
+          raise RuntimeError("Exiting due to terminate flag being set to true.")
+
+      async def is_disconnected():
+          return True
+
+      async def run(deadline):
+          return await inference_executor.run("terminated", None, run_until_terminated, [], {}, deadline.run_options, deadline=deadline)
+
+      with self.assertRaises(ServiceUnavailableError):
+          asyncio.run(run(Deadline(30)))
+      with self.assertRaises(ClientClosedRequestError):
+          asyncio.run(run(Deadline(None, is_disconnected)))
+
+  def test_deadline_holds_slot_until_run_returns(self):
+      executor = InferenceExecutor(4, 1, 8)
+      running = []
+      peak = []
+
+      def run_ignoring_terminate():
+          running.append(1)
+          peak.append(len(running))
+          time.sleep(0.2)
+          running.pop()
+          return "done"
+
+      async def remote_run():
+          # Runs in worker processes are not terminated by the RunOptions
+          return await asyncio.to_thread(run_ignoring_terminate)
+
+      async def run(execute):
+          first = asyncio.create_task(execute(deadline=Deadline(50)))
+          await asyncio.sleep(0.1)
+          # The first request's deadline passed, but its run still occupies the model's only slot
+          second = await execute()
+          return (await asyncio.gather(first, return_exceptions=True))[0], second
+
+      for execute in (partial(executor.run, "slow", None, run_ignoring_terminate), partial(executor.admit, "slow_remote", None, remote_run)):
+          peak.clear()
+          first, second = asyncio.run(run(execute))
+          assert isinstance(first, ServiceUnavailableError)
+          assert second == "done"
+          assert max(peak) == 1
+
+  def test_infer_timeout_header(self):
+      response = self.client.post("/infer/double", json={"input": [[1, 2, 3]]}, headers={"X-Nexon-Timeout-Ms": "5000"})
+      assert response.status_code == status.HTTP_200_OK
+      response = self.client.post("/infer/double", json={"input": [[1, 2, 3]]}, headers={"X-Nexon-Timeout-Ms": "soon"})
+      assert response.status_code == status.HTTP_400_BAD_REQUEST
+      # Without the header no deadline watches the run
+      assert request_deadline(Request({"type": "http", "headers": []})) is None
+      assert request_deadline(Request({"type": "http", "headers": [(b"x-nexon-timeout-ms", b"250")]})).remaining() > 0
+
+  def test_batch_scheduler_coalesces_requests(self):
+      calls = []
+
+      async def execute(output_names, feeds):
+          calls.append(feeds["input"].shape)
+          return [feeds["input"] * 2]
+
+      async def run():
+          scheduler = BatchScheduler(max_batch_size=4, max_wait_ms=20)
+          rows = [np.full((1, 3), i, dtype=np.float32) for i in range(3)]
+          results = await asyncio.gather(*[scheduler.run({"input": row}, ["output"], execute) for row in rows])
+          return scheduler, results
+
+      scheduler, results = asyncio.run(run())
+      assert calls == [(3, 3)]
+      for i, result in enumerate(results):
+          assert np.array_equal(result[0], np.full((1, 3), 2 * i))
+      assert scheduler.stats()['batches'] == 1
+      assert scheduler.stats()['average_batch_size'] == 3
+
+  def test_worker_pool_model_affinity(self):
+      pool = WorkerPool(size=4, replicas=2, threads=1, cache_max_bytes=0)
+      file_ids = [str(ObjectId()) for _ in range(50)]
+      assignments = {file_id: [worker.worker_id for worker in pool._candidates(file_id)] for file_id in file_ids}
+      for workers in assignments.values():
+          assert len(set(workers)) == 2
+      # Adding a worker only moves the models assigned to it
+      grown = WorkerPool(size=5, replicas=1, threads=1, cache_max_bytes=0)
+      single = WorkerPool(size=4, replicas=1, threads=1, cache_max_bytes=0)
+      for file_id in file_ids:
+          before = single._candidates(file_id)[0].worker_id
+          after = grown._candidates(file_id)[0].worker_id
+          assert after in (before, 4)
+
+  def test_worker_pool_restarts_worker_on_broken_pipe(self):
+      class DyingProcess:
+          exitcode = -9
+          alive = True
+
+          def is_alive(self):
+              return self.alive
+
+          def join(self, timeout=None):
+              self.alive = False
+
+          def kill(self):
+              self.alive = False
+
+      class BrokenConnection:
+          def send(self, message):
+              raise BrokenPipeError()
+
+          def close(self):
+              pass
+
+      async def run():
+          pool = WorkerPool(size=1, replicas=1, threads=1, cache_max_bytes=0)
+          pool.loop = asyncio.get_running_loop()
+          worker = pool.workers[0]
+          worker.process = DyingProcess()
+          worker.connection = BrokenConnection()
+          spawned = []
+          with patch.object(pool, "_spawn", spawned.append):
+              await pool._check(worker)
+          return worker, spawned
+
+      worker, spawned = asyncio.run(run())
+      assert spawned == [worker]
+      assert worker.restarts == 1
+
+  def test_worker_pool_shared_memory_round_trip(self):
+      array = np.arange(12, dtype=np.float32).reshape(3, 4)
+      packed, segment = pack_value(array)
+      value, _ = unpack_value(packed, copy=True)
+      segment.close()
+      segment.unlink()
+      assert np.array_equal(value, array)
+      assert value.dtype == np.float32
+      packed, segment = pack_value([{"a": 0.5}])
+      assert segment is None
+      assert unpack_value(packed, copy=True)[0] == [{"a": 0.5}]
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,228 @@
+import asyncio
+import io
+import json
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from fastapi import status
+from app.api.jobs import app
+from app.controller.database import get_db_controller
+from app.controller.job_controller import JobRunner, job_runner
+from app.controller.routing_table import routing_table
+from app.test.test_inference import build_double_model
+from app.util.constants import STATUS_DEPLOYED
+
+MOCKED_ID = "job_model_id"
+MOCKED_FILE_ID = ObjectId()
+ROWS = [[i, i, i] for i in range(5)]
+
+
+class MockGridOut:
+    """GridFS download stream returning its content in small chunks."""
+    def __init__(self, content: bytes, chunk_size: int = 7):
+        self.content = content
+        self.chunk_size = chunk_size
+        self.position = 0
+        self.length = len(content)
+        self.metadata = None
+
+    def seek(self, position):
+        self.position = position
+
+    async def read(self):
+        return self.content[self.position:]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.position >= len(self.content):
+            raise StopAsyncIteration()
+        chunk = self.content[self.position:self.position + self.chunk_size]
+        self.position += len(chunk)
+        return chunk
+
+
+class MockDBController:
+    def __init__(self):
+        self.models = {
+            "double": {
+                "_id": MOCKED_ID,
+                "file_id": str(MOCKED_FILE_ID),
+                "name": "double",
+                "version": 1,
+                "status": STATUS_DEPLOYED
+            },
+        }
+        self.files = {MOCKED_FILE_ID: (build_double_model(), None)}
+        self.jobs = {}
+
+    async def find_one(self, query, sort=None):
+        return self.models.get(query["name"])
+
+    async def find_and_sort(self, query, sort):
+        model = self.models.get(query["name"])
+        return [model] if model else []
+
+    async def upload_file(self, filename, file, metadata=None):
+        file_id = ObjectId()
+        self.files[file_id] = (file if isinstance(file, bytes) else file.read(), metadata)
+        return file_id
+
+    async def download_file(self, file_id):
+        return MockGridOut(self.files[file_id][0])
+
+    async def delete_file(self, file_id):
+        del self.files[file_id]
+
+    async def find_files(self, query):
+        return [SimpleNamespace(_id=file_id) for file_id, (_, metadata) in self.files.items() if metadata and metadata["job_id"] == query["metadata.job_id"]]
+
+    async def insert_job(self, job):
+        job_id = ObjectId()
+        self.jobs[job_id] = {**job, "_id": job_id}
+        return str(job_id)
+
+    async def find_job(self, query):
+        return self.jobs.get(query["_id"])
+
+    async def find_jobs(self, query):
+        return [job for job in self.jobs.values() if self._matches(job, query)]
+
+    async def update_job(self, query, update):
+        job = self.jobs.get(query["_id"])
+        if job is None or not self._matches(job, query):
+            return SimpleNamespace(matched_count=0, modified_count=0)
+        job.update(update.get("$set", {}))
+        for key, value in update.get("$push", {}).items():
+            job[key] = job[key] + [value]
+        for key, value in update.get("$inc", {}).items():
+            job[key] += value
+        return SimpleNamespace(matched_count=1, modified_count=1)
+
+    async def claim_job(self, query, update):
+        result = await self.update_job(query, update)
+        return self.jobs[query["_id"]] if result.matched_count else None
+
+    async def delete_job(self, query):
+        self.jobs.pop(query["_id"], None)
+
+    def _matches(self, job, query):
+        if "$or" in query and not any(self._matches(job, condition) for condition in query["$or"]):
+            return False
+        for key, expected in query.items():
+            if key in ("_id", "$or"):
+                continue
+            value = job.get(key)
+            if isinstance(expected, dict):
+                if "$in" in expected and value not in expected["$in"]:
+                    return False
+                if "$lt" in expected and not (value is not None and value < expected["$lt"]):
+                    return False
+            elif value != expected:
+                return False
+        return True
+
+
+mock_controller = MockDBController()
+
+async def get_mock_controller():
+    return mock_controller
+
+
+def ndjson_file(rows):
+    return io.BytesIO("".join(json.dumps(row) + "\n" for row in rows).encode())
+
+
+class TestJobsApi(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+      app.dependency_overrides[get_db_controller] = get_mock_controller
+      cls.client = TestClient(app)
+
+  @classmethod
+  def tearDownClass(cls):
+      app.dependency_overrides = {}
+      routing_table.remove(MOCKED_ID)
+
+  def create_job(self, rows, **params):
+      with patch.object(job_runner, "submit") as submit:
+          response = self.client.post("/double", files={"file": ("rows.ndjson", ndjson_file(rows), "application/x-ndjson")}, params=params)
+      assert response.status_code == status.HTTP_200_OK
+      submit.assert_called_once()
+      return response.json()["job_id"]
+
+  def test_run_job(self):
+      job_id = self.create_job(ROWS, chunk_rows=2)
+      assert self.client.get(f"/{job_id}").json()["status"] == "queued"
+
+      asyncio.run(job_runner.run_job(mock_controller, job_id))
+      job = self.client.get(f"/{job_id}").json()
+      assert job["status"] == "completed"
+      assert job["rows"] == 5
+      assert job["chunks"] == 3
+      assert job["progress"] == 1.0
+
+      response = self.client.get(f"/{job_id}/results")
+      lines = [json.loads(line) for line in response.text.splitlines()]
+      assert [line["results"] for line in lines] == [[[2.0 * i] * 3] for i in range(5)]
+
+  def test_resume_job_from_last_chunk(self):
+      job_id = self.create_job(ROWS, chunk_rows=2)
+      # Simulate a restart after the first chunk was recorded and the second one only uploaded
+      job = mock_controller.jobs[ObjectId(job_id)]
+      first_chunk = b"".join(json.dumps({"results": [[2.0 * i] * 3]}).encode() + b"\n" for i in range(2))
+      recorded = asyncio.run(mock_controller.upload_file("chunk-0", first_chunk, {"job_id": job_id, "chunk": 0}))
+      orphan = asyncio.run(mock_controller.upload_file("chunk-1", b"partial", {"job_id": job_id, "chunk": 1}))
+      job.update({"status": "running", "result_files": [str(recorded)], "rows": 2, "input_offset": len(ndjson_file(ROWS[:2]).getvalue())})
+
+      asyncio.run(job_runner.run_job(mock_controller, job_id))
+      assert orphan not in mock_controller.files
+      job = self.client.get(f"/{job_id}").json()
+      assert job["status"] == "completed"
+      assert job["rows"] == 5
+      lines = [json.loads(line) for line in self.client.get(f"/{job_id}/results").text.splitlines()]
+      assert [line["results"] for line in lines] == [[[2.0 * i] * 3] for i in range(5)]
+
+  def test_cancelled_job_does_not_run(self):
+      job_id = self.create_job(ROWS)
+      response = self.client.put(f"/{job_id}/cancel")
+      assert response.json()["status"] == "cancelled"
+      asyncio.run(job_runner.run_job(mock_controller, job_id))
+      assert self.client.get(f"/{job_id}").json()["rows"] == 0
+
+  def test_job_runs_on_one_server(self):
+      job_id = self.create_job(ROWS, chunk_rows=2)
+      other_server = JobRunner(1)
+      job = mock_controller.jobs[ObjectId(job_id)]
+      job.update({"status": "running", "owner": other_server.owner, "lease_until": time.time() + 60})
+      asyncio.run(job_runner.run_job(mock_controller, job_id))
+      assert job["rows"] == 0
+      assert asyncio.run(mock_controller.find_jobs(job_runner._claimable({}))) == []
+
+      # Once the other server's lease expired, the job is taken over and the other server stops at its next chunk
+      job["lease_until"] = time.time() - 1
+      asyncio.run(job_runner.run_job(mock_controller, job_id))
+      assert job["status"] == "completed"
+      assert job["owner"] == job_runner.owner
+      result = asyncio.run(mock_controller.update_job({"_id": job["_id"], "owner": other_server.owner}, {"$set": {}}))
+      assert result.matched_count == 0
+
+  def test_delete_job(self):
+      job_id = self.create_job(ROWS)
+      input_file_id = ObjectId(mock_controller.jobs[ObjectId(job_id)]["input_file_id"])
+      response = self.client.delete(f"/{job_id}")
+      assert response.status_code == status.HTTP_200_OK
+      assert input_file_id not in mock_controller.files
+      assert self.client.get(f"/{job_id}").status_code == status.HTTP_404_NOT_FOUND
+
+  def test_job_for_unknown_model(self):
+      response = self.client.post("/unknown", files={"file": ("rows.ndjson", ndjson_file(ROWS), "application/x-ndjson")})
+      assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+if __name__ == "__main__":
+    unittest.main()
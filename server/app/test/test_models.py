@@ -50,6 +50,15 @@ class MockDBController:
     async def delete_file(self, file_id):
         pass
       
+    async def insert_blob(self, blob):
+        pass
+
+    async def update_blob(self, query, update):
+        return None
+
+    async def delete_blob(self, query):
+        pass
+
     async def delete_one(self, query):
         return SimpleNamespace(deleted_count=1)
       
@@ -0,0 +1,146 @@
+import json
+import unittest
+from unittest.mock import patch
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from fastapi import status
+from app.api.inference import app as inference_app
+from app.api.profiles import app
+from app.controller.database import get_db_controller
+from app.controller.routing_table import routing_table
+from app.controller.session_cache import session_cache
+from app.controller.profiling_controller import summarize_trace
+from app.test.test_inference import build_double_model
+from app.test.test_jobs import MockGridOut
+from app.util.constants import STATUS_DEPLOYED
+
+MOCKED_ID = "profiled_model_id"
+MOCKED_FILE_ID = ObjectId()
+ADMIN = {"X-Nexon-Admin-Token": "secret"}
+
+
+class MockDBController:
+    def __init__(self):
+        self.model = {
+            "_id": MOCKED_ID,
+            "file_id": str(MOCKED_FILE_ID),
+            "name": "profiled",
+            "version": 1,
+            "status": STATUS_DEPLOYED
+        }
+        self.files = {MOCKED_FILE_ID: build_double_model()}
+        self.profiles = {}
+
+    async def find_one(self, query, sort=None):
+        return self.model if query["name"] == "profiled" else None
+
+    async def find_and_sort(self, query, sort):
+        return [self.model] if query["name"] == "profiled" else []
+
+    async def upload_file(self, filename, file, metadata=None):
+        file_id = ObjectId()
+        self.files[file_id] = file
+        return file_id
+
+    async def download_file(self, file_id):
+        return MockGridOut(self.files[file_id])
+
+    async def delete_file(self, file_id):
+        del self.files[file_id]
+
+    async def insert_profile(self, profile):
+        profile_id = ObjectId()
+        self.profiles[profile_id] = {**profile, "_id": profile_id}
+        return str(profile_id)
+
+    async def find_profile(self, query):
+        return self.profiles.get(query["_id"])
+
+    async def find_profiles(self, query):
+        return [profile for profile in self.profiles.values() if all(profile[key] == value for key, value in query.items())]
+
+    async def delete_profile(self, query):
+        self.profiles.pop(query["_id"], None)
+
+
+mock_controller = MockDBController()
+
+async def get_mock_controller():
+    return mock_controller
+
+
+class TestProfilesApi(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+      app.dependency_overrides[get_db_controller] = get_mock_controller
+      inference_app.dependency_overrides[get_db_controller] = get_mock_controller
+      cls.client = TestClient(app)
+      cls.inference_client = TestClient(inference_app)
+
+  @classmethod
+  def tearDownClass(cls):
+      app.dependency_overrides = {}
+      inference_app.dependency_overrides = {}
+      routing_table.remove(MOCKED_ID)
+
+  def setUp(self):
+      session_cache.clear()
+      routing_table.remove(MOCKED_ID)
+      mock_controller.model.pop("profiling", None)
+      self.admin_token = patch("app.util.admin.ADMIN_TOKEN", "secret")
+      self.admin_token.start()
+
+  def tearDown(self):
+      self.admin_token.stop()
+
+  def test_profile_request(self):
+      response = self.inference_client.post("/infer/profiled", json={"input": [[1, 2, 3]]}, headers={"X-Nexon-Profile": "1", **ADMIN})
+      assert response.status_code == status.HTTP_200_OK
+      assert response.json()['results'] == [[[2.0, 4.0, 6.0]]]
+      profile_id = response.headers["X-Nexon-Profile-Id"]
+
+      profiles = self.client.get("/", params={"model_name": "profiled"}, headers=ADMIN).json()
+      assert profile_id in [profile["profile_id"] for profile in profiles]
+
+      profile = self.client.get(f"/{profile_id}", headers=ADMIN).json()
+      assert profile["trigger"] == "request"
+      assert profile["summary"]["ops"][0]["op_type"] == "Mul"
+      assert profile["summary"]["ops"][0]["count"] == 1
+
+      trace = self.client.get(f"/{profile_id}/trace", headers=ADMIN).json()
+      assert any(event.get("cat") == "Node" for event in trace)
+
+      assert self.client.delete(f"/{profile_id}", headers=ADMIN).status_code == status.HTTP_200_OK
+      assert self.client.get(f"/{profile_id}", headers=ADMIN).status_code == status.HTTP_404_NOT_FOUND
+
+  def test_profiling_requires_admin_token(self):
+      response = self.inference_client.post("/infer/profiled", json={"input": [[1, 2, 3]]}, headers={"X-Nexon-Profile": "1"})
+      assert response.status_code == status.HTTP_403_FORBIDDEN
+      assert self.client.get("/").status_code == status.HTTP_403_FORBIDDEN
+      assert self.client.get("/", headers={"X-Nexon-Admin-Token": "wrong"}).status_code == status.HTTP_403_FORBIDDEN
+      with patch("app.util.admin.ADMIN_TOKEN", None):
+          assert self.client.get("/", headers=ADMIN).status_code == status.HTTP_403_FORBIDDEN
+
+  def test_sampled_profile(self):
+      mock_controller.model["profiling"] = {"enabled": True, "sample_rate": 1.0}
+      response = self.inference_client.post("/infer/profiled", json={"input": [[1, 2, 3]]})
+      assert response.status_code == status.HTTP_200_OK
+      profile = self.client.get(f"/{response.headers['X-Nexon-Profile-Id']}", headers=ADMIN).json()
+      assert profile["trigger"] == "sampled"
+
+  def test_summarize_trace(self):
+      trace = [
+          {"cat": "Session", "name": "model_run", "dur": 100},
+          {"cat": "Node", "name": "a_kernel_time", "dur": 30, "args": {"op_name": "MatMul"}},
+          {"cat": "Node", "name": "b_kernel_time", "dur": 50, "args": {"op_name": "MatMul"}},
+          {"cat": "Node", "name": "c_kernel_time", "dur": 20, "args": {"op_name": "Relu"}},
+          {"cat": "Node", "name": "c_fence_before", "dur": 0, "args": {"op_name": "Relu"}},
+      ]
+      summary = summarize_trace(trace, top_n=1)
+      assert summary["run_us"] == 100
+      assert summary["ops"] == [{"op_type": "MatMul", "total_us": 80, "count": 2, "share": 0.8}]
+      assert summary["nodes"] == [{"node": "b", "total_us": 50, "count": 1, "op_type": "MatMul", "share": 0.5}]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+import asyncio
+import time
+import unittest
+import numpy as np
+from onnx import helper, numpy_helper, TensorProto
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from fastapi.testclient import TestClient
+from fastapi import status
+from app.api.deployment import app
+from app.api.inference import app as inference_app
+from app.controller import deployment_controller
+from app.controller.database import get_db_controller
+from app.controller.deployment_controller import DeploymentController
+from app.controller.routing_table import routing_table
+from app.controller.session_cache import session_cache
+from app.test.test_jobs import MockGridOut
+from app.util.constants import PROMOTION_COMPLETED, PROMOTION_FAILED, PROMOTION_WARMING, STATUS_DEPLOYED, STATUS_UPLOADED
+from app.util.metrics import inference_in_flight
+
+
+def build_scale_model(factor: float):
+    graph = helper.make_graph(
+        [helper.make_node("Mul", ["input", "factor"], ["output"])],
+        "scale",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [None, 3])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, [None, 3])],
+        [numpy_helper.from_array(np.array(factor, dtype=np.float32), "factor")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    return model.SerializeToString()
+
+
+class MockDBController:
+    def __init__(self):
+        self.files = {}
+        self.models = []
+        self.promotions = {}
+
+    def reset(self, second_model: bytes):
+        self.files = {}
+        self.models = []
+        self.promotions = {}
+        for version, (model_bytes, model_status) in enumerate([(build_scale_model(2), STATUS_DEPLOYED), (second_model, STATUS_UPLOADED)], 1):
+            file_id = ObjectId()
+            self.files[file_id] = model_bytes
+            self.models.append({"_id": f"scale_v{version}", "file_id": str(file_id), "name": "scale", "version": version, "status": model_status})
+
+    async def find(self, query):
+        return [model for model in self.models if model["name"] == query["name"]]
+
+    async def find_one(self, query, sort=None):
+        return next((model for model in self.models if model["name"] == query["name"] and model["version"] == query["version"]), None)
+
+    async def update_one(self, query, update):
+        for model in self.models:
+            if model["_id"] == query["_id"]:
+                model.update(update["$set"])
+        return SimpleNamespace(modified_count=1)
+
+    async def download_file(self, file_id):
+        return MockGridOut(self.files[file_id])
+
+    async def start_promotion(self, query, update):
+        promotion = self.promotions.get(query["_id"])
+        if promotion is None:
+            self.promotions[query["_id"]] = {"_id": query["_id"], **update["$set"]}
+        elif promotion["state"] in query["$or"][0]["state"]["$in"] or promotion["started"] < query["$or"][1]["started"]["$lt"]:
+            promotion.update(update["$set"])
+        else:
+            raise DuplicateKeyError("duplicate key")
+
+    async def find_promotion(self, query):
+        promotion = self.promotions.get(query["_id"])
+        return dict(promotion) if promotion is not None else None
+
+    async def update_promotion(self, query, update):
+        promotion = self.promotions.get(query["_id"])
+        if promotion is not None and promotion["promotion_id"] == query["promotion_id"]:
+            promotion.update(update["$set"])
+
+
+mock_controller = MockDBController()
+
+async def get_mock_controller():
+    return mock_controller
+
+
+class TestPromotionApi(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+      for api in (app, inference_app):
+          api.dependency_overrides[get_db_controller] = get_mock_controller
+      cls.client = TestClient(app)
+      cls.inference_client = TestClient(inference_app)
+
+  @classmethod
+  def tearDownClass(cls):
+      for api in (app, inference_app):
+          api.dependency_overrides = {}
+      for model in mock_controller.models:
+          routing_table.remove(model["_id"])
+
+  def reset(self, second_model: bytes):
+      mock_controller.reset(second_model)
+      session_cache.clear()
+      for model in mock_controller.models:
+          routing_table.remove(model["_id"])
+      routing_table.update(mock_controller.models[0])
+
+  def infer(self):
+      response = self.inference_client.post("/infer/scale", json={"input": [[1.0, 2.0, 3.0]]})
+      assert response.status_code == status.HTTP_200_OK
+      return response.json()["results"][0]
+
+  def test_promote(self):
+      self.reset(build_scale_model(3))
+      old_model, new_model = mock_controller.models
+      assert self.infer() == [[2.0, 4.0, 6.0]]
+      assert session_cache.get(old_model["file_id"]) is not None
+
+      response = self.client.post("/promote/scale/2")
+      assert response.status_code == status.HTTP_200_OK
+      assert response.json()["promotion"]["from_versions"] == [1]
+
+      promotion = self.client.get("/promote/scale").json()
+      assert promotion["state"] == PROMOTION_COMPLETED
+      assert promotion["drained"] is True
+      assert new_model["status"] == STATUS_DEPLOYED
+      assert old_model["status"] == STATUS_UPLOADED
+      assert routing_table.resolve("scale", 1) is None
+      assert session_cache.get(old_model["file_id"]) is None
+      assert session_cache.get(new_model["file_id"]) is not None
+      assert self.infer() == [[3.0, 6.0, 9.0]]
+
+      # Rolling back promotes the previous version the same way
+      self.client.post("/promote/scale/1")
+      assert self.client.get("/promote/scale").json()["state"] == PROMOTION_COMPLETED
+      assert self.infer() == [[2.0, 4.0, 6.0]]
+
+  def test_failed_warm_up_keeps_serving_the_deployed_version(self):
+      self.reset(b"not an onnx model")
+      old_model, new_model = mock_controller.models
+
+      response = self.client.post("/promote/scale/2")
+      assert response.status_code == status.HTTP_200_OK
+      promotion = self.client.get("/promote/scale").json()
+      assert promotion["state"] == PROMOTION_FAILED
+      assert "Warm-up failed" in promotion["details"]
+      assert old_model["status"] == STATUS_DEPLOYED
+      assert new_model["status"] == STATUS_UPLOADED
+      assert self.infer() == [[2.0, 4.0, 6.0]]
+
+  def test_promote_rejects_invalid_versions(self):
+      self.reset(build_scale_model(3))
+      assert self.client.post("/promote/scale/3").status_code == status.HTTP_404_NOT_FOUND
+      assert self.client.post("/promote/scale/1").status_code == status.HTTP_400_BAD_REQUEST
+      assert self.client.get("/promote/other").status_code == status.HTTP_404_NOT_FOUND
+
+  def test_one_promotion_per_model_at_a_time(self):
+      self.reset(build_scale_model(3))
+      # A promotion started by another server instance is in progress
+      mock_controller.promotions["scale"] = {"_id": "scale", "promotion_id": "other", "model_name": "scale", "to_version": 1, "state": PROMOTION_WARMING, "started": time.time()}
+      response = self.client.post("/promote/scale/2")
+      assert response.status_code == status.HTTP_400_BAD_REQUEST
+      assert mock_controller.models[1]["status"] == STATUS_UPLOADED
+
+      # Once it expired, e.g. because its server stopped, the model can be promoted again
+      mock_controller.promotions["scale"]["started"] = time.time() - 3600
+      assert self.client.post("/promote/scale/2").status_code == status.HTTP_200_OK
+      promotion = self.client.get("/promote/scale").json()
+      assert promotion["state"] == PROMOTION_COMPLETED
+      assert promotion["promotion_id"] != "other"
+
+  def test_drain_waits_for_requests_in_flight(self):
+      model = {"name": "scale", "version": 1}
+      controller = DeploymentController(mock_controller)
+
+      async def drain():
+          inference_in_flight.inc(model="scale", version="1")
+          asyncio.get_running_loop().call_later(0.1, lambda: inference_in_flight.dec(model="scale", version="1"))
+          return await controller._drain([model])
+
+      assert asyncio.run(drain()) is True
+      inference_in_flight.inc(model="scale", version="1")
+      try:
+          with patch.object(deployment_controller, "PROMOTE_DRAIN_TIMEOUT", 0.1):
+              assert asyncio.run(controller._drain([model])) is False
+      finally:
+          inference_in_flight.dec(model="scale", version="1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,7 @@ from fastapi.testclient import TestClient
 from fastapi import status
 from app.api.upload import app
 from app.controller.database import get_db_controller
+from app.test.test_inference import build_double_model
 
 MOCKED_ID = "mocked_id"
 MOCKED_FILE_ID = "mocked_file_id"
@@ -15,8 +16,17 @@ class MockDBController:
     async def insert_model(self, model_metadata):
         return MOCKED_ID
       
-    async def upload_file(self, filename, file):
+    async def upload_file(self, filename, file, metadata=None):
         return MOCKED_FILE_ID
+
+    async def insert_blob(self, blob):
+        pass
+
+    async def update_blob(self, query, update):
+        return None
+
+    async def delete_blob(self, query):
+        pass
       
     async def find_one(self, query, sort=None):
         return None
@@ -40,6 +50,35 @@ class TestUploadApi(unittest.TestCase):
       assert response.status_code == status.HTTP_200_OK
       assert response.json()['model_id'] == MOCKED_ID
       assert response.json()['file_id'] == MOCKED_FILE_ID
+      assert response.json()['signature'] is None
+      
+  def test_upload_file_with_session_config(self):
+      response = self.client.post(
+          "/",
+          files={"file": ("model.onnx", io.BytesIO(b"dummy onnx content"), "application/octet-stream")},
+          data={"session_config": '{"intra_op_num_threads": 2, "execution_mode": "parallel"}'},
+      )
+      assert response.status_code == status.HTTP_200_OK
+      assert response.json()['session_config'] == {"intra_op_num_threads": 2, "execution_mode": "parallel"}
+
+  def test_upload_file_with_invalid_session_config(self):
+      response = self.client.post(
+          "/",
+          files={"file": ("model.onnx", io.BytesIO(b"dummy onnx content"), "application/octet-stream")},
+          data={"session_config": '{"execution_mode": "fast"}'},
+      )
+      assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+  def test_upload_file_stores_signature(self):
+      response = self.client.post(
+          "/",
+          files={"file": ("model.onnx", io.BytesIO(build_double_model()), "application/octet-stream")},
+      )
+      assert response.status_code == status.HTTP_200_OK
+      assert response.json()['signature'] == {
+          "inputs": [{"name": "input", "type": "tensor(float)", "shape": [None, 3]}],
+          "outputs": [{"name": "output", "type": "tensor(float)", "shape": [None, 3]}],
+      }
       
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,181 @@
+from types import SimpleNamespace
+import io
+import unittest
+import numpy as np
+import onnx
+from onnx import helper, numpy_helper, TensorProto
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from fastapi import status
+from app.api.deployment import app
+from app.api.inference import app as inference_app
+from app.api.upload import app as upload_app
+from app.controller.database import get_db_controller
+from app.controller.routing_table import routing_table
+from app.controller.session_cache import session_cache
+from app.test.test_jobs import MockGridOut
+from app.util.constants import STATUS_DEPLOYED
+from app.util.model_signature import read_signature
+
+MOCKED_ID = "variant_model_id"
+MOCKED_FILE_ID = ObjectId()
+
+
+def build_linear_model():
+    weights = np.random.default_rng(0).standard_normal((8, 4)).astype(np.float32)
+    graph = helper.make_graph(
+        [helper.make_node("MatMul", ["input", "weights"], ["output"])],
+        "linear",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [None, 8])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, [None, 4])],
+        [numpy_helper.from_array(weights, "weights")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    return model.SerializeToString()
+
+
+class MockDBController:
+    def __init__(self):
+        self.files = {}
+        self.model = None
+
+    def reset(self):
+        self.files = {MOCKED_FILE_ID: build_linear_model()}
+        self.model = {
+            "_id": MOCKED_ID,
+            "file_id": str(MOCKED_FILE_ID),
+            "name": "linear",
+            "version": 1,
+            "status": STATUS_DEPLOYED,
+            "signature": read_signature(io.BytesIO(self.files[MOCKED_FILE_ID])),
+        }
+
+    async def find_one(self, query, sort=None):
+        return self.model if query["name"] == self.model["name"] else None
+
+    async def find_and_sort(self, query, sort):
+        return [self.model] if query["name"] == "linear" else []
+
+    async def insert_model(self, model_metadata):
+        self.model = {"_id": MOCKED_ID, **model_metadata.to_dict()}
+        return MOCKED_ID
+
+    async def update_one(self, query, update):
+        self.model.update(update["$set"])
+        return SimpleNamespace(modified_count=1)
+
+    async def upload_file(self, filename, file, metadata=None):
+        file_id = ObjectId()
+        self.files[file_id] = file if isinstance(file, bytes) else file.read()
+        return file_id
+
+    async def insert_blob(self, blob):
+        pass
+
+    async def update_blob(self, query, update):
+        return None
+
+    async def delete_blob(self, query):
+        pass
+
+    async def download_file(self, file_id):
+        return MockGridOut(self.files[file_id])
+
+    async def delete_file(self, file_id):
+        del self.files[file_id]
+
+
+mock_controller = MockDBController()
+
+async def get_mock_controller():
+    return mock_controller
+
+
+class TestVariantsApi(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+      for api in (app, inference_app, upload_app):
+          api.dependency_overrides[get_db_controller] = get_mock_controller
+      cls.client = TestClient(app)
+      cls.inference_client = TestClient(inference_app)
+
+  @classmethod
+  def tearDownClass(cls):
+      for api in (app, inference_app, upload_app):
+          api.dependency_overrides = {}
+      routing_table.remove(MOCKED_ID)
+
+  def setUp(self):
+      mock_controller.reset()
+      session_cache.clear()
+      routing_table.remove(MOCKED_ID)
+
+  def test_upload_generates_variants(self):
+      response = TestClient(upload_app).post(
+          "/",
+          files={"file": ("linear.onnx", io.BytesIO(build_linear_model()), "application/octet-stream")},
+          data={"variants": "int8,fp16,optimized"},
+      )
+      assert response.status_code == status.HTTP_200_OK
+      # Variants are generated in the background after the response and recorded on the model
+      assert response.json()["pending_variants"] == ["int8", "fp16", "optimized"]
+      variants = mock_controller.model["variants"]
+      assert set(variants) == {"int8", "fp16", "optimized"}
+      int8_model = onnx.load_model_from_string(mock_controller.files[ObjectId(variants["int8"]["file_id"])])
+      assert "MatMulInteger" in [node.op_type for node in int8_model.graph.node]
+
+  def test_upload_rejects_unknown_variants(self):
+      response = TestClient(upload_app).post(
+          "/",
+          files={"file": ("linear.onnx", io.BytesIO(build_linear_model()), "application/octet-stream")},
+          data={"variants": "int4"},
+      )
+      assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+  def test_infer_variant(self):
+      response = self.client.post("/variants/linear/1", json={"variants": ["int8", "fp16"]})
+      assert response.status_code == status.HTTP_200_OK
+      int8_file_id = response.json()["variants"]["int8"]["file_id"]
+
+      inputs = {"input": np.ones((2, 8), dtype=np.float32).tolist()}
+      original = self.inference_client.post("/infer/linear", json=inputs).json()["results"][0]
+      for variant in ("int8", "fp16", "original"):
+          results = self.inference_client.post("/infer/linear", params={"variant": variant}, json=inputs).json()["results"][0]
+          np.testing.assert_allclose(results, original, atol=0.1)
+      assert session_cache.get(int8_file_id) is not None
+
+      response = self.inference_client.post("/infer/linear", params={"variant": "optimized"}, json=inputs)
+      assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+  def test_default_variant(self):
+      self.client.post("/variants/linear/1", json={"variants": ["int8"]})
+      assert self.client.put("/variant/linear/1", json={"variant": "fp16"}).status_code == status.HTTP_400_BAD_REQUEST
+      response = self.client.put("/variant/linear/1", json={"variant": "int8"})
+      assert response.status_code == status.HTTP_200_OK
+      assert mock_controller.model["default_variant"] == "int8"
+
+      self.inference_client.post("/infer/linear", json={"input": np.ones((1, 8)).tolist()})
+      assert session_cache.get(mock_controller.model["variants"]["int8"]["file_id"]) is not None
+      assert session_cache.get(str(MOCKED_FILE_ID)) is None
+
+      self.client.put("/variant/linear/1", json={"variant": "original"})
+      assert mock_controller.model["default_variant"] is None
+
+  def test_compare_variants(self):
+      self.client.post("/variants/linear/1", json={"variants": ["int8", "optimized"]})
+      response = self.client.post("/variants/linear/1/compare", params={"runs": 3})
+      assert response.status_code == status.HTTP_200_OK
+      report = response.json()["variants"]
+      assert list(report) == ["original", "int8", "optimized"]
+      assert "max_abs_error" not in report["original"]
+      assert report["optimized"]["max_abs_error"] < 1e-5
+      assert 0 < report["int8"]["max_abs_error"] < 0.1
+      assert report["int8"]["latency_ms"]["p50"] > 0
+
+      response = self.client.post("/variants/linear/1/compare", params={"runs": 1}, json={"input": np.ones((1, 8)).tolist()})
+      assert response.status_code == status.HTTP_200_OK
+
+
+if __name__ == "__main__":
+    unittest.main()
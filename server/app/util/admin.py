@@ -0,0 +1,22 @@
+"""
+Admin-only operations, e.g. profiling, are authorized by a shared token configured with NEXON_ADMIN_TOKEN
+and sent in the X-Nexon-Admin-Token header. Without a configured token all admin operations are disabled.
+"""
+from os import environ
+import hmac
+from fastapi import Request
+from app.util.errors import ForbiddenError
+
+ADMIN_TOKEN = environ.get("NEXON_ADMIN_TOKEN")
+ADMIN_TOKEN_HEADER = "X-Nexon-Admin-Token"
+
+
+def is_admin(request: Request) -> bool:
+  token = request.headers.get(ADMIN_TOKEN_HEADER)
+  return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def require_admin(request: Request):
+  """Dependency for FastAPI rejecting requests without the admin token."""
+  if not is_admin(request):
+    raise ForbiddenError("This operation requires the admin token.").as_http_exception()
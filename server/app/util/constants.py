@@ -6,4 +6,22 @@ for consistency and clarity in the codebase.
 
 STATUS_UPLOADED = "Uploaded"
 STATUS_DEPLOYED = "Deployed"
-STATUS_DOWNLOADING = "Downloading"
\ No newline at end of file
+STATUS_DOWNLOADING = "Downloading"
+
+# Warm-up states of deployed models
+MODEL_STATE_WARMING = "warming"
+MODEL_STATE_READY = "ready"
+MODEL_STATE_FAILED = "failed"
+
+# States of version promotions
+PROMOTION_WARMING = "warming"
+PROMOTION_DRAINING = "draining"
+PROMOTION_COMPLETED = "completed"
+PROMOTION_FAILED = "failed"
+
+# States of batch inference jobs
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_COMPLETED = "completed"
+JOB_STATUS_FAILED = "failed"
+JOB_STATUS_CANCELLED = "cancelled"
@@ -23,4 +23,34 @@ class NotFoundError(ErrorWithStatusCode):
 class InternalServerError(ErrorWithStatusCode):
   """Exception raised for internal server errors."""
   def __init__(self, message="Internal server error"):
-      super().__init__(500, message)
\ No newline at end of file
+      super().__init__(500, message)
+
+class TooManyRequestsError(ErrorWithStatusCode):
+  """Exception raised when a request is rejected because too many requests are pending."""
+  def __init__(self, message="Too many requests"):
+      super().__init__(429, message)
+
+class ServiceUnavailableError(ErrorWithStatusCode):
+  """Exception raised when the server can temporarily not handle a request."""
+  def __init__(self, message="Service unavailable"):
+      super().__init__(503, message)
+
+class NotAcceptableError(ErrorWithStatusCode):
+  """Exception raised when the response can not be encoded in the requested format."""
+  def __init__(self, message="Not acceptable"):
+      super().__init__(406, message)
+
+class UnsupportedMediaTypeError(ErrorWithStatusCode):
+  """Exception raised when the request body has an unsupported content type."""
+  def __init__(self, message="Unsupported media type"):
+      super().__init__(415, message)
+
+class ForbiddenError(ErrorWithStatusCode):
+  """Exception raised when a request lacks the permissions for an operation."""
+  def __init__(self, message="Forbidden"):
+      super().__init__(403, message)
+
+class ClientClosedRequestError(ErrorWithStatusCode):
+  """Exception raised when the client disconnected before its request was processed."""
+  def __init__(self, message="Client closed request"):
+      super().__init__(499, message)
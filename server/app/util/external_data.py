@@ -0,0 +1,73 @@
+"""
+ONNX models with external data: models larger than the 2 GB protobuf limit store their weights in separate files
+next to the model file, referenced by a location relative to the model's directory, e.g. "model.onnx.data".
+Such a model is stored as a bundle, the model file and one GridFS file per location, and materialized
+into a directory with the same layout before a session is built from the model's path.
+"""
+import logging
+import posixpath
+import onnx
+from app.util.errors import BadRequestError
+
+logger = logging.getLogger("uvicorn")
+
+
+def _tensors(graph: onnx.GraphProto):
+  yield from graph.initializer
+  for node in graph.node:
+    for attribute in node.attribute:
+      if attribute.HasField("t"):
+        yield attribute.t
+      yield from attribute.tensors
+      if attribute.HasField("g"):
+        yield from _tensors(attribute.g)
+      for subgraph in attribute.graphs:
+        yield from _tensors(subgraph)
+
+
+def external_data_locations(source) -> list[str]:
+  """
+  Returns the external data files referenced by an ONNX model, read from a path or binary file object without loading them.
+  Returns an empty list if the model has no external data or is not a valid ONNX model.
+  """
+  try:
+    model = onnx.load_model(source, format="protobuf", load_external_data=False)
+  except Exception as e:
+    logger.warning(f"Could not read the external data of the model: {e}")
+    return []
+  locations = set()
+  for tensor in _tensors(model.graph):
+    if tensor.data_location == onnx.TensorProto.EXTERNAL:
+      location = {entry.key: entry.value for entry in tensor.external_data}.get("location")
+      if location:
+        locations.add(check_location(location))
+  return sorted(locations)
+
+
+def check_location(location: str) -> str:
+  """
+  Rejects locations outside of the model's directory, so materializing a bundle never writes elsewhere.
+  """
+  normalized = posixpath.normpath(location.replace("\\", "/"))
+  if posixpath.isabs(normalized) or normalized == ".." or normalized.startswith("../"):
+    raise BadRequestError(f"The external data location '{location}' is outside of the model's directory.")
+  return normalized
+
+
+def match_external_data(locations: list[str], file_names: list[str]) -> dict[str, str]:
+  """
+  Matches the external data locations of a model with the names of the given files, by full location or by file name.
+  Returns the file name for every location.
+  """
+  matched = {}
+  for location in locations:
+    file_name = next((name for name in file_names if name in (location, posixpath.basename(location))), None)
+    if file_name is not None:
+      matched[location] = file_name
+  missing = [location for location in locations if location not in matched]
+  if missing:
+    raise BadRequestError(f"The model references external data files that were not given: {missing}.")
+  unreferenced = [name for name in file_names if name not in matched.values()]
+  if unreferenced:
+    raise BadRequestError(f"The files {unreferenced} are not referenced by the model.")
+  return matched
@@ -0,0 +1,73 @@
+"""
+JSON encoding of inference results. NumPy outputs are serialized straight to JSON bytes by orjson,
+instead of being converted to nested Python lists and walked again by FastAPI's jsonable_encoder.
+"""
+from os import environ
+import numpy as np
+import orjson
+from fastapi import Request, Response
+from app.util.errors import BadRequestError
+
+# Default number of decimals of float outputs, unset keeps their full precision
+JSON_PRECISION = int(environ["NEXON_JSON_PRECISION"]) if environ.get("NEXON_JSON_PRECISION") else None
+
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(value):
+  # Values orjson does not serialize natively, e.g. float16, non-contiguous or object arrays
+  if isinstance(value, (np.ndarray, np.generic)):
+    return value.tolist()
+  raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def encode_json(document) -> bytes:
+  return orjson.dumps(document, default=_default, option=JSON_OPTIONS)
+
+
+def round_floats(value, precision: int | None):
+  """
+  Rounds float tensors to the given number of decimals, which shortens their JSON encoding.
+  Other values, e.g. ZipMap outputs, are returned unchanged.
+  """
+  if precision is None:
+    return value
+  if isinstance(value, np.ndarray) and np.issubdtype(value.dtype, np.floating):
+    return np.round(value, precision)
+  if isinstance(value, np.floating):
+    return np.round(value, precision)
+  return value
+
+
+def precision_param(request: Request) -> int | None:
+  """Parses the 'precision' query parameter, defaulting to NEXON_JSON_PRECISION."""
+  precision = request.query_params.get("precision")
+  if precision is None:
+    return JSON_PRECISION
+  try:
+    precision = int(precision)
+  except ValueError:
+    precision = -1
+  if precision < 0:
+    raise BadRequestError("The precision must be a non-negative number of decimals.")
+  return precision
+
+
+class NumpyJSONResponse(Response):
+  """
+  JSON response whose content may contain NumPy arrays and scalars.
+  """
+  media_type = "application/json"
+
+  def render(self, content) -> bytes:
+    return encode_json(content)
+
+
+def results_response(results: dict, precision: int = None) -> NumpyJSONResponse:
+  """
+  JSON response of session outputs by output name.
+  """
+  return NumpyJSONResponse({
+    "results": [round_floats(result, precision) for result in results.values()],
+    "outputs": list(results.keys()),
+  })
@@ -0,0 +1,190 @@
+"""
+Prometheus metrics of the inference and MLflow sync paths, rendered in the Prometheus text exposition format.
+The few metric types needed are implemented here instead of depending on prometheus_client.
+Label values are given as keyword arguments, e.g. inference_stage_seconds.observe(0.01, model="m", version="1", stage="run").
+"""
+from contextlib import contextmanager
+import math
+import threading
+import time
+
+METRICS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds of the latency histograms, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+  return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+  if not names:
+    return ""
+  return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+  if value == math.inf:
+    return "+Inf"
+  if float(value).is_integer():
+    return str(int(value))
+  return repr(float(value))
+
+
+class Metric():
+  """
+  Base class of the metric types. Counters and gauges are either updated explicitly,
+  or read at scrape time from collect(), which returns the values by tuple of label values.
+  """
+  type = "untyped"
+
+  def __init__(self, name: str, documentation: str, label_names: tuple = (), collect=None):
+    self.name = name
+    self.documentation = documentation
+    self.label_names = tuple(label_names)
+    self.collect = collect
+    self.values: dict[tuple, object] = {}
+    self.lock = threading.Lock()
+
+  def _key(self, labels: dict) -> tuple:
+    if set(labels) != set(self.label_names):
+      raise ValueError(f"Metric {self.name} expects the labels {list(self.label_names)}, got {list(labels)}")
+    return tuple(str(labels[name]) for name in self.label_names)
+
+  def samples(self) -> list[tuple[str, tuple, tuple, float]]:
+    """
+    Returns the samples of the metric as (name, label names, label values, value).
+    """
+    if self.collect is not None:
+      return [(self.name, self.label_names, tuple(str(value) for value in key), value) for key, value in self.collect().items()]
+    with self.lock:
+      return [(self.name, self.label_names, key, value) for key, value in self.values.items()]
+
+  def render(self) -> str:
+    lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+    for name, label_names, label_values, value in self.samples():
+      lines.append(f"{name}{_format_labels(label_names, label_values)} {_format_value(value)}")
+    return "\n".join(lines)
+
+
+class Counter(Metric):
+  type = "counter"
+
+  def inc(self, amount: float = 1, **labels):
+    key = self._key(labels)
+    with self.lock:
+      self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+  type = "gauge"
+
+  def set(self, value: float, **labels):
+    key = self._key(labels)
+    with self.lock:
+      self.values[key] = value
+
+  def inc(self, amount: float = 1, **labels):
+    key = self._key(labels)
+    with self.lock:
+      self.values[key] = self.values.get(key, 0) + amount
+
+  def dec(self, amount: float = 1, **labels):
+    self.inc(-amount, **labels)
+
+  def get(self, **labels) -> float:
+    key = self._key(labels)
+    with self.lock:
+      return self.values.get(key, 0)
+
+
+class Histogram(Metric):
+  type = "histogram"
+
+  def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+    super().__init__(name, documentation, label_names)
+    self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+  def observe(self, value: float, **labels):
+    key = self._key(labels)
+    with self.lock:
+      counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+      for index, bound in enumerate(self.buckets):
+        if value <= bound:
+          counts[index] += 1
+          break
+      self.values[key] = (counts, total + value)
+
+  @contextmanager
+  def time(self, **labels):
+    """
+    Observes the duration of the block in seconds, also if it raises.
+    """
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(time.perf_counter() - start, **labels)
+
+  def samples(self):
+    samples = []
+    with self.lock:
+      items = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+    bucket_labels = self.label_names + ("le",)
+    for key, counts, total in items:
+      cumulative = 0
+      for bound, count in zip(self.buckets, counts):
+        cumulative += count
+        samples.append((f"{self.name}_bucket", bucket_labels, key + (_format_value(bound),), cumulative))
+      samples.append((f"{self.name}_sum", self.label_names, key, total))
+      samples.append((f"{self.name}_count", self.label_names, key, cumulative))
+    return samples
+
+
+class MetricsRegistry():
+  def __init__(self):
+    self.metrics: dict[str, Metric] = {}
+
+  def register(self, metric: Metric) -> Metric:
+    if metric.name in self.metrics:
+      raise ValueError(f"Metric {metric.name} is already registered")
+    self.metrics[metric.name] = metric
+    return metric
+
+  def counter(self, name: str, documentation: str, label_names: tuple = (), collect=None) -> Counter:
+    return self.register(Counter(name, documentation, label_names, collect))
+
+  def gauge(self, name: str, documentation: str, label_names: tuple = (), collect=None) -> Gauge:
+    return self.register(Gauge(name, documentation, label_names, collect))
+
+  def histogram(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+    return self.register(Histogram(name, documentation, label_names, buckets))
+
+  def render(self) -> str:
+    return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def model_labels(model: dict) -> dict:
+  """Labels of a model document."""
+  version = model.get("version")
+  return {"model": model["name"], "version": str(version) if version is not None else ""}
+
+
+inference_requests = registry.counter(
+  "nexon_inference_requests_total", "Inference requests by model and outcome.", ("model", "version", "outcome"))
+inference_in_flight = registry.gauge(
+  "nexon_inference_in_flight", "Inference requests currently being processed.", ("model", "version"))
+inference_stage_seconds = registry.histogram(
+  "nexon_inference_stage_seconds",
+  "Duration of the stages of an inference request: routing, download, session, input_conversion, run and serialization.",
+  ("model", "version", "stage"))
+mlflow_sync_seconds = registry.histogram(
+  "nexon_mlflow_sync_stage_seconds",
+  "Duration of the stages of an MLflow sync: registry_lookup, artifact_download and gridfs_upload.",
+  ("model", "version", "stage"))
+mlflow_sync_failures = registry.counter(
+  "nexon_mlflow_sync_failures_total", "Model versions whose MLflow download or deployment failed.", ("model", "version"))
@@ -0,0 +1,77 @@
+"""
+Input and output signatures of ONNX models, extracted once at upload time and stored in the model document.
+A signature lists name, type and shape of every input and output in the notation of ONNX Runtime,
+e.g. {"name": "input", "type": "tensor(float)", "shape": [null, 3]}. Symbolic dimensions are kept as their name.
+"""
+import logging
+import onnx
+
+logger = logging.getLogger("uvicorn")
+
+
+def _type_string(type_proto: onnx.TypeProto) -> str:
+  kind = type_proto.WhichOneof("value")
+  if kind == "tensor_type":
+    return f"tensor({onnx.TensorProto.DataType.Name(type_proto.tensor_type.elem_type).lower()})"
+  if kind == "sequence_type":
+    return f"seq({_type_string(type_proto.sequence_type.elem_type)})"
+  if kind == "map_type":
+    key_type = onnx.TensorProto.DataType.Name(type_proto.map_type.key_type).lower()
+    return f"map({key_type},{_type_string(type_proto.map_type.value_type)})"
+  if kind == "optional_type":
+    return f"optional({_type_string(type_proto.optional_type.elem_type)})"
+  return str(kind)
+
+
+def _shape(type_proto: onnx.TypeProto) -> list | None:
+  if type_proto.WhichOneof("value") != "tensor_type" or not type_proto.tensor_type.HasField("shape"):
+    return None
+  return [
+    dim.dim_value if dim.HasField("dim_value") else (dim.dim_param or None)
+    for dim in type_proto.tensor_type.shape.dim
+  ]
+
+
+def _node(value_info: onnx.ValueInfoProto) -> dict:
+  return {"name": value_info.name, "type": _type_string(value_info.type), "shape": _shape(value_info.type)}
+
+
+def read_signature(source) -> dict | None:
+  """
+  Reads the signature of an ONNX model from a path or binary file object without loading external weights.
+  Returns None if the file is not a valid ONNX model.
+  """
+  try:
+    model = onnx.load_model(source, format="protobuf", load_external_data=False)
+  except Exception as e:
+    logger.warning(f"Could not read the signature of the model: {e}")
+    return None
+  initializers = {initializer.name for initializer in model.graph.initializer}
+  return {
+    "inputs": [_node(value_info) for value_info in model.graph.input if value_info.name not in initializers],
+    "outputs": [_node(value_info) for value_info in model.graph.output],
+  }
+
+
+def session_signature(session) -> dict:
+  """
+  Signature of a loaded session, for models stored before signatures were extracted at upload time.
+  """
+  def node(node_arg):
+    shape = node_arg.shape if node_arg.type.startswith("tensor(") else None
+    return {"name": node_arg.name, "type": node_arg.type, "shape": [dim if isinstance(dim, (int, str)) else None for dim in shape] if shape is not None else None}
+  return {
+    "inputs": [node(node_arg) for node_arg in session.get_inputs()],
+    "outputs": [node(node_arg) for node_arg in session.get_outputs()],
+  }
+
+
+def shape_mismatch(shape: tuple, expected: list | None) -> bool:
+  """
+  Checks a tensor shape against the shape of a signature. Symbolic and unknown dimensions match any size.
+  """
+  if expected is None:
+    return False
+  if len(shape) != len(expected):
+    return True
+  return any(isinstance(dim, int) and dim > 0 and size != dim for size, dim in zip(shape, expected))
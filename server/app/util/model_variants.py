@@ -0,0 +1,81 @@
+"""
+Optimized variants of ONNX models, derived from the original model file and stored next to it:
+int8 quantizes the weights with ONNX Runtime's dynamic quantization,
+fp16 converts the float tensors to float16 while keeping float32 inputs and outputs,
+optimized stores the graph after ONNX Runtime's extended graph optimizations, so sessions skip most of them at load time.
+All variants keep the inputs and outputs of the original, so the model's signature applies to them as well.
+"""
+import os
+import onnx
+import onnxruntime as ort
+from app.util.errors import BadRequestError
+
+VARIANT_ORIGINAL = "original"
+VARIANT_INT8 = "int8"
+VARIANT_FP16 = "fp16"
+VARIANT_OPTIMIZED = "optimized"
+MODEL_VARIANTS = (VARIANT_INT8, VARIANT_FP16, VARIANT_OPTIMIZED)
+
+
+def parse_variants(value: str | list | None) -> list[str]:
+  """
+  Parses a comma separated list of variant names, e.g. "int8,optimized".
+  """
+  if not value:
+    return []
+  names = value.split(",") if isinstance(value, str) else value
+  variants = list(dict.fromkeys(name.strip() for name in names if name.strip()))
+  unknown = [variant for variant in variants if variant not in MODEL_VARIANTS]
+  if unknown:
+    raise BadRequestError(f"Unknown model variants {unknown}. Available variants are {list(MODEL_VARIANTS)}.")
+  return variants
+
+
+def build_variant(model_path: str, variant: str, variant_path: str):
+  """
+  Builds the given variant of the ONNX model file at model_path into variant_path. The model is read from disk by
+  ONNX Runtime's tools instead of being passed around as bytes. CPU bound, run it off the event loop.
+  """
+  if variant == VARIANT_FP16:
+    from onnxruntime.transformers.float16 import convert_float_to_float16
+    model = convert_float_to_float16(onnx.load_model(model_path), keep_io_types=True)
+    onnx.save_model(model, variant_path)
+  elif variant == VARIANT_INT8:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(model_path, variant_path, weight_type=QuantType.QInt8)
+  elif variant == VARIANT_OPTIMIZED:
+    # Extended optimizations only fuse into operators of the CPU execution provider, which the server runs on
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    options.optimized_model_filepath = variant_path
+    ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+  else:
+    raise BadRequestError(f"Unknown model variant '{variant}'.")
+
+
+def variant_file_name(file_name: str, variant: str) -> str:
+  base, extension = os.path.splitext(file_name)
+  return f"{base}.{variant}{extension or '.onnx'}"
+
+
+def select_variant(model: dict, variant: str = None) -> dict:
+  """
+  Returns the model document to run a request on: the given variant, the model's default variant, or the original.
+  The selected variant's file replaces the original file, so it gets its own session and cached results.
+  """
+  variant = variant or model.get("default_variant")
+  if not variant or variant == VARIANT_ORIGINAL:
+    return model
+  variants = model.get("variants") or {}
+  if variant not in variants:
+    raise BadRequestError(f"Model {model['name']} (v{model['version']}) has no '{variant}' variant. Available variants are {[VARIANT_ORIGINAL, *variants]}.")
+  return {**model, "file_id": variants[variant]["file_id"], "variant": variant}
+
+
+def model_file_ids(model: dict) -> list[str]:
+  """
+  Returns the ids of the original file, of all variant files and of the external data files of a model.
+  """
+  file_ids = [str(model["file_id"])] if model.get("file_id") else []
+  file_ids += [variant["file_id"] for variant in (model.get("variants") or {}).values()]
+  return file_ids + [entry["file_id"] for entry in model.get("external_data") or []]
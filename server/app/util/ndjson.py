@@ -0,0 +1,77 @@
+"""
+Newline delimited JSON (NDJSON) for the streaming inference endpoints.
+Every line of a body is one JSON document, so bodies can be read and written incrementally.
+"""
+from typing import AsyncIterator
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+from starlette.types import Receive, Scope, Send
+from app.util.json_codec import encode_json
+
+MEDIA_TYPE_NDJSON = "application/x-ndjson"
+
+
+class RequestBody():
+  """
+  Streams the body of a request and tracks whether it was received completely.
+  """
+  def __init__(self, request: Request):
+    self.request = request
+    self.consumed = False
+
+  async def chunks(self) -> AsyncIterator[bytes]:
+    async for chunk in self.request.stream():
+      yield chunk
+    self.consumed = True
+
+  async def is_disconnected(self) -> bool:
+    # Polling for a disconnect while the body is read would drop body messages.
+    # Until then a disconnect surfaces as ClientDisconnect from the body stream.
+    return self.consumed and await self.request.is_disconnected()
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+  """
+  Streams a response while its generator still reads the request body.
+  StreamingResponse listens for disconnects by receiving messages itself, which would compete with the body stream,
+  so the generator checks for disconnects instead.
+  """
+  media_type = MEDIA_TYPE_NDJSON
+
+  async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    try:
+      await self.stream_response(send)
+    except (ClientDisconnect, OSError):
+      return
+    if self.background is not None:
+      await self.background()
+
+
+async def ndjson_records(chunks: AsyncIterator[bytes], offset: int = 0) -> AsyncIterator[tuple[bytes, int]]:
+  """
+  Splits a stream of body chunks into non-empty lines, each with the byte offset just past the line.
+  offset is the position of the first chunk in the stream. Only the current incomplete line is buffered.
+  """
+  buffer = b""
+  async for chunk in chunks:
+    buffer += chunk
+    *lines, buffer = buffer.split(b"\n")
+    for line in lines:
+      offset += len(line) + 1
+      if line.strip():
+        yield line, offset
+  if buffer.strip():
+    yield buffer, offset + len(buffer)
+
+
+async def ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+  """
+  Splits a stream of body chunks into non-empty lines.
+  """
+  async for line, _ in ndjson_records(chunks):
+    yield line
+
+
+def ndjson_line(document) -> bytes:
+  return encode_json(document) + b"\n"
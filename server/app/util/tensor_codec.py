@@ -0,0 +1,138 @@
+"""
+Binary encodings of tensors for the inference endpoints.
+Tensors are sent either as .npy files (application/x-npy) or as a raw C-ordered buffer
+(application/octet-stream) described by the X-Tensor-Dtype and X-Tensor-Shape headers.
+Several named tensors are sent as .npz archives (application/x-npz).
+"""
+import zipfile
+import io
+import numpy as np
+from fastapi import Request, Response
+from app.util.errors import BadRequestError, NotAcceptableError
+
+MEDIA_TYPE_JSON = "application/json"
+MEDIA_TYPE_NPY = "application/x-npy"
+MEDIA_TYPE_RAW = "application/octet-stream"
+MEDIA_TYPE_NPZ = "application/x-npz"
+BINARY_MEDIA_TYPES = (MEDIA_TYPE_NPY, MEDIA_TYPE_RAW, MEDIA_TYPE_NPZ)
+
+HEADER_DTYPE = "X-Tensor-Dtype"
+HEADER_SHAPE = "X-Tensor-Shape"
+
+
+def media_type(content_type: str | None) -> str:
+  """Strips parameters like the charset from a Content-Type header."""
+  if not content_type:
+    return MEDIA_TYPE_JSON
+  return content_type.split(";")[0].strip().lower()
+
+
+def output_names_param(request: Request) -> list | None:
+  """Parses the comma separated 'outputs' query parameter of requests without a JSON body."""
+  outputs = request.query_params.get("outputs")
+  return [name.strip() for name in outputs.split(",") if name.strip()] if outputs else None
+
+
+def accepted_media_type(accept: str | None) -> str:
+  """Picks the response encoding from an Accept header, JSON unless a binary encoding is requested."""
+  if accept:
+    for candidate in accept.split(","):
+      candidate = media_type(candidate)
+      if candidate in BINARY_MEDIA_TYPES or candidate == MEDIA_TYPE_JSON:
+        return candidate
+  return MEDIA_TYPE_JSON
+
+
+def decode_npy(body: bytes) -> np.ndarray:
+  """Decodes a .npy file without copying its data."""
+  stream = io.BytesIO(body)
+  try:
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+      shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+      shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+  except ValueError as e:
+    raise BadRequestError(f"Invalid .npy body: {str(e)}")
+  if dtype.hasobject:
+    raise BadRequestError("Object arrays are not supported.")
+  offset = stream.tell()
+  count = int(np.prod(shape))
+  if len(body) - offset != count * dtype.itemsize:
+    raise BadRequestError("The .npy body is truncated or has trailing data.")
+  array = np.frombuffer(body, dtype=dtype, count=count, offset=offset)
+  return array.reshape(shape, order="F" if fortran_order else "C")
+
+
+def decode_raw(body: bytes, dtype: str | None, shape: str | None) -> np.ndarray:
+  """Decodes a raw C-ordered buffer described by the dtype and shape headers without copying it."""
+  if not dtype or shape is None:
+    raise BadRequestError(f"Raw tensor bodies require the {HEADER_DTYPE} and {HEADER_SHAPE} headers.")
+  try:
+    dtype = np.dtype(dtype)
+    shape = tuple(int(dim) for dim in shape.split(",") if dim.strip())
+  except (TypeError, ValueError) as e:
+    raise BadRequestError(f"Invalid tensor header: {str(e)}")
+  if dtype.hasobject:
+    raise BadRequestError("Object arrays are not supported.")
+  if len(body) != int(np.prod(shape)) * dtype.itemsize:
+    raise BadRequestError(f"Body of {len(body)} bytes does not match a {dtype} tensor of shape {list(shape)}.")
+  return np.frombuffer(body, dtype=dtype).reshape(shape)
+
+
+def decode_npz(body: bytes) -> dict[str, np.ndarray]:
+  """Decodes a .npz archive into arrays by name."""
+  try:
+    with np.load(io.BytesIO(body), allow_pickle=False) as archive:
+      return {name: archive[name] for name in archive.files}
+  except (ValueError, OSError, zipfile.BadZipFile) as e:
+    raise BadRequestError(f"Invalid .npz body: {str(e)}")
+
+
+def decode_tensor(body: bytes, content_type: str, headers) -> np.ndarray | dict[str, np.ndarray]:
+  """Decodes a binary request body into a NumPy array, or arrays by name for .npz archives."""
+  if content_type == MEDIA_TYPE_NPZ:
+    return decode_npz(body)
+  if content_type == MEDIA_TYPE_NPY:
+    return decode_npy(body)
+  return decode_raw(body, headers.get(HEADER_DTYPE), headers.get(HEADER_SHAPE))
+
+
+def encode_npy(array: np.ndarray) -> bytes:
+  stream = io.BytesIO()
+  np.save(stream, array, allow_pickle=False)
+  return stream.getvalue()
+
+
+def encode_raw(array: np.ndarray) -> tuple[bytes, dict]:
+  array = np.ascontiguousarray(array)
+  headers = {
+    HEADER_DTYPE: array.dtype.str,
+    HEADER_SHAPE: ",".join(str(dim) for dim in array.shape),
+  }
+  return array.tobytes(), headers
+
+
+def encode_npz(arrays: dict[str, np.ndarray]) -> bytes:
+  stream = io.BytesIO()
+  np.savez(stream, allow_pickle=False, **arrays)
+  return stream.getvalue()
+
+
+def tensor_response(results: dict, accept: str) -> Response:
+  """
+  Encodes the inference results by output name in the accepted binary format.
+  .npy and raw buffers hold a single output, .npz archives any number of outputs.
+  """
+  for name, result in results.items():
+    if not isinstance(result, np.ndarray) or result.dtype.hasobject:
+      raise NotAcceptableError(f"Output '{name}' can not be encoded as a binary tensor, request JSON instead.")
+  if accept == MEDIA_TYPE_NPZ:
+    return Response(content=encode_npz(results), media_type=MEDIA_TYPE_NPZ)
+  if len(results) != 1:
+    raise NotAcceptableError(f"Several outputs were requested, accept {MEDIA_TYPE_NPZ} instead.")
+  result = next(iter(results.values()))
+  if accept == MEDIA_TYPE_NPY:
+    return Response(content=encode_npy(result), media_type=MEDIA_TYPE_NPY)
+  content, headers = encode_raw(result)
+  return Response(content=content, media_type=MEDIA_TYPE_RAW, headers=headers)
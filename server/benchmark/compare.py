@@ -0,0 +1,46 @@
+"""
+Compares two benchmark result files scenario by scenario, e.g. of the commits before and after a change:
+  python -m benchmark.compare before.json after.json
+"""
+import argparse
+import json
+
+
+def change(before: float, after: float) -> str:
+  if not before:
+    return "-"
+  return f"{(after - before) / before * 100:+.1f}%"
+
+
+def compare(before: dict, after: dict) -> list[str]:
+  before_results = {result["scenario"]: result for result in before["results"]}
+  lines = [f"{'scenario':<50} {'p50 ms':>18} {'p99 ms':>18} {'req/s':>20} {'peak MB':>18}"]
+  for result in after["results"]:
+    previous = before_results.get(result["scenario"])
+    if previous is None or not previous["latency_ms"] or not result["latency_ms"]:
+      continue
+    columns = []
+    for old, new in (
+      (previous["latency_ms"]["p50"], result["latency_ms"]["p50"]),
+      (previous["latency_ms"]["p99"], result["latency_ms"]["p99"]),
+      (previous["throughput_rps"], result["throughput_rps"]),
+      ((previous.get("memory") or {}).get("rss_peak_mb"), (result.get("memory") or {}).get("rss_peak_mb")),
+    ):
+      columns.append(f"{new} ({change(old, new)})" if new is not None else "-")
+    lines.append(f"{result['scenario']:<50} {columns[0]:>18} {columns[1]:>18} {columns[2]:>20} {columns[3]:>18}")
+  return lines
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Compares two NEXON benchmark result files.")
+  parser.add_argument("before")
+  parser.add_argument("after")
+  args = parser.parse_args()
+  with open(args.before) as before_file, open(args.after) as after_file:
+    before, after = json.load(before_file), json.load(after_file)
+  print(f"{before['meta']['commit']} -> {after['meta']['commit']}")
+  print("\n".join(compare(before, after)))
+
+
+if __name__ == "__main__":
+  main()
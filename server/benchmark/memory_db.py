@@ -0,0 +1,67 @@
+"""
+In-memory stand-in for the DatabaseController, like the MockDBController of the tests,
+so benchmarks measure NEXON itself instead of MongoDB.
+"""
+from types import SimpleNamespace
+from bson import ObjectId
+
+
+class MemoryGridOut:
+  def __init__(self, content: bytes):
+    self.content = content
+
+  async def read(self):
+    return self.content
+
+
+class MemoryDBController:
+  def __init__(self):
+    self.models: dict[str, dict] = {}
+    self.files: dict[str, bytes] = {}
+
+  def debug(self):
+    return "In-memory DB Controller"
+
+  async def find(self, query=None):
+    return [model for model in self.models.values() if self._matches(model, query or {})]
+
+  async def find_and_sort(self, query, sort):
+    models = await self.find(query)
+    for key, direction in reversed(sort):
+      models.sort(key=lambda model: model.get(key), reverse=direction < 0)
+    return models
+
+  async def find_one(self, query, sort=None):
+    models = await (self.find_and_sort(query, sort) if sort else self.find(query))
+    return models[0] if models else None
+
+  async def insert_model(self, model_metadata):
+    model_id = str(ObjectId())
+    self.models[model_id] = {"_id": model_id, **model_metadata.to_dict()}
+    return model_id
+
+  async def update_one(self, query, update):
+    model = await self.find_one(query)
+    if model is None:
+      return SimpleNamespace(matched_count=0, modified_count=0)
+    model.update(update.get("$set", {}))
+    return SimpleNamespace(matched_count=1, modified_count=1)
+
+  async def delete_one(self, query):
+    model = await self.find_one(query)
+    if model is not None:
+      del self.models[str(model["_id"])]
+
+  async def upload_file(self, filename, file, metadata=None):
+    file_id = ObjectId()
+    self.files[str(file_id)] = file if isinstance(file, bytes) else file.read()
+    return file_id
+
+  async def download_file(self, file_id):
+    return MemoryGridOut(self.files[str(file_id)])
+
+  async def delete_file(self, file_id):
+    self.files.pop(str(file_id), None)
+
+  def _matches(self, model: dict, query: dict) -> bool:
+    return all(str(model.get(key)) == str(value) for key, value in query.items())
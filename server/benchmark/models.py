@@ -0,0 +1,67 @@
+"""
+ONNX models of varying size and shape for benchmarks, described by specs:
+- linear-<features>: a scikit-learn LinearRegression converted with skl2onnx, as in mlflow_experiments/generate_onnx_model.py
+- mlp-<features>x<hidden>x<layers>: a ReLU multi-layer perceptron with random weights, built with onnx.helper
+"""
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+
+def linear_model(features: int) -> bytes:
+  try:
+    from sklearn.datasets import make_regression
+    from sklearn.linear_model import LinearRegression
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import FloatTensorType
+  except ImportError as e:
+    raise RuntimeError(f"linear models require scikit-learn and skl2onnx (pip install -r benchmark/requirements.txt): {e}")
+  X, y = make_regression(n_samples=100, n_features=features, random_state=42)
+  model = LinearRegression().fit(X, y)
+  onnx_model = convert_sklearn(model, initial_types=[("input", FloatTensorType([None, features]))])
+  return onnx_model.SerializeToString()
+
+
+def mlp_model(features: int, hidden: int, layers: int, seed: int = 42) -> bytes:
+  rng = np.random.default_rng(seed)
+  nodes = []
+  initializers = []
+  previous, width = "input", features
+  for layer in range(layers):
+    last = layer == layers - 1
+    out_width = 1 if last else hidden
+    weight = (rng.standard_normal((width, out_width)) / np.sqrt(width)).astype(np.float32)
+    initializers += [numpy_helper.from_array(weight, f"w{layer}"), numpy_helper.from_array(np.zeros(out_width, dtype=np.float32), f"b{layer}")]
+    output = "variable" if last else f"gemm{layer}"
+    nodes.append(helper.make_node("Gemm", [previous, f"w{layer}", f"b{layer}"], [output]))
+    if not last:
+      nodes.append(helper.make_node("Relu", [output], [f"relu{layer}"]))
+      output = f"relu{layer}"
+    previous, width = output, out_width
+  graph = helper.make_graph(
+    nodes,
+    f"mlp_{features}x{hidden}x{layers}",
+    [helper.make_tensor_value_info("input", TensorProto.FLOAT, [None, features])],
+    [helper.make_tensor_value_info("variable", TensorProto.FLOAT, [None, 1])],
+    initializers,
+  )
+  model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+  model.ir_version = 8
+  onnx.checker.check_model(model)
+  return model.SerializeToString()
+
+
+def build_model(spec: str) -> tuple[bytes, int]:
+  """
+  Builds the model described by spec and returns it with its number of input features.
+  """
+  kind, _, shape = spec.partition("-")
+  try:
+    dims = [int(dim) for dim in shape.split("x")]
+  except ValueError:
+    dims = []
+  if kind == "linear" and len(dims) == 1:
+    return linear_model(dims[0]), dims[0]
+  if kind == "mlp" and len(dims) == 3:
+    return mlp_model(*dims), dims[0]
+  raise ValueError(f"Invalid model spec '{spec}', expected linear-<features> or mlp-<features>x<hidden>x<layers>")
@@ -0,0 +1,305 @@
+"""
+End-to-end benchmark of the inference API, reporting latency percentiles, throughput and memory as JSON.
+
+Generated models under increasing concurrency, against the app in-process with an in-memory database:
+  python -m benchmark.run --models linear-10,mlp-64x256x2,mlp-512x2048x4 --concurrency 1,8,32 --requests 2000 --output before.json
+
+Replay of captured traffic against real model files, or against a running server with --url:
+  python -m benchmark.run --model-file ticket_assignment=model.onnx --replay traffic.jsonl --concurrency 16
+  python -m benchmark.run --url http://localhost:8000 --replay traffic.jsonl
+
+Replay files have one request per line, {"path": "/inference/infer/<model>[/<version>]", "body": {...}}
+or {"model": "<model>", "version": 1, "body": {...}}. Results of two runs are compared with benchmark.compare.
+Run from the server directory, e.g. with NEXON_INFERENCE_THREADS or other settings exported as for the server.
+"""
+from datetime import datetime
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+import onnxruntime as ort
+import psutil
+
+MEMORY_SAMPLE_INTERVAL = 0.05
+
+
+class MemorySampler():
+  """
+  Samples the resident memory of the process while a scenario runs. Only meaningful for in-process runs.
+  """
+  def __init__(self, interval: float = MEMORY_SAMPLE_INTERVAL):
+    self.interval = interval
+    self.process = psutil.Process()
+    self.start_rss = self.peak_rss = 0
+    self.task: asyncio.Task = None
+
+  async def __aenter__(self):
+    self.start_rss = self.peak_rss = self.process.memory_info().rss
+    self.task = asyncio.create_task(self._sample())
+    return self
+
+  async def __aexit__(self, *exc_info):
+    self.task.cancel()
+    self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+  async def _sample(self):
+    while True:
+      self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+      await asyncio.sleep(self.interval)
+
+  def stats(self) -> dict:
+    end_rss = self.process.memory_info().rss
+    return {
+      "rss_start_mb": round(self.start_rss / 2**20, 1),
+      "rss_peak_mb": round(self.peak_rss / 2**20, 1),
+      "rss_end_mb": round(end_rss / 2**20, 1),
+    }
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+  latencies_ms = np.array(latencies) * 1000
+  completed = len(latencies)
+  return {
+    "requests": completed,
+    "errors": errors,
+    "duration_s": round(elapsed, 3),
+    "throughput_rps": round(completed / elapsed, 1) if elapsed else 0.0,
+    "latency_ms": {
+      "p50": round(float(np.percentile(latencies_ms, 50)), 3),
+      "p95": round(float(np.percentile(latencies_ms, 95)), 3),
+      "p99": round(float(np.percentile(latencies_ms, 99)), 3),
+      "mean": round(float(latencies_ms.mean()), 3),
+      "max": round(float(latencies_ms.max()), 3),
+    } if completed else None,
+  }
+
+
+async def drive(client, requests: list[tuple[str, dict]], total: int, concurrency: int) -> dict:
+  """
+  Sends total requests, cycling through the given (path, body) pairs, from concurrency closed-loop clients.
+  """
+  latencies = []
+  errors = 0
+  sent = 0
+  first_error = None
+
+  async def worker():
+    nonlocal sent, errors, first_error
+    while sent < total:
+      path, body = requests[sent % len(requests)]
+      sent += 1
+      start = time.perf_counter()
+      try:
+        response = await client.post(path, json=body)
+        failed = response.status_code != 200
+        if failed and first_error is None:
+          first_error = f"{response.status_code}: {response.text[:200]}"
+      except Exception as e:
+        failed = True
+        first_error = first_error or str(e)
+      if failed:
+        errors += 1
+      else:
+        latencies.append(time.perf_counter() - start)
+
+  start = time.perf_counter()
+  await asyncio.gather(*(worker() for _ in range(concurrency)))
+  summary = summarize(latencies, errors, time.perf_counter() - start)
+  if first_error is not None:
+    summary["first_error"] = first_error
+  return summary
+
+
+def random_bodies(features: int, batch: int, count: int, seed: int = 0) -> list[dict]:
+  rng = np.random.default_rng(seed)
+  return [{"input": rng.standard_normal((batch, features)).astype(np.float32).tolist()} for _ in range(count)]
+
+
+def read_replay(path: str) -> list[tuple[str, dict]]:
+  requests = []
+  with open(path) as replay_file:
+    for line in replay_file:
+      if not line.strip():
+        continue
+      entry = json.loads(line)
+      request_path = entry.get("path")
+      if request_path is None:
+        request_path = f"/inference/infer/{entry['model']}" + (f"/{entry['version']}" if entry.get("version") is not None else "")
+      requests.append((request_path, entry["body"]))
+  if not requests:
+    raise ValueError(f"No requests in {path}")
+  return requests
+
+
+async def seed_models(db_controller, models: dict[str, bytes]) -> list[str]:
+  """
+  Stores the given models by name as deployed version 1, like an upload followed by a deployment.
+  """
+  from app.controller.database import ModelMetadata
+  from app.util.constants import STATUS_DEPLOYED
+  from app.util.file_utils import convert_size
+  from app.util.model_signature import read_signature
+
+  model_ids = []
+  for name, model_bytes in models.items():
+    file_id = await db_controller.upload_file(f"{name}.onnx", io.BytesIO(model_bytes))
+    model_ids.append(await db_controller.insert_model(ModelMetadata(
+      file_id=str(file_id), name=name, version=1, size=convert_size(len(model_bytes)), status=STATUS_DEPLOYED,
+      signature=read_signature(io.BytesIO(model_bytes)),
+    )))
+  return model_ids
+
+
+async def remove_models(db_controller, model_ids: list[str]):
+  """
+  Deletes the seeded models and drops their routes and sessions, like an undeployment followed by a deletion.
+  """
+  from bson import ObjectId
+  from app.controller.routing_table import routing_table
+  from app.controller.session_cache import session_cache
+  for model_id in model_ids:
+    model = await db_controller.find_one({"_id": ObjectId(model_id)})
+    if model is not None:
+      routing_table.remove(model_id)
+      session_cache.invalidate(model["file_id"])
+      await db_controller.delete_file(ObjectId(model["file_id"]))
+      await db_controller.delete_one({"_id": model["_id"]})
+
+
+def metadata(args) -> dict:
+  try:
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip())
+  except (OSError, subprocess.CalledProcessError):
+    commit, dirty = None, None
+  return {
+    "commit": commit,
+    "dirty": dirty,
+    "timestamp": datetime.now().isoformat(timespec="seconds"),
+    "python": platform.python_version(),
+    "onnxruntime": ort.__version__,
+    "platform": platform.platform(),
+    "cpu_count": os.cpu_count(),
+    "settings": {key: value for key, value in os.environ.items() if key.startswith("NEXON_") and "MONGO" not in key and "TOKEN" not in key},
+    "args": vars(args),
+  }
+
+
+async def run_benchmark(args) -> dict:
+  import httpx
+
+  concurrency_levels = [int(level) for level in str(args.concurrency).split(",")]
+  specs = [spec for spec in args.models.split(",") if spec] if args.models else []
+  model_files = dict(model_file.split("=", 1) for model_file in args.model_file)
+  replay = read_replay(args.replay) if args.replay else None
+
+  db_controller = None
+  model_ids = []
+  generated = {}
+  if args.url:
+    client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+  else:
+    if args.database == "memory":
+      # The database module reads its connection settings on import
+      for key in ("NEXON_MONGO_USER", "NEXON_MONGO_PASS", "NEXON_MONGO_HOST", "NEXON_MONGO_PORT", "NEXON_MONGO_DB"):
+        os.environ.setdefault(key, "benchmark")
+    from fastapi import FastAPI
+    from app.api.inference import app as inference_app
+    from app.controller.database import close_mongo_connection, connect_to_mongo, get_db_controller
+    from benchmark.memory_db import MemoryDBController
+    from benchmark.models import build_model
+
+    if args.database == "mongo":
+      await connect_to_mongo()
+      db_controller = get_db_controller()
+    else:
+      db_controller = MemoryDBController()
+      inference_app.dependency_overrides[get_db_controller] = lambda: db_controller
+
+    generated = {spec: build_model(spec) for spec in specs}
+    models = {f"bench-{spec}": model_bytes for spec, (model_bytes, _) in generated.items()}
+    for name, path in model_files.items():
+      with open(path, "rb") as model_file:
+        models[name] = model_file.read()
+    model_ids = await seed_models(db_controller, models)
+
+    root = FastAPI()
+    root.mount("/inference", inference_app)
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=root), base_url="http://benchmark", timeout=args.timeout)
+
+  scenarios = []
+  for spec, (_, features) in generated.items():
+    path = f"/inference/infer/bench-{spec}"
+    for rows in [int(batch) for batch in str(args.batch).split(",")]:
+      scenarios.append((f"{spec} batch={rows}", [(path, body) for body in random_bodies(features, rows, args.distinct_inputs)], {"model": spec, "batch": rows}))
+  if replay is not None:
+    scenarios.append((f"replay {os.path.basename(args.replay)}", replay, {"replay": args.replay}))
+
+  results = []
+  try:
+    async with client:
+      for name, requests, details in scenarios:
+        # Loads and warms up the sessions outside of the measurement
+        await drive(client, requests, min(len(requests), args.warmup) or 1, 1)
+        for concurrency in concurrency_levels:
+          async with MemorySampler() as sampler:
+            summary = await drive(client, requests, args.requests or len(requests), concurrency)
+          result = {"scenario": f"{name} concurrency={concurrency}", **details, "concurrency": concurrency, **summary}
+          if not args.url:
+            result["memory"] = sampler.stats()
+          results.append(result)
+          print(format_result(result), file=sys.stderr)
+  finally:
+    if db_controller is not None:
+      await remove_models(db_controller, model_ids)
+      if args.database == "mongo":
+        await close_mongo_connection()
+
+  return {"meta": metadata(args), "results": results}
+
+
+def format_result(result: dict) -> str:
+  latency = result["latency_ms"] or {}
+  return (f"{result['scenario']:<50} {result['throughput_rps']:>10} req/s  "
+          f"p50 {latency.get('p50', '-'):>9} ms  p95 {latency.get('p95', '-'):>9} ms  p99 {latency.get('p99', '-'):>9} ms  "
+          f"errors {result['errors']}")
+
+
+def parse_args(argv: list[str] = None):
+  parser = argparse.ArgumentParser(description="Benchmarks the NEXON inference API.")
+  parser.add_argument("--models", default="linear-10,mlp-64x256x2,mlp-512x2048x4", help="Comma separated specs of generated models: linear-<features> or mlp-<features>x<hidden>x<layers>. Empty to only replay.")
+  parser.add_argument("--model-file", action="append", default=[], metavar="NAME=PATH", help="Deploys an ONNX file under the given name, e.g. for replays. Can be repeated.")
+  parser.add_argument("--replay", help="JSONL file of captured requests to replay.")
+  parser.add_argument("--concurrency", default="1,8,32", help="Comma separated numbers of concurrent clients.")
+  parser.add_argument("--requests", type=int, default=1000, help="Requests per scenario and concurrency level. 0 replays each captured request once.")
+  parser.add_argument("--batch", default="1", help="Comma separated numbers of rows per generated request.")
+  parser.add_argument("--distinct-inputs", type=int, default=64, help="Distinct random inputs per generated scenario.")
+  parser.add_argument("--warmup", type=int, default=20, help="Requests sent before each scenario.")
+  parser.add_argument("--database", choices=["memory", "mongo"], default="memory", help="In-memory stand-in or the MongoDB configured by NEXON_MONGO_*.")
+  parser.add_argument("--url", help="Base URL of a running server to benchmark instead of the in-process app. Models must be deployed there.")
+  parser.add_argument("--timeout", type=float, default=60.0, help="Request timeout in seconds.")
+  parser.add_argument("--output", help="File to write the JSON results to, printed to stdout otherwise.")
+  return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None):
+  args = parse_args(argv)
+  if args.url:
+    args.models = ""
+  report = asyncio.run(run_benchmark(args))
+  output = json.dumps(report, indent=2)
+  if args.output:
+    with open(args.output, "w") as output_file:
+      output_file.write(output + "\n")
+  else:
+    print(output)
+
+
+if __name__ == "__main__":
+  main()
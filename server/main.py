@@ -1,5 +1,7 @@
+import asyncio
 from dotenv import load_dotenv
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from app.api.inference import app as inference_app
@@ -7,7 +9,16 @@ from app.api.deployment import app as deployment_app
 from app.api.upload import app as upload_app
 from app.api.models import app as model_app
 from app.api.mlflow_api import app as mlflow_app
-from app.controller.database import close_mongo_connection, connect_to_mongo
+from app.api.jobs import app as jobs_app
+from app.api.profiles import app as profiles_app
+from app.controller.database import close_mongo_connection, connect_to_mongo, get_db_controller
+from app.controller.inference_executor import inference_executor
+from app.controller.job_controller import job_runner
+from app.controller.warmup_controller import WarmupController
+from app.controller.routing_table import routing_table
+from app.controller.session_cache import session_cache
+from app.controller.worker_pool import worker_pool
+from app.util.metrics import METRICS_MEDIA_TYPE, registry
 import os 
 
 # Load environment variables from .env
@@ -17,18 +28,41 @@ load_dotenv()
 async def lifespan(app: FastAPI):
     # Connect to MongoDB when the app starts
     await connect_to_mongo()
+    # Start the inference worker processes, if enabled
+    if worker_pool.enabled:
+      worker_pool.start()
+      session_cache.add_invalidation_listener(worker_pool.invalidate)
+    # Load and warm up all deployed models without delaying the start
+    warmup_controller = WarmupController(get_db_controller())
+    warmup_task = asyncio.create_task(warmup_controller.warm_up_deployed())
+    # Warm up models routed later, e.g. deployed through another server instance
+    routing_table.add_route_listener(warmup_controller.schedule)
+    # Resume batch inference jobs interrupted by the last shutdown
+    await job_runner.start(get_db_controller())
     yield
+    warmup_task.cancel()
+    await job_runner.stop()
     # Close MongoDB connection when the app stops
     await close_mongo_connection()
+    # Stop the inference threads and worker processes
+    inference_executor.shutdown()
+    await worker_pool.stop()
 
 # Create the main FastAPI app
 app = FastAPI(lifespan=lifespan)
 
+# Prometheus metrics, registered before the mounts as the models API mounted at "/" would shadow it
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type=METRICS_MEDIA_TYPE)
+
 # Mount the inference API to the main app (if modularized)
 app.mount("/inference", inference_app)
 app.mount("/deployment", deployment_app)
 app.mount("/upload", upload_app)
 app.mount("/api/mlflow", mlflow_app)
+app.mount("/jobs", jobs_app)
+app.mount("/profiles", profiles_app)
 app.mount("/", model_app)
 
 # Add CORS middleware